@@ -1,9 +1,18 @@
 from fastapi import FastAPI, HTTPException, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import sqlite3
 from typing import List, Optional
 from pydantic import BaseModel, Field
 from datetime import datetime
+import time
+import json
+import os
+from spider import heartbeat, queries
+from spider.db_writer import connect, open_writer
+from api.precompute import MaterializedResponses
+from api.replica import ReadReplica
+from api.singleflight import SingleFlight
 
 app = FastAPI(title="B站商城API")
 
@@ -14,37 +23,65 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Replica-Age", "X-Materialized-Age"],
 )
 
 # 数据库连接
 DATABASE_URL = "./db/bilibili_mall.db"
 
 def get_db():
-    conn = sqlite3.connect(DATABASE_URL)
+    conn = connect(DATABASE_URL)
     conn.row_factory = sqlite3.Row
     return conn
 
-# 在初始化数据库连接后添加黑名单表创建代码
-def init_db():
-    conn = sqlite3.connect(DATABASE_URL)
+# 只读副本：配置了 BMALL_READ_REPLICA_INTERVAL（秒）时，统计类接口读定期刷新的副本，不与爬虫争用主库
+READ_REPLICA_INTERVAL = int(os.environ.get('BMALL_READ_REPLICA_INTERVAL', '0'))
+replica = None
+
+# 合并并发的相同请求：相同参数的请求同时到达时只查询一次，等待超过 SINGLE_FLIGHT_TIMEOUT 秒返回 504
+SINGLE_FLIGHT_TIMEOUT = 30
+single_flight = SingleFlight()
+
+# 物化响应：统计类接口由后台任务预计算，请求直接返回最近一次的结果
+materialized = MaterializedResponses(DATABASE_URL, os.path.join(os.path.dirname(DATABASE_URL), 'materialized'),
+                                     single_flight=single_flight)
+
+@app.on_event("startup")
+async def start_background():
+    global replica
+    if READ_REPLICA_INTERVAL > 0:
+        replica = ReadReplica(DATABASE_URL, os.path.splitext(DATABASE_URL)[0] + '.replica.db', READ_REPLICA_INTERVAL)
+        replica.start()
+    materialized.start(replica)
+
+@app.on_event("shutdown")
+async def stop_background():
+    await materialized.stop()
+    if replica is not None:
+        replica.stop()
+
+def get_read_db(response: Response):
+    """统计类接口的读连接：副本可用时读副本，并在响应头 X-Replica-Age 中返回副本落后主库的秒数"""
+    conn = replica.connect() if replica is not None else None
+    if conn is None:
+        return get_db()
+    response.headers["X-Replica-Age"] = f"{replica.age():.1f}"
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # 创建黑名单表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS blacklist (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        uid TEXT NOT NULL,
-        uname TEXT NOT NULL,
-        reason TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        UNIQUE(uid)
-    )
-    ''')
-    
-    conn.commit()
     return conn
 
+# 写入端：配置了 BMALL_WRITER_SOCKET 时交给写服务，否则由本进程的写线程写入
+writer = None
+
+def get_writer():
+    global writer
+    if writer is None:
+        writer = open_writer(path=DATABASE_URL)
+    return writer
+
+async def write(statements):
+    """提交写任务并等待提交完成，不阻塞事件循环，并发请求的写入合并到同一个事务中"""
+    return await asyncio.wrap_future(get_writer().submit(statements))
+
 # 模型定义
 class SkuInfo(BaseModel):
     sku_id: int
@@ -66,6 +103,7 @@ class ItemDetail(BaseModel):
     publish_status: int
     created_at: datetime
     is_blacklisted: bool
+    relist_count: int = 0
 
 class SkuListResponse(BaseModel):
     items: List[SkuInfo]
@@ -85,17 +123,7 @@ async def get_brands():
         conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            SELECT 
-                b.id,
-                b.name,
-                COUNT(DISTINCT s.sku_id) as total_items
-            FROM brands b
-            LEFT JOIN c2c_items c ON b.id = c.brand_id
-            LEFT JOIN skus s ON s.sku_id = c.sku_id
-            GROUP BY b.id, b.name
-            ORDER BY total_items DESC
-        """)
+        cursor.execute(queries.BRANDS)
         
         return [dict(row) for row in cursor.fetchall()]
     finally:
@@ -103,6 +131,7 @@ async def get_brands():
 
 @app.get("/api/skus", response_model=SkuListResponse)
 async def get_skus(
+    response: Response,
     page: int = 1, 
     page_size: int = 20, 
     brand_id: Optional[int] = None, 
@@ -110,79 +139,41 @@ async def get_skus(
     sort_by: Optional[str] = None,
     sort_order: Optional[str] = "desc"
 ):
+    """获取SKU列表（合并并发的相同请求）"""
+    params = {
+        "page": page,
+        "page_size": page_size,
+        "brand_id": brand_id,
+        "keyword": keyword or None,  # 空关键词与不搜索相同
+        "sort_by": sort_by,
+        "sort_order": sort_order.lower() if sort_order else sort_order
+    }
+    return await single_flight.do('skus', params, compute_skus, response, timeout=SINGLE_FLIGHT_TIMEOUT)
+
+def compute_skus(response: Response, page, page_size, brand_id, keyword, sort_by, sort_order):
     """获取SKU列表"""
     try:
         conn = get_db()
         cursor = conn.cursor()
         
         # 构建查询条件
-        params = []
-        brand_filter = ""
-        if brand_id is not None:
-            brand_filter = "AND i.brand_id = ?"
-            params.append(brand_id)
-        
-        # 添加搜索参数
         search_term = f"%{keyword}%" if keyword else None
-        params.extend([search_term, search_term])  # 两次，因为有两个查询都用到了
+        params = {
+            "brand_id": brand_id,
+            "search": search_term,
+            "limit": page_size,
+            "offset": (page - 1) * page_size,
+        }
+        brand_filter = "AND i.brand_id = :brand_id" if brand_id is not None else ""
         
         # 构建排序条件
-        order_clause = "s.sku_id DESC"
-        if sort_by:
+        order_clause = "latest_id DESC"
+        if sort_by in ("min_price", "total_items"):
             order_direction = "DESC" if sort_order.lower() == "desc" else "ASC"
-            if sort_by == "min_price":
-                order_clause = f"min_price {order_direction}"
-            elif sort_by == "total_items":
-                order_clause = f"total_items {order_direction}"
+            order_clause = f"{sort_by} {order_direction}"
         
         # 主查询
-        query = f"""
-            WITH filtered_items AS (
-                SELECT 
-                    i.sku_id,
-                    i.price,
-                    i.id
-                FROM c2c_items i
-                WHERE 1=1
-                {brand_filter}
-            ),
-            sku_stats AS (
-                SELECT 
-                    s.sku_id,
-                    s.name,
-                    s.img,
-                    s.market_price,
-                    MIN(fi.price) as min_price,
-                    MAX(fi.price) as max_price,
-                    COUNT(fi.id) as total_items,
-                    MAX(fi.id) as latest_id
-                FROM skus s
-                JOIN filtered_items fi ON fi.sku_id = s.sku_id
-                WHERE 1=1
-                AND (? IS NULL OR s.name LIKE ?)
-                GROUP BY s.sku_id, s.name, s.img, s.market_price
-            )
-            SELECT 
-                sku_id,
-                name,
-                img,
-                market_price,
-                min_price,
-                max_price,
-                total_items
-            FROM sku_stats
-            WHERE total_items > 0
-            ORDER BY {
-                'latest_id DESC' if not sort_by
-                else f"total_items {order_direction}" if sort_by == 'total_items'
-                else f"min_price {order_direction}" if sort_by == 'min_price'
-                else 'latest_id DESC'
-            }
-            LIMIT ? OFFSET ?
-        """
-        
-        # 添加分页参数
-        params.extend([page_size, (page - 1) * page_size])
+        query = queries.SKUS.format(brand_filter=brand_filter, order=order_clause)
         
         # 执行查询
         cursor.execute(query, params)
@@ -200,8 +191,9 @@ async def get_skus(
                 "img": img_url,
                 "market_price": row['market_price'],
                 "price_range": {
-                    "min": row['min_price'],
-                    "max": row['max_price']
+                    # 生成列经排序后整数值的 REAL 会以 int 返回，统一转为 float
+                    "min": float(row['min_price']),
+                    "max": float(row['max_price'])
                 },
                 "total_items": row['total_items']
             })
@@ -217,29 +209,18 @@ async def get_skus(
         conn.close()
 
 @app.get("/api/sku/{sku_id}/items", response_model=List[ItemDetail])
-async def get_sku_items(sku_id: int):
+async def get_sku_items(sku_id: int, response: Response):
+    """获取指定SKU的所有在售商品（合并并发的相同请求）"""
+    return await single_flight.do('sku-items', {"sku_id": sku_id}, compute_sku_items, response,
+                                  timeout=SINGLE_FLIGHT_TIMEOUT)
+
+def compute_sku_items(response: Response, sku_id):
     """获取指定SKU的所有在售商品"""
     try:
         conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            SELECT 
-                i.id as c2c_items_id,
-                i.uname as seller_name,
-                i.uid as seller_uid,
-                i.uface as seller_avatar,
-                i.uspace_jump_url as seller_url,
-                i.price,
-                s.market_price,
-                i.publish_status,
-                i.created_at,
-                i.is_blacklisted
-            FROM c2c_items i
-            JOIN skus s ON i.sku_id = s.sku_id
-            WHERE i.sku_id = ?
-            ORDER BY i.price ASC
-        """, (sku_id,))
+        cursor.execute(queries.SKU_ITEMS, {"sku_id": sku_id})
         
         results = []
         base_url = "https://mall.bilibili.com/neul-next/index.html?page=magic-market_detail&noTitleBar=1&itemsId="
@@ -271,10 +252,11 @@ async def get_sku_items(sku_id: int):
                 "seller_url": seller_url,
                 "price": row['price'],
                 "market_price": row['market_price'],
-                "url": f"{base_url}{row['c2c_items_id']}",
+                "url": f"{base_url}{row['listing_id']}",
                 "publish_status": row['publish_status'],
                 "created_at": row['created_at'],
-                "is_blacklisted": row['is_blacklisted']
+                "is_blacklisted": row['is_blacklisted'],
+                "relist_count": row['relist_count']
             })
         
         return results
@@ -285,227 +267,152 @@ async def get_sku_items(sku_id: int):
 async def batch_delete_products(request: BatchDeleteRequest):
     """批量删除商品及其关联的SKU"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            # 开启事务
-            cursor.execute("BEGIN TRANSACTION")
-            
-            for product_id in request.productIds:
-                # 1. 删除关联的SKU
-                cursor.execute("""
-                    DELETE FROM c2c_items 
+        statements = []
+        for product_id in request.productIds:
+            # 1. 删除关联的SKU（包括已归档的商品）
+            for table in ('c2c_items', 'c2c_items_archive'):
+                statements.append((f"""
+                    DELETE FROM {table} 
                     WHERE sku_id IN (
                         SELECT sku_id 
                         FROM skus 
                         WHERE sku_id = ?
                     )
-                """, (product_id,))
-                
-                # 2. 删除商品SKU
-                cursor.execute("""
-                    DELETE FROM skus 
-                    WHERE sku_id = ?
-                """, (product_id,))
-            
-            # 提交事务
-            cursor.execute("COMMIT")
-            
-            return {
-                "success": True,
-                "message": "删除成功"
-            }
+                """, (product_id,)))
+        
+            # 2. 删除商品SKU
+            statements.append(("""
+                DELETE FROM skus 
+                WHERE sku_id = ?
+            """, (product_id,)))
             
-        except Exception as e:
-            # 如果出错，回滚事务
-            cursor.execute("ROLLBACK")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=str(e)
-            )
+        # 所有删除在同一个事务中执行，出错时全部回滚
+        await write(statements)
+                
+        return {
+            "success": True,
+            "message": "删除成功"
+        }
             
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
-    finally:
-        conn.close()
 
 @app.delete("/api/products/{product_id}/skus")
 async def delete_product_skus(product_id: int):
     """删除指定商品的所有SKU"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        # 删除关联的SKU（包括已归档的商品）
+        await write([
+            (queries.DELETE_SKU_ITEMS.format(table=table), {"sku_id": product_id})
+            for table in ('c2c_items', 'c2c_items_archive')
+        ])
         
-        try:
-            # 开启事务
-            cursor.execute("BEGIN TRANSACTION")
-            
-            # 删除关联的SKU
-            cursor.execute("""
-                DELETE FROM c2c_items 
-                WHERE sku_id = ?
-            """, (product_id,))
-            
-            # 提交事务
-            cursor.execute("COMMIT")
-            
-            return {
-                "success": True,
-                "message": "SKU删除成功"
-            }
-            
-        except Exception as e:
-            # 如果出错，回滚事务
-            cursor.execute("ROLLBACK")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=str(e)
-            )
+        return {
+            "success": True,
+            "message": "SKU删除成功"
+        }
             
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
-    finally:
-        conn.close()
 
 @app.post("/api/brands")
 async def create_brand(brand: dict):
     """创建新品牌"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
+        # 插入新品牌
+        await write([("""
+            INSERT INTO brands (name)
+            VALUES (?)
+        """, (brand['name'],))])
         
-        try:
-            cursor.execute("BEGIN TRANSACTION")
-            
-            # 插入新品牌
-            cursor.execute("""
-                INSERT INTO brands (name)
-                VALUES (?)
-            """, (brand['name'],))
-            
-            cursor.execute("COMMIT")
-            
-            return {
-                "success": True,
-                "message": "品牌添加成功"
-            }
-            
-        except Exception as e:
-            cursor.execute("ROLLBACK")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=str(e)
-            )
+        return {
+            "success": True,
+            "message": "品牌添加成功"
+        }
             
-    finally:
-        conn.close()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
 
 @app.delete("/api/brands/{brand_id}")
 async def delete_brand(brand_id: int):
     """删除品牌"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("BEGIN TRANSACTION")
-            
-            # 检查是否有关联的商品
-            cursor.execute("""
-                SELECT COUNT(*) as count
-                FROM skus s
-                JOIN c2c_items c ON s.sku_id = c.sku_id
-                WHERE c.brand_id = ?
-            """, (brand_id,))
-            
-            if cursor.fetchone()['count'] > 0:
-                cursor.execute("ROLLBACK")
-                return {
-                    "success": False,
-                    "message": "该品牌下还有商品，不能删除"
-                }
+        # 检查和删除在同一条语句中完成，避免检查后又有新商品关联到该品牌
+        results = await write([("""
+            DELETE FROM brands
+            WHERE id = ?
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM skus s
+                  JOIN c2c_items_history c ON s.sku_id = c.sku_id
+                  WHERE c.brand_id = ?
+              )
+        """, (brand_id, brand_id))])
+        
+        if results[0]['rowcount'] == 0:
+            # 未删除：品牌下还有商品，或品牌不存在
+            conn = get_db()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1 FROM brands WHERE id = ?", (brand_id,))
+                if cursor.fetchone():
+                    return {
+                        "success": False,
+                        "message": "该品牌下还有商品，不能删除"
+                    }
+            finally:
+                conn.close()
             
-            # 删除品牌
-            cursor.execute("""
-                DELETE FROM brands
-                WHERE id = ?
-            """, (brand_id,))
-            
-            cursor.execute("COMMIT")
-            
-            return {
-                "success": True,
-                "message": "品牌删除成功"
-            }
-            
-        except Exception as e:
-            cursor.execute("ROLLBACK")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=str(e)
-            )
+        return {
+            "success": True,
+            "message": "品牌删除成功"
+        }
             
-    finally:
-        conn.close()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
 
 @app.get("/api/status-changes")
 async def get_status_changes(page: int = 1, page_size: int = 20, status: str = 'all'):
-    """获取最近状态发生变更的商品"""
+    """获取最近状态发生变更的商品（来自状态变更事件）"""
     try:
         conn = get_db()
         cursor = conn.cursor()
         
         # 构建状态过滤条件
-        status_condition = "AND c.publish_status != 1"  # 默认排除在售商品
+        status_condition = "AND e.new_status != 1"  # 默认排除重新上架事件
         if status == 'sold':
-            status_condition = "AND c.publish_status = -2"
+            status_condition = "AND e.new_status = -2"
         elif status == 'offline':
-            status_condition = "AND c.publish_status = -1"
+            status_condition = "AND e.new_status = -1"
         
-        # 获取过滤后的总记录数
-        cursor.execute(f"""
-            WITH filtered_items AS (
-                SELECT DISTINCT c.id
-                FROM c2c_items c
-                JOIN skus s ON c.sku_id = s.sku_id
-                WHERE c.last_check_time >= datetime('now', '-24 hours')
-                {status_condition}
-            )
-            SELECT COUNT(*) as total FROM filtered_items
-        """)
+        since = int((time.time() - 24 * 3600) * 1000)
+        
+        # 获取过滤后的总记录数（每个商品只计最近一次变更）
+        cursor.execute(queries.STATUS_CHANGES_COUNT.format(status_condition=status_condition), {"since_24h": since})
         total = cursor.fetchone()['total']
         
         # 计算分页
         offset = (page - 1) * page_size
         
         # 获取分页数据，添加用户信息
-        cursor.execute(f"""
-            SELECT DISTINCT
-                c.id,
-                s.sku_id,
-                s.name,
-                s.img,
-                c.price,
-                c.publish_status,
-                datetime(c.last_check_time, '+8 hours') as last_check_time,
-                c.uname as seller_name,
-                c.uid as seller_uid,
-                c.uspace_jump_url as seller_url
-            FROM c2c_items c
-            JOIN skus s ON c.sku_id = s.sku_id
-            WHERE c.last_check_time >= datetime('now', '-24 hours')
-            {status_condition}
-            ORDER BY c.last_check_time DESC
-            LIMIT ? OFFSET ?
-        """, (page_size, offset))
-        
+        cursor.execute(queries.STATUS_CHANGES.format(status_condition=status_condition), {
+            "since_24h": since,
+            "limit": page_size,
+            "offset": offset
+        })
+
         results = []
         for row in cursor.fetchall():
             img_url = row['img']
@@ -560,18 +467,7 @@ async def get_blacklist(page: int = 1, page_size: int = 20):
         offset = (page - 1) * page_size
         
         # 获取分页数据
-        cursor.execute("""
-            SELECT 
-                b.*,
-                (
-                    SELECT COUNT(DISTINCT c.id)
-                    FROM c2c_items c
-                    WHERE c.uid = b.uid
-                ) as total_items
-            FROM blacklist b
-            ORDER BY b.created_at DESC
-            LIMIT ? OFFSET ?
-        """, (page_size, offset))
+        cursor.execute(queries.BLACKLIST, {"limit": page_size, "offset": offset})
         
         results = []
         for row in cursor.fetchall():
@@ -595,88 +491,20 @@ async def get_blacklist(page: int = 1, page_size: int = 20):
         conn.close()
 
 @app.get("/api/suspicious-users")
-async def get_suspicious_users():
+async def get_suspicious_users(response: Response):
+    """获取可疑用户列表（后台预计算）"""
+    return await materialized.serve('suspicious-users', response)
+
+def compute_suspicious_users(response: Response):
     """获取可疑用户列表
     1. 1小时内对同一商品上架超过20次的用户
     2. 1小时内对3个以上SKU上架超过10次的用户
     """
     try:
-        conn = get_db()
+        conn = get_read_db(response)
         cursor = conn.cursor()
         
-        cursor.execute("""
-            WITH single_sku_stats AS (
-                SELECT 
-                    c.uid,
-                    c.uname,
-                    c.sku_id,
-                    COUNT(*) as listing_count,
-                    MIN(c.created_at) as first_listing,
-                    MAX(c.created_at) as last_listing
-                FROM c2c_items c
-                WHERE c.created_at >= datetime('now', '-1 hour')
-                GROUP BY c.uid, c.uname, c.sku_id
-                HAVING listing_count >= 20
-            ),
-            multi_sku_stats AS (
-                SELECT 
-                    c.uid,
-                    c.uname,
-                    COUNT(DISTINCT c.sku_id) as sku_count,
-                    MIN(c.created_at) as first_listing,
-                    MAX(c.created_at) as last_listing
-                FROM c2c_items c
-                WHERE c.created_at >= datetime('now', '-1 hour')
-                GROUP BY c.uid, c.uname
-                HAVING sku_count >= 3
-                AND (
-                    SELECT COUNT(*)
-                    FROM c2c_items c2
-                    WHERE c2.uid = c.uid
-                    AND c2.created_at >= datetime('now', '-1 hour')
-                ) >= (sku_count * 10)
-            )
-            SELECT 
-                us.uid,
-                us.uname,
-                us.sku_id,
-                s.name as sku_name,
-                us.listing_count,
-                us.first_listing,
-                us.last_listing,
-                (
-                    SELECT COUNT(DISTINCT c2.sku_id)
-                    FROM c2c_items c2
-                    WHERE c2.uid = us.uid
-                ) as total_skus
-            FROM single_sku_stats us
-            JOIN skus s ON us.sku_id = s.sku_id
-            WHERE NOT EXISTS (
-                SELECT 1 FROM blacklist b 
-                WHERE b.uid = us.uid
-            )
-            UNION ALL
-            SELECT 
-                ms.uid,
-                ms.uname,
-                NULL as sku_id,
-                '多个商品' as sku_name,
-                (
-                    SELECT COUNT(*)
-                    FROM c2c_items c2
-                    WHERE c2.uid = ms.uid
-                    AND c2.created_at >= datetime('now', '-1 hour')
-                ) as listing_count,
-                ms.first_listing,
-                ms.last_listing,
-                ms.sku_count as total_skus
-            FROM multi_sku_stats ms
-            WHERE NOT EXISTS (
-                SELECT 1 FROM blacklist b 
-                WHERE b.uid = ms.uid
-            )
-            ORDER BY listing_count DESC
-        """)
+        cursor.execute(queries.SUSPICIOUS_USERS, {"since_1h": int((time.time() - 3600) * 1000)})
         
         results = []
         for row in cursor.fetchall():
@@ -698,118 +526,78 @@ async def get_suspicious_users():
 @app.post("/api/blacklist")
 async def add_to_blacklist(user: dict):
     """添加用户到黑名单"""
+    now_ms = int(time.time() * 1000)
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("BEGIN TRANSACTION")
-            
+        await write([
             # 添加到黑名单
-            cursor.execute("""
+            ("""
                 INSERT INTO blacklist (uid, uname, reason)
                 VALUES (?, ?, ?)
-            """, (user['uid'], user['uname'], user['reason']))
+            """, (user['uid'], user['uname'], user['reason'])),
             
-            # 更新该用户所有商品的状态为-1
-            cursor.execute("""
-                UPDATE c2c_items 
-                SET publish_status = -1,
-                    is_blacklisted = 1,
-                    last_check_time = CURRENT_TIMESTAMP
-                WHERE uid = ?
-            """, (user['uid'],))
+            # 记录状态变更事件
+            ("""
+                INSERT INTO listing_events (item_id, old_status, new_status, price_cents, source, event_time)
+                SELECT id, publish_status, -1, price_cents, 'api_blacklist', ?
+                FROM c2c_items
+                WHERE uid = ? AND publish_status IS NOT -1
+            """, (now_ms, user['uid'])),
             
-            cursor.execute("COMMIT")
+            # 更新该用户所有商品的状态为-1
+            (queries.BLACKLIST_OFFLINE, {"now_ms": now_ms, "uid": user['uid']}),
+        ])
             
-            return {
-                "success": True,
-                "message": "已添加到黑名单"
-            }
+        return {
+            "success": True,
+            "message": "已添加到黑名单"
+        }
             
-        except sqlite3.IntegrityError:
-            cursor.execute("ROLLBACK")
-            return {
-                "success": False,
-                "message": "该用户已在黑名单中"
-            }
+    except sqlite3.IntegrityError:
+        return {
+            "success": False,
+            "message": "该用户已在黑名单中"
+        }
             
-        except Exception as e:
-            cursor.execute("ROLLBACK")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=str(e)
-            )
-    finally:
-        conn.close()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
 
 @app.delete("/api/blacklist/{uid}")
 async def remove_from_blacklist(uid: str):
     """从黑名单中移除用户"""
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("DELETE FROM blacklist WHERE uid = ?", (uid,))
-        conn.commit()
+    await write([("DELETE FROM blacklist WHERE uid = ?", (uid,))])
         
-        return {
-            "success": True,
-            "message": "已从黑名单中移除"
-        }
-    finally:
-        conn.close()
+    return {
+        "success": True,
+        "message": "已从黑名单中移除"
+    }
 
 @app.get("/api/user-stats")
-async def get_user_stats():
+async def get_user_stats(response: Response):
+    """获取用户行为统计数据（后台预计算）"""
+    return await materialized.serve('user-stats', response)
+
+def compute_user_stats(response: Response):
     """获取用户行为统计数据"""
     try:
-        conn = get_db()
+        conn = get_read_db(response)
         cursor = conn.cursor()
         
         # 定义时间段
         periods = [
-            ('1小时', 'datetime("now", "-1 hour")'),
-            ('3小时', 'datetime("now", "-3 hours")'),
-            ('12小时', 'datetime("now", "-12 hours")'),
-            ('24小时', 'datetime("now", "-24 hours")')
+            ('1小时', 3600),
+            ('3小时', 3 * 3600),
+            ('12小时', 12 * 3600),
+            ('24小时', 24 * 3600)
         ]
         
         results = {}
         
-        for period_name, period_sql in periods:
+        for period_name, period_seconds in periods:
             # 获取每个时间段内用户的上架数据
-            cursor.execute(f"""
-                WITH user_stats AS (
-                    SELECT 
-                        c.uid,
-                        c.uname,
-                        COUNT(DISTINCT c.id) as listing_count,
-                        COUNT(DISTINCT c.sku_id) as sku_count,
-                        MIN(c.price) as min_price,
-                        MAX(c.price) as max_price,
-                        MIN(c.created_at) as first_listing,
-                        MAX(c.created_at) as last_listing,
-                        (
-                            SELECT b.reason 
-                            FROM blacklist b 
-                            WHERE b.uid = c.uid
-                            LIMIT 1
-                        ) as blacklist_reason
-                    FROM c2c_items c
-                    WHERE c.created_at >= {period_sql}
-                    GROUP BY c.uid, c.uname
-                )
-                SELECT 
-                    us.*,
-                    CASE 
-                        WHEN blacklist_reason IS NOT NULL THEN 1
-                        ELSE 0
-                    END as is_blacklisted
-                FROM user_stats us
-                ORDER BY us.listing_count DESC
-                LIMIT 50
-            """)
+            cursor.execute(queries.USER_STATS, {"since": int((time.time() - period_seconds) * 1000)})
             
             period_results = []
             for row in cursor.fetchall():
@@ -833,29 +621,22 @@ async def get_user_stats():
         conn.close()
 
 @app.get("/api/user/items")
-async def get_user_items(uid: str, uname: str):
+async def get_user_items(uid: str, uname: str, response: Response):
+    """获取指定用户的所有商品
+    
+    按 uid 查询，卖家改名前后的商品都会返回（包括已归档的商品）；uname 参数为兼容保留，
+    不参与查询，也不区分合并的请求。
+    """
+    return await single_flight.do('user-items', {"uid": uid}, compute_user_items, response,
+                                  timeout=SINGLE_FLIGHT_TIMEOUT)
+
+def compute_user_items(response: Response, uid):
     """获取指定用户的所有商品"""
     try:
         conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            SELECT DISTINCT
-                s.sku_id,
-                s.name,
-                s.img,
-                s.market_price,
-                COUNT(DISTINCT c.id) as listing_count,
-                MIN(c.price) as min_price,
-                MAX(c.price) as max_price,
-                MIN(c.created_at) as first_listing,
-                MAX(c.created_at) as last_listing
-            FROM c2c_items c
-            JOIN skus s ON c.sku_id = s.sku_id
-            WHERE c.uid = ? AND c.uname = ?
-            GROUP BY s.sku_id, s.name, s.img, s.market_price
-            ORDER BY last_listing DESC
-        """, (uid, uname))
+        cursor.execute(queries.USER_ITEMS, {"uid": uid})
         
         results = []
         for row in cursor.fetchall():
@@ -885,38 +666,36 @@ async def get_user_items(uid: str, uname: str):
         conn.close()
 
 @app.get("/api/statistics")
-async def get_statistics():
+async def get_statistics(response: Response):
+    """获取统计数据（后台预计算）"""
+    return await materialized.serve('statistics', response)
+
+def compute_statistics(response: Response):
     """获取统计数据"""
     try:
-        conn = get_db()
+        conn = get_read_db(response)
         cursor = conn.cursor()
         
         # 定义时间段
         periods = [
-            ('1小时', 'datetime("now", "-1 hour")'),
-            ('3小时', 'datetime("now", "-3 hours")'),
-            ('6小时', 'datetime("now", "-6 hours")'),
-            ('12小时', 'datetime("now", "-12 hours")'),
-            ('24小时', 'datetime("now", "-24 hours")')
+            ('1小时', 'datetime("now", "-1 hour")', 3600),
+            ('3小时', 'datetime("now", "-3 hours")', 3 * 3600),
+            ('6小时', 'datetime("now", "-6 hours")', 6 * 3600),
+            ('12小时', 'datetime("now", "-12 hours")', 12 * 3600),
+            ('24小时', 'datetime("now", "-24 hours")', 24 * 3600)
         ]
         
         results = {}
         
-        for period_name, period_sql in periods:
+        for period_name, period_sql, period_seconds in periods:
+            since_ms = int((time.time() - period_seconds) * 1000)
+            
             # 新增商品数量
-            cursor.execute(f"""
-                SELECT COUNT(*) as count
-                FROM c2c_items
-                WHERE created_at >= {period_sql}
-            """)
+            cursor.execute(queries.STATISTICS_NEW_ITEMS, {"since": since_ms})
             new_items = cursor.fetchone()['count']
             
             # 新增SKU数量
-            cursor.execute(f"""
-                SELECT COUNT(DISTINCT sku_id) as count
-                FROM c2c_items
-                WHERE created_at >= {period_sql}
-            """)
+            cursor.execute(queries.STATISTICS_NEW_SKUS, {"since": since_ms})
             new_skus = cursor.fetchone()['count']
             
             # 新增封禁用户数量
@@ -927,36 +706,12 @@ async def get_statistics():
             """)
             new_blacklist = cursor.fetchone()['count']
             
-            # 已售商品数量
-            cursor.execute(f"""
-                SELECT COUNT(*) as count
-                FROM c2c_items
-                WHERE publish_status = -2
-                AND last_check_time >= {period_sql}
-            """)
+            # 已售商品数量（来自状态变更事件）
+            cursor.execute(queries.STATISTICS_SOLD, {"since": since_ms})
             sold_items = cursor.fetchone()['count']
             
             # 获取最活跃用户
-            cursor.execute(f"""
-                SELECT 
-                    uid,
-                    uname,
-                    COUNT(*) as listing_count,
-                    COUNT(DISTINCT sku_id) as sku_count,
-                    MIN(created_at) as first_listing,
-                    MAX(created_at) as last_listing,
-                    (
-                        SELECT reason 
-                        FROM blacklist b 
-                        WHERE b.uid = c.uid
-                        LIMIT 1
-                    ) as blacklist_reason
-                FROM c2c_items c
-                WHERE created_at >= {period_sql}
-                GROUP BY uid, uname
-                ORDER BY listing_count DESC
-                LIMIT 5
-            """)
+            cursor.execute(queries.STATISTICS_ACTIVE, {"since": since_ms})
             
             active_users = []
             for row in cursor.fetchall():
@@ -984,47 +739,176 @@ async def get_statistics():
         conn.close()
 
 @app.get("/api/statistics/trend")
-async def get_statistics_trend():
+async def get_statistics_trend(response: Response):
+    """获取最近一小时的趋势数据（后台预计算）"""
+    return await materialized.serve('statistics-trend', response)
+
+def compute_statistics_trend(response: Response):
     """获取最近一小时的趋势数据（按分钟）"""
     try:
-        conn = get_db()
+        conn = get_read_db(response)
         cursor = conn.cursor()
         
-        # 获取最近60分钟的数据
-        cursor.execute("""
-            WITH RECURSIVE 
-            minutes(minute) AS (
-                SELECT datetime('now', '-59 minutes')
-                UNION ALL
-                SELECT datetime(minute, '+1 minutes')
-                FROM minutes
-                WHERE minute < datetime('now')
-            )
-            SELECT 
-                strftime('%H:%M', datetime(m.minute, '+8 hours')) as time,
-                COUNT(c.id) as items_count,
-                COUNT(DISTINCT c.sku_id) as skus_count,
-                COUNT(DISTINCT c.uid) as users_count
-            FROM minutes m
-            LEFT JOIN c2c_items c ON 
-                strftime('%Y-%m-%d %H:%M', c.created_at) = strftime('%Y-%m-%d %H:%M', datetime(m.minute))
-            GROUP BY m.minute
-            ORDER BY m.minute
-        """)
+        # 获取最近60分钟的数据：按 created_ms 索引范围扫描，再按分钟分组
+        first_minute = int(time.time()) // 60 - 59
+        cursor.execute(queries.STATISTICS_TREND, {"since_1h": first_minute * 60000})
+        counts = {row['minute']: row for row in cursor.fetchall()}
         
+        # 没有商品的分钟补 0，时间显示为北京时间
         results = []
-        for row in cursor.fetchall():
+        for minute in range(first_minute, first_minute + 60):
+            row = counts.get(minute)
             results.append({
-                "time": row['time'],
-                "items_count": row['items_count'],
-                "skus_count": row['skus_count'],
-                "users_count": row['users_count']
+                "time": time.strftime('%H:%M', time.gmtime(minute * 60 + 8 * 3600)),
+                "items_count": row['items_count'] if row else 0,
+                "skus_count": row['skus_count'] if row else 0,
+                "users_count": row['users_count'] if row else 0
             })
         
         return results
     finally:
         conn.close()
 
+materialized.register('statistics', compute_statistics, min_interval=10, max_interval=60)
+materialized.register('statistics-trend', compute_statistics_trend, min_interval=10, max_interval=30)
+materialized.register('user-stats', compute_user_stats, min_interval=10, max_interval=60)
+materialized.register('suspicious-users', compute_suspicious_users, min_interval=10, max_interval=60)
+
+@app.get("/api/precompute")
+async def get_precompute_status():
+    """获取物化响应的预计算状态：计算耗时、结果年龄、由哪个 worker 计算"""
+    return materialized.status()
+
+@app.get("/api/single-flight")
+async def get_single_flight_status():
+    """获取本 worker 合并请求的统计：各接口的执行次数、合并的等待请求数、超时次数"""
+    return single_flight.status()
+
+@app.get("/api/crawl-schedule")
+async def get_crawl_schedule():
+    """获取列表爬虫的调度状态：各分类的到达率估计、下一轮计划，以及各分片的进度和产出"""
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        now = time.time()
+        
+        def format_time(timestamp):
+            return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else None
+        
+        categories = []
+        shards = []
+        try:
+            cursor.execute("SELECT * FROM crawl_schedule ORDER BY category")
+            for row in cursor.fetchall():
+                categories.append({
+                    "category": row['category'],
+                    "arrival_rate_per_minute": round(row['arrival_rate'] * 60, 3) if row['arrival_rate'] is not None else None,
+                    "rate_samples": row['rate_samples'],
+                    "last_new_items": row['last_new_items'],
+                    "last_round_at": format_time(row['last_round_at']),
+                    "next_round_at": format_time(row['next_round_at']),
+                    "next_round_in": max(0, round(row['next_round_at'] - now)) if row['next_round_at'] else 0,
+                    "planned_interval": row['planned_interval'],
+                    "planned_pages": row['planned_pages']
+                })
+            
+            cursor.execute("SELECT * FROM crawl_state ORDER BY crawl_key")
+            for row in cursor.fetchall():
+                shards.append({
+                    "crawl_key": row['crawl_key'],
+                    "high_water_id": row['high_water_id'],
+                    "in_progress": row['next_id'] is not None,
+                    "yield_rate": row['yield_rate'],
+                    "round_stats": json.loads(row['round_stats']) if row['round_stats'] else None,
+                    "updated_at": row['updated_at']
+                })
+        except sqlite3.OperationalError:
+            pass  # 列表爬虫尚未运行，表不存在
+        
+        return {
+            "categories": categories,
+            "shards": shards
+        }
+    finally:
+        conn.close()
+
+# 就绪检查的阈值，可通过环境变量配置：列表爬虫/状态爬虫最近一次成功的最长间隔(秒)、到期未检查商品的最大数量
+READY_LIST_MAX_AGE = int(os.environ.get('BMALL_READY_LIST_MAX_AGE', '3600'))
+READY_STATUS_MAX_AGE = int(os.environ.get('BMALL_READY_STATUS_MAX_AGE', '900'))
+READY_MAX_BACKLOG = int(os.environ.get('BMALL_READY_MAX_BACKLOG', '10000'))
+
+@app.get("/healthz")
+async def healthz():
+    """存活检查：进程能响应请求即返回 200，不访问数据库"""
+    return {"status": "ok"}
+
+def check_pipeline():
+    """检查数据库能否访问，并读取爬虫心跳和到期未检查的商品数"""
+    start = time.perf_counter()
+    conn = connect(DATABASE_URL, busy_timeout=2)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        latency_ms = (time.perf_counter() - start) * 1000
+        heartbeats = heartbeat.load_heartbeats(cursor)
+        # 按 (publish_status, next_check_ms) 索引计数，超过阈值后不再继续数
+        cursor.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM c2c_items
+                WHERE publish_status = 1 AND next_check_ms <= ?
+                LIMIT ?
+            )
+        """, (int(time.time() * 1000), READY_MAX_BACKLOG + 1))
+        backlog = cursor.fetchone()[0]
+        return latency_ms, heartbeats, backlog
+    finally:
+        conn.close()
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    """就绪检查：数据库可访问，且爬虫没有停滞
+    
+    列表爬虫超过 BMALL_READY_LIST_MAX_AGE 秒没有成功写入一页、有到期商品时状态爬虫超过
+    BMALL_READY_STATUS_MAX_AGE 秒没有成功检查、或到期未检查的商品超过 BMALL_READY_MAX_BACKLOG
+    条时返回 503。还没有心跳的组件（尚未运行）不判为停滞。
+
+    供外部监控告警使用；容器健康检查和爬虫的启动依赖用 /healthz，否则爬虫停滞后
+    API 被判为不健康，重启的爬虫又在等待 API 健康，无法恢复。
+    """
+    now = time.time()
+    checks = {}
+    try:
+        latency_ms, heartbeats, backlog = await asyncio.to_thread(check_pipeline)
+    except sqlite3.Error as e:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "not_ready", "checks": {"database": {"ok": False, "error": str(e)}}}
+    checks["database"] = {"ok": True, "latency_ms": round(latency_ms, 1)}
+    
+    for component, max_age in ((heartbeat.LIST_PAGE, READY_LIST_MAX_AGE), (heartbeat.STATUS_CHECK, READY_STATUS_MAX_AGE)):
+        last_success_ms, detail = heartbeats.get(component, (None, {}))
+        age = now - last_success_ms / 1000 if last_success_ms is not None else None
+        ok = age is None or age <= max_age
+        if component == heartbeat.STATUS_CHECK and backlog == 0:
+            ok = True  # 没有到期商品时状态爬虫空闲，不算停滞
+        checks[component] = {
+            "ok": ok,
+            "last_success": datetime.fromtimestamp(last_success_ms / 1000).strftime('%Y-%m-%d %H:%M:%S') if last_success_ms else None,
+            "age": round(age, 1) if age is not None else None,
+            "max_age": max_age,
+            "detail": detail
+        }
+    
+    checks["backlog"] = {
+        "ok": backlog <= READY_MAX_BACKLOG,
+        "due_items": backlog if backlog <= READY_MAX_BACKLOG else f">{READY_MAX_BACKLOG}",
+        "max_due_items": READY_MAX_BACKLOG
+    }
+    
+    ready = all(check["ok"] for check in checks.values())
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if ready else "not_ready", "checks": checks}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
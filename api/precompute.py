@@ -0,0 +1,186 @@
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+import time
+
+from fastapi import Response
+
+from api.singleflight import SingleFlight
+
+
+class MaterializedResponses:
+    """在后台预计算耗时的接口响应（物化响应），请求到来时直接返回最近一次的结果
+
+    每个注册的响应在数据版本变化且距上次计算超过 min_interval 秒，或距上次计算超过
+    max_interval 秒时重新计算。结果以 JSON 文件保存在 directory 中：多个 uvicorn worker
+    通过文件锁选出一个 worker 负责计算，其他 worker 直接读取文件；负责计算的 worker
+    退出后锁自动释放，由其他 worker 接替。
+
+    后台计算和请求当场计算都经过 single_flight，同一个响应同时只计算一次。
+    """
+    def __init__(self, db_path, directory, poll_interval=1, single_flight=None, timeout=60):
+        self.db_path = db_path
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.single_flight = single_flight or SingleFlight()
+        self.timeout = timeout
+        self.replica = None
+        self.views = {}
+        self.versions = {}
+        self.cache = {}
+        self.stats = {}
+        self.lock_file = None
+        self.task = None
+
+    def register(self, name, func, min_interval=10, max_interval=60):
+        """func(response) 返回响应内容，读取数据时可在 response 上设置 X-Replica-Age"""
+        self.views[name] = (func, min_interval, max_interval)
+        self.stats[name] = {'runs': 0, 'failures': 0, 'duration_total': 0, 'duration_max': 0}
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def load(self, name):
+        """读取最近一次的结果，文件未变化时使用内存中的副本"""
+        try:
+            mtime = os.stat(self.path(name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self.cache.get(name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(self.path(name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.cache[name] = (mtime, snapshot)
+        return snapshot
+
+    def save(self, name, snapshot):
+        temp = self.path(name) + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(snapshot, f, ensure_ascii=False, default=str)
+        os.replace(temp, self.path(name))
+
+    def is_leader(self):
+        """尝试获得计算锁（不等待），已持有时直接返回 True"""
+        if self.lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.directory, '.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def data_version(self, conn):
+        """数据版本：启用只读副本时为副本的生成时间，否则为主库的 data_version（其他连接提交后变化）"""
+        if self.replica is not None and self.replica.snapshot_at is not None:
+            return self.replica.snapshot_at
+        return conn.execute('PRAGMA data_version').fetchone()[0]
+
+    async def compute(self, name, version=None):
+        func, _, _ = self.views[name]
+        response = Response()
+        start = time.perf_counter()
+        payload = await self.single_flight.do(name, {}, func, response)
+        duration = time.perf_counter() - start
+        stats = self.stats[name]
+        stats['runs'] += 1
+        stats['duration_total'] += duration
+        stats['duration_max'] = max(stats['duration_max'], duration)
+        replica_age = response.headers.get('X-Replica-Age')
+        # 计算统计随结果一起保存，其他 worker 也能看到
+        snapshot = {
+            'payload': payload,
+            'computed_at': time.time(),
+            'duration_ms': round(duration * 1000, 1),
+            'replica_age': float(replica_age) if replica_age is not None else None,
+            'worker': os.getpid(),
+            'runs': stats['runs'],
+            'failures': stats['failures'],
+            'avg_duration_ms': round(stats['duration_total'] / stats['runs'] * 1000, 1),
+            'max_duration_ms': round(stats['duration_max'] * 1000, 1),
+        }
+        self.save(name, snapshot)
+        self.versions[name] = version
+        return snapshot
+
+    async def run(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            while True:
+                if self.is_leader():
+                    version = self.data_version(conn)
+                    for name, (_, min_interval, max_interval) in self.views.items():
+                        snapshot = self.load(name)
+                        age = time.time() - snapshot['computed_at'] if snapshot else None
+                        if (age is None or age >= max_interval
+                                or (self.versions.get(name) != version and age >= min_interval)):
+                            try:
+                                await self.compute(name, version)
+                            except Exception as e:
+                                self.stats[name]['failures'] += 1
+                                print(f"预计算 {name} 失败: {e}")
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            conn.close()
+
+    def start(self, replica=None):
+        os.makedirs(self.directory, exist_ok=True)
+        self.replica = replica
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    async def serve(self, name, response):
+        """返回最近一次的结果，并在响应头中返回结果的年龄
+
+        X-Materialized-Age 为结果计算后经过的秒数；结果读自只读副本时，X-Replica-Age 为数据
+        落后主库的总秒数。还没有结果，或负责计算的 worker 停止超过 2 倍 max_interval 时，
+        当场计算（并发的请求只计算一次，等待超过 timeout 秒返回 504）。
+        """
+        func, _, max_interval = self.views[name]
+        snapshot = self.load(name)
+        if snapshot is None or time.time() - snapshot['computed_at'] > max_interval * 2:
+            return await self.single_flight.do(name, {}, func, response, timeout=self.timeout)
+        age = time.time() - snapshot['computed_at']
+        response.headers["X-Materialized-Age"] = f"{age:.1f}"
+        if snapshot['replica_age'] is not None:
+            response.headers["X-Replica-Age"] = f"{snapshot['replica_age'] + age:.1f}"
+        return snapshot['payload']
+
+    def status(self):
+        """各物化响应的计算耗时和年龄（由负责计算的 worker 记录）"""
+        now = time.time()
+        views = []
+        for name, (_, min_interval, max_interval) in self.views.items():
+            snapshot = self.load(name) or {}
+            views.append({
+                "name": name,
+                "min_interval": min_interval,
+                "max_interval": max_interval,
+                "age": round(now - snapshot['computed_at'], 1) if snapshot else None,
+                "replica_age": snapshot.get('replica_age'),
+                "last_duration_ms": snapshot.get('duration_ms'),
+                "computed_by": snapshot.get('worker'),
+                "runs": snapshot.get('runs', 0),
+                "failures": snapshot.get('failures', 0),
+                "avg_duration_ms": snapshot.get('avg_duration_ms'),
+                "max_duration_ms": snapshot.get('max_duration_ms'),
+            })
+        return {"worker": os.getpid(), "is_leader": self.lock_file is not None, "views": views}
@@ -0,0 +1,93 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+
+from spider.backup import snapshot
+
+
+class ReadReplica:
+    """统计类接口使用的只读副本
+
+    后台线程每 interval 秒用在线备份接口把主库分步复制到临时文件，再改名替换副本文件
+    （改名是原子的：已打开的连接继续读旧文件，新连接读新文件）。副本以 immutable 方式打开，
+    读取时不加任何锁，长时间的统计查询不会影响爬虫写入主库。
+
+    多个 uvicorn worker 通过文件锁选出一个 worker 负责复制；副本文件的修改时间记为快照时间，
+    各 worker 据此计算副本年龄。副本超过 3 倍 interval 未刷新时不再使用。
+    """
+    def __init__(self, source, path, interval=30, pages=1024, sleep=0.01):
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self.pages = pages
+        self.sleep = sleep
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock_file = None
+
+    @property
+    def snapshot_at(self):
+        """当前副本对应的主库时间，还没有副本时为 None"""
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def is_leader(self):
+        """尝试获得复制锁（不等待），已持有时直接返回 True"""
+        if self.lock_file is not None:
+            return True
+        lock_file = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def refresh(self):
+        temp = self.path + '.tmp'
+        for path in (temp, temp + '-journal'):
+            if os.path.exists(path):
+                os.remove(path)
+        started = time.time()
+        stats = snapshot(self.source, temp, pages=self.pages, sleep=self.sleep, check=False)
+        os.utime(temp, (started, started))
+        os.replace(temp, self.path)
+        return stats
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.is_leader():
+                try:
+                    self.refresh()
+                except (sqlite3.Error, OSError) as e:
+                    print(f"刷新只读副本失败: {e}")
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='read-replica', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def age(self):
+        """副本落后主库的秒数，尚未生成副本时返回 None"""
+        snapshot_at = self.snapshot_at
+        return time.time() - snapshot_at if snapshot_at is not None else None
+
+    def connect(self):
+        """打开副本的只读连接，没有副本或副本太旧（包括上次运行留下的副本）时返回 None"""
+        age = self.age()
+        if age is None or age > self.interval * 3:
+            return None
+        return sqlite3.connect(f"file:{self.path}?immutable=1", uri=True)
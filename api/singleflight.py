@@ -0,0 +1,66 @@
+import asyncio
+
+from fastapi import HTTPException, Response, status
+
+
+class SingleFlight:
+    """合并并发的相同请求（single-flight）
+
+    同一接口、相同参数的计算进行中时，后到的请求不再重复查询，而是等待同一次计算并共享结果，
+    以及计算时设置的 X- 响应头（如 X-Replica-Age）。等待超过 timeout 秒的请求返回 504，
+    计算本身继续进行，其他等待者仍能拿到结果。只合并同时进行的请求，不缓存结果。
+    """
+    def __init__(self):
+        self.calls = {}
+        self.stats = {}
+
+    def route_stats(self, route):
+        if route not in self.stats:
+            self.stats[route] = {'executions': 0, 'coalesced': 0, 'max_waiters': 0, 'timeouts': 0, 'failures': 0}
+        return self.stats[route]
+
+    async def do(self, route, params, func, response=None, timeout=None):
+        """在线程中执行 func(response, **params)，相同 route 和 params 的并发请求共享一次执行"""
+        stats = self.route_stats(route)
+        key = (route, tuple(sorted(params.items())))
+        call = self.calls.get(key)
+        if call is None:
+            shared = Response()
+            call = {'task': asyncio.ensure_future(asyncio.to_thread(func, shared, **params)),
+                    'response': shared, 'waiters': 0}
+            self.calls[key] = call
+            call['task'].add_done_callback(lambda task: self.finish(key, call, stats))
+            stats['executions'] += 1
+        else:
+            stats['coalesced'] += 1
+        call['waiters'] += 1
+        stats['max_waiters'] = max(stats['max_waiters'], call['waiters'])
+
+        try:
+            # shield：等待者超时或断开连接时不取消计算
+            result = await asyncio.wait_for(asyncio.shield(call['task']), timeout)
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=f"查询超过 {timeout} 秒未完成"
+            )
+        if response is not None:
+            for name, value in call['response'].headers.items():
+                if name.startswith('x-'):
+                    response.headers[name] = value
+        return result
+
+    def finish(self, key, call, stats):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        if not call['task'].cancelled() and call['task'].exception() is not None:
+            stats['failures'] += 1
+
+    def status(self):
+        """各接口的执行次数、合并的等待请求数、单次计算的最多等待者、超时和失败次数"""
+        return {
+            "in_flight": [{"route": route, "params": dict(params), "waiters": call['waiters']}
+                          for (route, params), call in self.calls.items()],
+            "routes": self.stats,
+        }
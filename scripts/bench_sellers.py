@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spider import migrations  # noqa: E402
+
+# 迁移前 c2c_items 的表结构（卖家资料在每条商品记录中重复）
+LEGACY_ITEMS_TABLE = '''
+CREATE TABLE c2c_items (
+    id INTEGER PRIMARY KEY,
+    type INTEGER,
+    name TEXT,
+    brand_id INTEGER,
+    sku_id INTEGER,
+    items_id INTEGER,
+    total_items_count INTEGER,
+    price REAL,
+    show_price TEXT,
+    show_market_price TEXT,
+    uid TEXT,
+    payment_time INTEGER,
+    is_my_publish INTEGER,
+    uspace_jump_url TEXT,
+    uface TEXT,
+    uname TEXT,
+    publish_status INTEGER DEFAULT 1,
+    is_blacklisted INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_check_time TIMESTAMP,
+    last_seen_in_list TIMESTAMP
+)
+'''
+
+# 迁移前后 /api/user-stats、/api/statistics、/api/user/items 的查询（24小时）
+QUERIES = {
+    'user-stats': (
+        '''
+        SELECT c.uid, c.uname, COUNT(DISTINCT c.id) as listing_count, COUNT(DISTINCT c.sku_id),
+               MIN(c.price), MAX(c.price), MIN(c.created_at), MAX(c.created_at)
+        FROM c2c_items c
+        WHERE c.created_at >= datetime('now', '-24 hours')
+        GROUP BY c.uid, c.uname
+        ORDER BY listing_count DESC
+        LIMIT 50
+        ''',
+        '''
+        WITH user_stats AS (
+            SELECT c.uid, COUNT(DISTINCT c.id) as listing_count, COUNT(DISTINCT c.sku_id),
+                   MIN(c.price), MAX(c.price), MIN(c.created_at), MAX(c.created_at)
+            FROM c2c_items c
+            WHERE c.created_at >= datetime('now', '-24 hours')
+            GROUP BY c.uid
+            ORDER BY listing_count DESC
+            LIMIT 50
+        )
+        SELECT CAST(us.uid AS TEXT), sl.uname, us.*
+        FROM user_stats us
+        LEFT JOIN sellers sl ON sl.uid = us.uid
+        ORDER BY us.listing_count DESC
+        ''',
+    ),
+    'statistics': (
+        '''
+        SELECT uid, uname, COUNT(*) as listing_count, COUNT(DISTINCT sku_id),
+               MIN(created_at), MAX(created_at)
+        FROM c2c_items c
+        WHERE created_at >= datetime('now', '-24 hours')
+        GROUP BY uid, uname
+        ORDER BY listing_count DESC
+        LIMIT 5
+        ''',
+        '''
+        WITH active AS (
+            SELECT uid, COUNT(*) as listing_count, COUNT(DISTINCT sku_id),
+                   MIN(created_at), MAX(created_at)
+            FROM c2c_items
+            WHERE created_at >= datetime('now', '-24 hours')
+            GROUP BY uid
+            ORDER BY listing_count DESC
+            LIMIT 5
+        )
+        SELECT CAST(a.uid AS TEXT), sl.uname, a.*
+        FROM active a
+        LEFT JOIN sellers sl ON sl.uid = a.uid
+        ORDER BY a.listing_count DESC
+        ''',
+    ),
+    'user-items': (
+        '''
+        SELECT s.sku_id, s.name, COUNT(DISTINCT c.id), MIN(c.price), MAX(c.price),
+               MIN(c.created_at), MAX(c.created_at) as last_listing
+        FROM c2c_items c
+        JOIN skus s ON c.sku_id = s.sku_id
+        WHERE c.uid = :uid AND c.uname = :uname
+        GROUP BY s.sku_id, s.name
+        ORDER BY last_listing DESC
+        ''',
+        '''
+        SELECT s.sku_id, s.name, COUNT(DISTINCT c.id), MIN(c.price), MAX(c.price),
+               MIN(c.created_at), MAX(c.created_at) as last_listing
+        FROM c2c_items c
+        JOIN skus s ON c.sku_id = s.sku_id
+        WHERE c.uid = :uid
+        GROUP BY s.sku_id, s.name
+        ORDER BY last_listing DESC
+        ''',
+    ),
+}
+
+
+def build_legacy_db(args):
+    """按迁移前的表结构生成模拟数据"""
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect('./db/bilibili_mall.db')
+    cursor = conn.cursor()
+    cursor.execute(LEGACY_ITEMS_TABLE)
+    cursor.execute('CREATE INDEX idx_c2c_items_uid ON c2c_items(uid)')
+    cursor.execute('CREATE INDEX idx_c2c_items_created_at ON c2c_items(created_at)')
+    cursor.execute('CREATE INDEX idx_c2c_items_sku_id ON c2c_items(sku_id)')
+    # 其他表按当前结构创建，不执行迁移
+    migrations.create_tables(cursor)
+    cursor.executemany(
+        'INSERT OR IGNORE INTO skus (sku_id, name, market_price_cents, type) VALUES (?, ?, ?, 1)',
+        [(sku_id, f"手办 {sku_id}", 15000) for sku_id in range(1, args.skus + 1)]
+    )
+
+    sellers = []
+    for index in range(args.sellers):
+        uid = str(10000000 + index * 37)
+        face = hashlib.sha1(uid.encode()).hexdigest()
+        sellers.append({
+            'uid': uid,
+            'names': [f"卖家{uid[-5:]}的小店"] + ([f"卖家{uid[-5:]}的新店"] if rng.random() < args.rename_ratio else []),
+            'uface': f"https://i0.hdslb.com/bfs/face/{face}.jpg",
+            'uspace_jump_url': f"https://space.bilibili.com/{uid}?spm_id_from=333.1007.0.0",
+        })
+    # 少数卖家上架了大部分商品
+    weights = [1 / (rank + 1) for rank in range(len(sellers))]
+
+    now = time.time()
+    rows = []
+    for item_id in range(1, args.listings + 1):
+        seller = rng.choices(sellers, weights)[0]
+        age = rng.random() * args.days * 86400
+        # 改过名的卖家，较早的商品使用旧昵称
+        uname = seller['names'][-1] if age < args.days * 43200 else seller['names'][0]
+        price = rng.randint(2000, 30000)
+        rows.append((
+            item_id, 1, f"手办 {item_id % args.skus + 1}", None, item_id % args.skus + 1, item_id,
+            1, price / 100, str(price / 100), '150', seller['uid'], 0, 0,
+            seller['uspace_jump_url'], seller['uface'], uname, 1,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - age)),
+        ))
+        if len(rows) >= 10000:
+            insert_legacy_rows(cursor, rows)
+            rows = []
+    insert_legacy_rows(cursor, rows)
+    conn.commit()
+    cursor.execute('VACUUM')
+    conn.close()
+    return sellers
+
+
+def insert_legacy_rows(cursor, rows):
+    cursor.executemany('''
+        INSERT INTO c2c_items (
+            id, type, name, brand_id, sku_id, items_id, total_items_count, price, show_price,
+            show_market_price, uid, payment_time, is_my_publish, uspace_jump_url, uface, uname,
+            publish_status, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def measure(label, query_index, params, repeat):
+    """返回数据库大小和每个查询的平均耗时(毫秒)"""
+    conn = sqlite3.connect('./db/bilibili_mall.db')
+    cursor = conn.cursor()
+    size, item_count = migrations.get_db_stats(cursor)
+    timings = {}
+    for name, queries in QUERIES.items():
+        # 第一次执行预热页缓存，不计入耗时
+        cursor.execute(queries[query_index], params).fetchall()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            cursor.execute(queries[query_index], params).fetchall()
+        timings[name] = (time.perf_counter() - start) / repeat * 1000
+    conn.close()
+    print(f"{label}: {item_count} 条商品，数据库 {size / 1024 / 1024:.1f} MB，"
+          + "，".join(f"{name} {elapsed:.1f} ms" for name, elapsed in timings.items()))
+    return size, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量 sellers 表迁移前后的数据库大小和查询耗时')
+    parser.add_argument('--listings', type=int, default=200000, help='模拟商品数，默认200000')
+    parser.add_argument('--sellers', type=int, default=5000, help='卖家数，默认5000')
+    parser.add_argument('--skus', type=int, default=500, help='SKU数，默认500')
+    parser.add_argument('--days', type=float, default=3, help='商品上架时间分布的天数，默认3天')
+    parser.add_argument('--rename-ratio', type=float, default=0.05, help='改过昵称的卖家比例，默认0.05')
+    parser.add_argument('--repeat', type=int, default=5, help='每个查询重复次数，默认5')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子，默认1')
+    parser.add_argument('--workdir', type=str, help='生成数据库的目录，默认使用临时目录')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_sellers_')
+    os.makedirs(os.path.join(workdir, 'db'), exist_ok=True)
+    os.chdir(workdir)
+    if os.path.exists('./db/bilibili_mall.db'):
+        parser.error(f"{workdir}/db/bilibili_mall.db 已存在")
+    print(f"生成模拟数据到 {workdir}/db/bilibili_mall.db ...")
+    sellers = build_legacy_db(args)
+    params = {'uid': sellers[0]['uid'], 'uname': sellers[0]['names'][-1]}
+
+    size_before, before = measure("迁移前", 0, params, args.repeat)
+    conn = sqlite3.connect('./db/bilibili_mall.db')
+    migrations.migrate_sellers(conn)
+    conn.close()
+    size_after, after = measure("迁移后", 1, params, args.repeat)
+
+    print(f"数据库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB "
+          f"({(1 - size_after / size_before) * 100:.0f}% 减少)")
+    for name in QUERIES:
+        print(f"{name}: {before[name]:.1f} ms -> {after[name]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
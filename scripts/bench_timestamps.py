@@ -0,0 +1,173 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spider import migrations  # noqa: E402
+from bench_sellers import build_legacy_db  # noqa: E402
+
+# 迁移前后的时间范围查询：迁移前比较文本时间，迁移后比较毫秒时间戳
+QUERIES = {
+    'new-items-1h': (
+        "SELECT COUNT(*) FROM c2c_items WHERE created_at >= datetime('now', '-1 hour')",
+        "SELECT COUNT(*) FROM c2c_items WHERE created_ms >= :since_1h",
+    ),
+    'new-skus-24h': (
+        "SELECT COUNT(DISTINCT sku_id) FROM c2c_items WHERE created_at >= datetime('now', '-24 hours')",
+        "SELECT COUNT(DISTINCT sku_id) FROM c2c_items WHERE created_ms >= :since_24h",
+    ),
+    'user-stats-3h': (
+        '''
+        SELECT uid, COUNT(*) as listing_count, MIN(price), MAX(price), MIN(created_at), MAX(created_at)
+        FROM c2c_items
+        WHERE created_at >= datetime('now', '-3 hours')
+        GROUP BY uid
+        ORDER BY listing_count DESC
+        LIMIT 50
+        ''',
+        '''
+        SELECT uid, COUNT(*) as listing_count, MIN(price), MAX(price), MIN(created_at), MAX(created_at)
+        FROM c2c_items
+        WHERE created_ms >= :since_3h
+        GROUP BY uid
+        ORDER BY listing_count DESC
+        LIMIT 50
+        ''',
+    ),
+    'checked-6h': (
+        "SELECT COUNT(*) FROM c2c_items WHERE last_check_time >= datetime('now', '-6 hours')",
+        "SELECT COUNT(*) FROM c2c_items WHERE last_check_ms >= :since_6h",
+    ),
+    'trend-60m': (
+        '''
+        WITH RECURSIVE
+        minutes(minute) AS (
+            SELECT datetime('now', '-59 minutes')
+            UNION ALL
+            SELECT datetime(minute, '+1 minutes')
+            FROM minutes
+            WHERE minute < datetime('now')
+        )
+        SELECT m.minute, COUNT(c.id), COUNT(DISTINCT c.sku_id), COUNT(DISTINCT c.uid)
+        FROM minutes m
+        LEFT JOIN c2c_items c ON
+            strftime('%Y-%m-%d %H:%M', c.created_at) = strftime('%Y-%m-%d %H:%M', datetime(m.minute))
+        GROUP BY m.minute
+        ''',
+        '''
+        SELECT created_ms / 60000 as minute, COUNT(id), COUNT(DISTINCT sku_id), COUNT(DISTINCT uid)
+        FROM c2c_items
+        WHERE created_ms >= :since_60m
+        GROUP BY minute
+        ''',
+    ),
+}
+
+
+def query_params():
+    now_ms = int(time.time() * 1000)
+    return {
+        'since_1h': now_ms - 3600 * 1000,
+        'since_3h': now_ms - 3 * 3600 * 1000,
+        'since_6h': now_ms - 6 * 3600 * 1000,
+        'since_24h': now_ms - 24 * 3600 * 1000,
+        'since_60m': (now_ms // 60000 - 59) * 60000,
+    }
+
+
+def prepare_text_timestamps(conn):
+    """迁移卖家资料后补上旧版的时间索引和部分商品的检查时间"""
+    cursor = conn.cursor()
+    cursor.execute("UPDATE c2c_items SET last_check_time = datetime(created_at, '+10 minutes') WHERE id % 2 = 0")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_c2c_items_last_check_time ON c2c_items(last_check_time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_c2c_items_uid_sku ON c2c_items(uid, sku_id, price)')
+    conn.commit()
+    cursor.execute('VACUUM')
+
+
+def index_sizes(cursor):
+    """c2c_items 表和各索引占用的字节数，SQLite 未编译 dbstat 时返回空"""
+    try:
+        cursor.execute('''
+            SELECT d.name, SUM(d.pgsize)
+            FROM dbstat d
+            JOIN sqlite_master m ON m.name = d.name
+            WHERE m.tbl_name = 'c2c_items'
+            GROUP BY d.name
+        ''')
+    except sqlite3.OperationalError:
+        return {}
+    return dict(cursor.fetchall())
+
+
+def measure(label, query_index, repeat):
+    """返回数据库大小、表和索引大小，以及每个查询的平均耗时(毫秒)"""
+    conn = sqlite3.connect('./db/bilibili_mall.db')
+    cursor = conn.cursor()
+    size, item_count = migrations.get_db_stats(cursor)
+    sizes = index_sizes(cursor)
+    params = query_params()
+    timings = {}
+    for name, queries in QUERIES.items():
+        # 第一次执行预热页缓存；超过1秒的慢查询不再重复，直接使用这次的耗时
+        start = time.perf_counter()
+        cursor.execute(queries[query_index], params).fetchall()
+        elapsed = time.perf_counter() - start
+        if elapsed > 1:
+            timings[name] = elapsed * 1000
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            cursor.execute(queries[query_index], params).fetchall()
+        timings[name] = (time.perf_counter() - start) / repeat * 1000
+    conn.close()
+    print(f"{label}: {item_count} 条商品，数据库 {size / 1024 / 1024:.1f} MB，"
+          + "，".join(f"{name} {elapsed:.2f} ms" for name, elapsed in timings.items()))
+    return size, sizes, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量时间和价格字段迁移为整数前后的范围查询耗时和索引大小')
+    parser.add_argument('--listings', type=int, default=200000, help='模拟商品数，默认200000')
+    parser.add_argument('--sellers', type=int, default=5000, help='卖家数，默认5000')
+    parser.add_argument('--skus', type=int, default=500, help='SKU数，默认500')
+    parser.add_argument('--days', type=float, default=3, help='商品上架时间分布的天数，默认3天')
+    parser.add_argument('--rename-ratio', type=float, default=0.05, help='改过昵称的卖家比例，默认0.05')
+    parser.add_argument('--repeat', type=int, default=20, help='每个查询重复次数，默认20')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子，默认1')
+    parser.add_argument('--workdir', type=str, help='生成数据库的目录，默认使用临时目录')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_timestamps_')
+    os.makedirs(os.path.join(workdir, 'db'), exist_ok=True)
+    os.chdir(workdir)
+    if os.path.exists('./db/bilibili_mall.db'):
+        parser.error(f"{workdir}/db/bilibili_mall.db 已存在")
+    print(f"生成模拟数据到 {workdir}/db/bilibili_mall.db ...")
+    build_legacy_db(args)
+    conn = sqlite3.connect('./db/bilibili_mall.db')
+    migrations.migrate_sellers(conn)
+    prepare_text_timestamps(conn)
+    conn.close()
+
+    size_before, sizes_before, before = measure("迁移前", 0, args.repeat)
+    conn = sqlite3.connect('./db/bilibili_mall.db')
+    migrations.migrate_timestamps(conn)
+    conn.close()
+    size_after, sizes_after, after = measure("迁移后", 1, args.repeat)
+
+    print(f"数据库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+    if sizes_before:
+        for name in sorted(set(sizes_before) | set(sizes_after)):
+            print(f"{name}: {sizes_before.get(name, 0) / 1024:.0f} KB -> {sizes_after.get(name, 0) / 1024:.0f} KB")
+    else:
+        print("SQLite 未编译 dbstat，跳过索引大小统计")
+    for name in QUERIES:
+        print(f"{name}: {before[name]:.2f} ms -> {after[name]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
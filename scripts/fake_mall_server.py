@@ -0,0 +1,455 @@
+import argparse
+import base64
+import heapq
+import json
+import math
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+BRANDS = ['SEGA', 'TAITO', 'BANPRESTO', 'FURYU', 'BANDAI', 'GOODSMILE', 'ALTER', 'KOTOBUKIYA']
+CHARACTERS = ['初音未来', '雷姆', '蕾姆', '五条悟', '芙莉莲', '阿尼亚', '绫波丽', '明日香', '蝴蝶忍', '甘雨']
+SERIES = ['景品手办', '比例手办', 'Q版手办', '粘土人', 'figma', '坐姿手办']
+
+
+class FakeMarket:
+    """模拟的市集：商品按泊松过程上架，按价格高低以不同速度售出，也会被卖家下架
+
+    市场状态在每次请求时按经过的时间推进，所有时间均为秒级时间戳。
+    """
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.random = random.Random(args.seed)
+        self.categories = [category.strip() for category in args.categories.split(',') if category.strip()]
+        self.started_at = time.time()
+        self.next_item_id = 100000000
+        self.listings = {}  # 商品ID -> 商品（包括已结束的）
+        self.on_sale = {}  # 在售商品ID -> 商品
+        self.exits = []  # (结束时间, 商品ID) 小顶堆
+        self.skus = self.create_skus(args.skus)
+        self.sellers = [str(10000000 + index) for index in range(args.sellers)]
+        self.sold_count = 0
+        self.delisted_count = 0
+
+        # 初始在售商品，上架时间分布在过去一小时内
+        for offset in sorted(self.random.uniform(0, 3600) for _ in range(args.initial_listings)):
+            self.create_listing(self.started_at - 3600 + offset)
+        self.next_arrival = self.started_at + self.random.expovariate(self.arrival_rate(self.started_at))
+
+    def create_skus(self, count):
+        skus = []
+        for index in range(count):
+            sku_id = 1000 + index
+            name = (f"{self.random.choice(BRANDS)} {self.random.choice(CHARACTERS)} "
+                    f"{self.random.choice(SERIES)} #{index}")
+            skus.append({
+                'sku_id': sku_id,
+                'name': name,
+                'category': self.categories[index % len(self.categories)],
+                'market_price': self.random.randrange(50, 500) * 100,  # 分
+                'img': f"//i0.hdslb.com/bfs/mall/mall/fake/{sku_id}.png",
+            })
+        return skus
+
+    def arrival_rate(self, now):
+        """当前的上架速率（个/秒），按 day_seconds 为周期正弦波动"""
+        phase = 2 * math.pi * (now - self.started_at) / self.args.day_seconds
+        return max(self.args.arrival_rate * (1 + self.args.diurnal_amplitude * math.sin(phase)), 1e-6)
+
+    def create_listing(self, listed_at):
+        """上架一个商品，并抽样它的结束时间和结束方式（售出或下架）"""
+        sku = self.random.choice(self.skus)
+        price = max(100, int(sku['market_price'] * self.random.lognormvariate(0, 0.25)) // 100 * 100)
+        # 价格低于市场价的商品售出更快
+        sell_rate = self.args.sell_rate * (sku['market_price'] / price) ** 3
+        delist_rate = self.args.delist_rate
+        ends_at = listed_at + self.random.expovariate(sell_rate + delist_rate)
+        item_type = 1 if self.random.random() >= self.args.other_type_ratio else 2
+        multi_sku = self.random.random() < self.args.multi_sku_ratio
+
+        item_id = self.next_item_id
+        self.next_item_id += self.random.randint(1, 3)
+        listing = {
+            'id': item_id,
+            'sku': sku,
+            'extra_sku': self.random.choice(self.skus) if multi_sku else None,
+            'type': item_type,
+            'price': price,
+            'uid': self.random.choice(self.sellers),
+            'listed_at': listed_at,
+            'ends_at': ends_at,
+            'end_reason': 'sold' if self.random.random() < sell_rate / (sell_rate + delist_rate) else 'delisted',
+            'ended_at': None,
+        }
+        self.listings[item_id] = listing
+        self.on_sale[item_id] = listing
+        heapq.heappush(self.exits, (ends_at, item_id))
+        return listing
+
+    def advance(self, now):
+        """把市场推进到 now：依次处理期间的上架和结束"""
+        while True:
+            next_exit = self.exits[0][0] if self.exits else math.inf
+            if self.next_arrival > now and next_exit > now:
+                return
+            if self.next_arrival <= next_exit:
+                self.create_listing(self.next_arrival)
+                self.next_arrival += self.random.expovariate(self.arrival_rate(self.next_arrival))
+            else:
+                _, item_id = heapq.heappop(self.exits)
+                listing = self.on_sale.pop(item_id)
+                listing['ended_at'] = listing['ends_at']
+                if listing['end_reason'] == 'sold':
+                    self.sold_count += 1
+                else:
+                    self.delisted_count += 1
+
+    def to_list_item(self, listing):
+        """列表接口返回的商品结构"""
+        skus = [listing['sku']] + ([listing['extra_sku']] if listing['extra_sku'] else [])
+        uid = listing['uid']
+        return {
+            'c2cItemsId': listing['id'],
+            'type': listing['type'],
+            'c2cItemsName': listing['sku']['name'],
+            'detailDtoList': [
+                {
+                    'blindBoxId': 0,
+                    'itemsId': sku['sku_id'] * 10,
+                    'skuId': sku['sku_id'],
+                    'name': sku['name'],
+                    'img': sku['img'],
+                    'marketPrice': sku['market_price'],
+                    'type': 0,
+                    'isHidden': False,
+                }
+                for sku in skus
+            ],
+            'totalItemsCount': len(skus),
+            'price': listing['price'],
+            'showPrice': f"{listing['price'] / 100:.2f}".rstrip('0').rstrip('.'),
+            'showMarketPrice': f"{listing['sku']['market_price'] / 100:.2f}".rstrip('0').rstrip('.'),
+            'uid': uid,
+            'paymentTime': 0,
+            'isMyPublish': False,
+            'uspaceJumpUrl': f"//space.bilibili.com/{uid}",
+            'uface': f"//i0.hdslb.com/bfs/face/fake{uid}.jpg",
+            'uname': f"卖家{uid[-4:]}",
+        }
+
+    @staticmethod
+    def encode_cursor(listing, sort_type):
+        key = listing['id'] if sort_type == 'TIME_DESC' else [listing['price'], listing['id']]
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(next_id):
+        return json.loads(base64.urlsafe_b64decode(next_id.encode()))
+
+    def list_items(self, body):
+        """列表接口：按分类、价格区间筛选在售商品，按 sortType 排序，nextId 为上一页最后一个商品的位置"""
+        sort_type = body.get('sortType') or 'TIME_DESC'
+        category = body.get('categoryFilter') or ''
+        price_ranges = []
+        for price_filter in body.get('priceFilters') or []:
+            low, _, high = str(price_filter).partition('-')
+            price_ranges.append((int(low or 0), int(high or 0) or math.inf))
+
+        with self.lock:
+            self.advance(time.time())
+            candidates = [
+                listing for listing in self.on_sale.values()
+                if (not category or listing['sku']['category'] == category)
+                and (not price_ranges or any(low <= listing['price'] <= high for low, high in price_ranges))
+            ]
+
+        if sort_type == 'PRICE_ASC':
+            sort_key = lambda listing: (listing['price'], listing['id'])
+            reverse = False
+        elif sort_type == 'PRICE_DESC':
+            sort_key = lambda listing: (listing['price'], listing['id'])
+            reverse = True
+        else:
+            sort_type = 'TIME_DESC'
+            sort_key = lambda listing: listing['id']
+            reverse = True
+        candidates.sort(key=sort_key, reverse=reverse)
+
+        if body.get('nextId'):
+            cursor = self.decode_cursor(body['nextId'])
+            cursor = cursor if sort_type == 'TIME_DESC' else tuple(cursor)
+            if reverse:
+                candidates = [listing for listing in candidates if sort_key(listing) < cursor]
+            else:
+                candidates = [listing for listing in candidates if sort_key(listing) > cursor]
+
+        page = candidates[:self.args.page_size]
+        has_more = len(candidates) > len(page)
+        return {
+            'code': 0,
+            'message': 'success',
+            'data': {
+                'data': [self.to_list_item(listing) for listing in page],
+                'nextId': self.encode_cursor(page[-1], sort_type) if page and has_more else None,
+            },
+        }
+
+    def item_detail(self, item_id):
+        """详情接口：在售 publishStatus=1，售出 saleStatus=2，下架 publishStatus=0"""
+        with self.lock:
+            self.advance(time.time())
+            listing = self.listings.get(item_id)
+            if listing is None:
+                return {'code': 0, 'message': 'success', 'data': {'c2cItemsId': item_id, 'publishStatus': 0, 'saleStatus': 1}}
+            ended = listing['ended_at'] is not None
+            return {
+                'code': 0,
+                'message': 'success',
+                'data': {
+                    'c2cItemsId': item_id,
+                    'c2cItemsName': listing['sku']['name'],
+                    'price': listing['price'],
+                    'publishStatus': 0 if ended and listing['end_reason'] == 'delisted' else 1,
+                    'saleStatus': 2 if ended and listing['end_reason'] == 'sold' else 1,
+                },
+            }
+
+    def get_stats(self):
+        with self.lock:
+            now = time.time()
+            self.advance(now)
+            return {
+                'uptime': now - self.started_at,
+                'arrival_rate': self.arrival_rate(now),
+                'listings': len(self.listings),
+                'on_sale': len(self.on_sale),
+                'sold': self.sold_count,
+                'delisted': self.delisted_count,
+            }
+
+    def get_listings(self, since_id=0):
+        """所有商品的真实上架/结束时间，用于衡量爬虫的新鲜度"""
+        with self.lock:
+            self.advance(time.time())
+            return [
+                {
+                    'id': listing['id'],
+                    'listed_at': listing['listed_at'],
+                    'ended_at': listing['ended_at'],
+                    'end_reason': listing['end_reason'] if listing['ended_at'] else None,
+                }
+                for listing in self.listings.values() if listing['id'] > since_id
+            ]
+
+
+class RateLimiter:
+    """按 Cookie（没有 Cookie 时按客户端地址）的令牌桶限流"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}  # 客户端 -> (令牌数, 更新时间)
+
+    def allow(self, client):
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self.buckets[client] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+
+class FakeMallHandler(BaseHTTPRequestHandler):
+    market = None
+    limiter = None
+    args = None
+    counters = {}
+    counters_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if self.args.verbose:
+            super().log_message(format, *args)
+
+    def count(self, name):
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def send_json(self, payload, status_code=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate_network(self, endpoint):
+        """模拟延迟、HTTP错误、接口错误和限流，返回 True 表示已经发送了错误响应"""
+        self.count(f"{endpoint}_requests")
+        latency = self.args.latency_ms + self.market.random.uniform(-1, 1) * self.args.latency_jitter_ms
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+        client = self.headers.get('cookie') or self.client_address[0]
+        if not self.limiter.allow(client):
+            self.count(f"{endpoint}_rate_limited")
+            self.send_json({'code': -412, 'message': '请求过于频繁，请稍后再试', 'data': None})
+            return True
+        if self.market.random.random() < self.args.http_error_rate:
+            self.count(f"{endpoint}_http_errors")
+            self.send_json({'message': 'Internal Server Error'}, status_code=500)
+            return True
+        if self.market.random.random() < self.args.api_error_rate:
+            self.count(f"{endpoint}_api_errors")
+            self.send_json({'code': 83000001, 'message': '服务繁忙，请稍后再试', 'data': None})
+            return True
+        return False
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if not path.endswith('/c2c/v2/list'):
+            self.send_json({'code': 404, 'message': 'not found'}, status_code=404)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self.send_json({'code': 400, 'message': '请求体不是合法的JSON'}, status_code=400)
+            return
+        if self.simulate_network('list'):
+            return
+        self.send_json(self.market.list_items(body))
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path.endswith('/c2c/items/queryC2cItemsDetail'):
+            try:
+                item_id = int(query['c2cItemsId'][0])
+            except (KeyError, ValueError):
+                self.send_json({'code': 400, 'message': '缺少 c2cItemsId'}, status_code=400)
+                return
+            if self.simulate_network('detail'):
+                return
+            self.send_json(self.market.item_detail(item_id))
+        elif parts.path == '/__stats':
+            with self.counters_lock:
+                counters = dict(self.counters)
+            self.send_json({'market': self.market.get_stats(), 'requests': counters})
+        elif parts.path == '/__listings':
+            since_id = int(query.get('since_id', ['0'])[0])
+            self.send_json(self.market.get_listings(since_id))
+        else:
+            self.send_json({'code': 404, 'message': 'not found'}, status_code=404)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report_freshness(server, db_path, grace):
+    """对比模拟市场的真实数据和爬虫数据库，输出覆盖率、发现延迟和售出识别延迟"""
+    with urlopen(f"{server.rstrip('/')}/__listings") as response:
+        listings = {listing['id']: listing for listing in json.loads(response.read())}
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, created_at FROM c2c_items")
+    discovered = {
+        item_id: datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        for item_id, created_at in cursor.fetchall()
+    }
+    cursor.execute("""
+        SELECT item_id, MIN(event_time) / 1000.0
+        FROM listing_events
+        WHERE new_status = -2
+        GROUP BY item_id
+    """)
+    sold_detected = dict(cursor.fetchall())
+    conn.close()
+
+    now = time.time()
+    started_at = min(listing['listed_at'] for listing in listings.values()) if listings else now
+    # 只统计上架超过 grace 秒的商品，给爬虫留出发现时间
+    eligible = [listing for listing in listings.values() if listing['listed_at'] <= now - grace]
+    found = [listing for listing in eligible if listing['id'] in discovered]
+    discovery_lags = [
+        discovered[listing['id']] - listing['listed_at']
+        for listing in found if listing['listed_at'] >= started_at + 3600
+    ]
+    sold = [
+        listing for listing in eligible
+        if listing['end_reason'] == 'sold' and listing['ended_at'] <= now - grace and listing['id'] in discovered
+    ]
+    sold_lags = [sold_detected[listing['id']] - listing['ended_at'] for listing in sold if listing['id'] in sold_detected]
+
+    print("=== 爬虫新鲜度 ===")
+    print(f"模拟商品数: {len(listings)}，统计范围（上架超过 {grace} 秒）: {len(eligible)}")
+    print(f"已抓取: {len(found)}（覆盖率 {len(found) / len(eligible) * 100 if eligible else 0:.1f}%）")
+    if discovery_lags:
+        print(f"发现延迟(秒): p50 {percentile(discovery_lags, 0.5):.1f}，p90 {percentile(discovery_lags, 0.9):.1f}，"
+              f"最大 {max(discovery_lags):.1f}")
+    print(f"已售出且被抓取: {len(sold)}，识别为售出: {len(sold_lags)}")
+    if sold_lags:
+        print(f"售出识别延迟(秒): p50 {percentile(sold_lags, 0.5):.1f}，p90 {percentile(sold_lags, 0.9):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟B站市集接口，用于压测和集成测试')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址，默认127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='监听端口，默认8080')
+    parser.add_argument('--categories', type=str, default='2312,2066,2331', help='商品分类ID，逗号分隔')
+    parser.add_argument('--skus', type=int, default=300, help='SKU数量，默认300')
+    parser.add_argument('--sellers', type=int, default=2000, help='卖家数量，默认2000')
+    parser.add_argument('--initial-listings', type=int, default=2000, help='启动时的在售商品数，默认2000')
+    parser.add_argument('--arrival-rate', type=float, default=0.5, help='平均每秒上架商品数，默认0.5')
+    parser.add_argument('--diurnal-amplitude', type=float, default=0.5, help='上架速率的昼夜波动幅度(0-1)，默认0.5')
+    parser.add_argument('--day-seconds', type=float, default=86400, help='昼夜波动周期(秒)，可调小以加速模拟，默认86400')
+    parser.add_argument('--sell-rate', type=float, default=1 / 7200, help='按市场价上架的商品每秒售出概率，默认1/7200')
+    parser.add_argument('--delist-rate', type=float, default=1 / 86400, help='每秒被下架的概率，默认1/86400')
+    parser.add_argument('--other-type-ratio', type=float, default=0.05, help='类型不是1的商品比例，默认0.05')
+    parser.add_argument('--multi-sku-ratio', type=float, default=0.03, help='包含多个SKU的商品比例，默认0.03')
+    parser.add_argument('--page-size', type=int, default=20, help='列表接口每页商品数，默认20')
+    parser.add_argument('--latency-ms', type=float, default=100, help='平均响应延迟(毫秒)，默认100')
+    parser.add_argument('--latency-jitter-ms', type=float, default=50, help='延迟随机波动(毫秒)，默认50')
+    parser.add_argument('--http-error-rate', type=float, default=0.0, help='返回HTTP 500的比例，默认0')
+    parser.add_argument('--api-error-rate', type=float, default=0.0, help='返回非0 code的比例，默认0')
+    parser.add_argument('--rate-limit', type=float, default=2.0, help='每个Cookie每秒允许的请求数，超过时返回 code -412，0 表示不限流，默认2')
+    parser.add_argument('--rate-burst', type=float, default=5, help='限流令牌桶容量，默认5')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    parser.add_argument('--verbose', action='store_true', help='输出每个请求的访问日志')
+    parser.add_argument('--report-db', type=str, help='不启动服务，对比 --server 的模拟数据和该数据库，输出爬虫新鲜度')
+    parser.add_argument('--server', type=str, default='http://127.0.0.1:8080', help='生成报告时的模拟服务地址')
+    parser.add_argument('--grace', type=int, default=60, help='生成报告时忽略最近多少秒内上架的商品，默认60秒')
+    args = parser.parse_args()
+
+    if args.report_db:
+        report_freshness(args.server, args.report_db, args.grace)
+        return
+
+    FakeMallHandler.market = FakeMarket(args)
+    FakeMallHandler.limiter = RateLimiter(args.rate_limit, args.rate_burst)
+    FakeMallHandler.args = args
+    server = ThreadingHTTPServer((args.host, args.port), FakeMallHandler)
+    print(f"模拟市集已启动: http://{args.host}:{args.port}")
+    print(f"爬虫使用 --base-url http://{args.host}:{args.port} 连接，统计信息: /__stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,555 @@
+import argparse
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spider import migrations, queries  # noqa: E402
+
+# API 和爬虫的查询：(名称, 来源, 权重, SQL)。权重为每轮（约一分钟）大致的执行次数。
+# SQL 取自 spider/queries.py，与代码执行的是同一份；随请求变化的片段取一种典型的取值
+QUERIES = (
+    ('brands', 'api get_brands', 1, queries.BRANDS),
+    ('skus', 'api get_skus', 5, queries.SKUS.format(brand_filter='', order='latest_id DESC')),
+    ('skus-brand', 'api get_skus(brand_id)', 3,
+     queries.SKUS.format(brand_filter='AND i.brand_id = :brand_id', order='min_price ASC')),
+    ('sku-items', 'api get_sku_items', 5, queries.SKU_ITEMS),
+    ('status-changes-count', 'api get_status_changes', 2,
+     queries.STATUS_CHANGES_COUNT.format(status_condition='AND e.new_status != 1')),
+    ('status-changes', 'api get_status_changes', 2,
+     queries.STATUS_CHANGES.format(status_condition='AND e.new_status != 1')),
+    ('blacklist', 'api get_blacklist', 1, queries.BLACKLIST),
+    ('suspicious-users', 'api get_suspicious_users', 1, queries.SUSPICIOUS_USERS),
+    ('user-stats', 'api get_user_stats', 4, queries.USER_STATS),
+    ('user-items', 'api get_user_items', 2, queries.USER_ITEMS),
+    ('statistics-new-items', 'api get_statistics', 5, queries.STATISTICS_NEW_ITEMS),
+    ('statistics-new-skus', 'api get_statistics', 5, queries.STATISTICS_NEW_SKUS),
+    ('statistics-sold', 'api get_statistics', 5, queries.STATISTICS_SOLD),
+    ('statistics-active', 'api get_statistics', 5, queries.STATISTICS_ACTIVE),
+    ('trend', 'api get_statistics_trend', 1, queries.STATISTICS_TREND),
+    ('existing-item', 'list_writer check_item_exists', 200, queries.EXISTING_ITEM),
+    ('archived-item', 'list_writer restore_archived_item', 20, queries.ARCHIVED_ITEM),
+    ('suspicious-user', 'list_writer check_suspicious_user', 100, queries.SELLER_LISTINGS_1H),
+    ('check-blacklist', 'list_writer check_blacklist', 200, queries.IN_BLACKLIST),
+    ('seller', 'list_writer save_seller', 100, queries.SELLER_PROFILE),
+    ('relist-lookup', 'list_writer find_relist_canonical', 100, queries.RELIST_CANONICAL),
+    ('relist-match', 'list_writer find_relist_canonical', 100, queries.RELIST_MATCH),
+    ('mark-seen', 'list_writer mark_seen_in_list', 10, queries.MARK_SEEN.format(item_ids=':item_id')),
+    ('mark-seen-relists', 'list_writer mark_seen_in_list', 10,
+     queries.MARK_SEEN_RELISTS.format(item_ids=':item_id')),
+    ('blacklist-users', 'mall-spider check_blacklist_users', 1, queries.BLACKLIST_USERS_24H),
+    ('offline-user-sku', 'mall-spider offline_user_sku_items', 1, queries.OFFLINE_USER_SKU),
+    ('excess-listings', 'mall-spider cleanup_excess_listings', 1, queries.EXCESS_LISTINGS),
+    ('check-intervals', 'status_spider compute_check_intervals', 10,
+     queries.CHECK_INTERVAL_FACTORS.format(item_ids=':item_id')),
+    ('new-items', 'status_spider schedule_new_items', 10, queries.UNSCHEDULED_ITEMS),
+    ('due-items', 'status_spider get_due_items', 10, queries.DUE_ITEMS),
+    ('suspicious-users-spider', 'status_spider check_suspicious_users', 1, queries.SUSPICIOUS_USERS_1H),
+    ('compact-events', 'status_spider compact_listing_events', 1, queries.COMPACT_EVENTS_BATCH),
+    ('archive-items', 'status_spider archive_settled_items', 1, queries.SETTLED_ITEMS),
+    ('blacklist-offline', 'api add_to_blacklist', 1, queries.BLACKLIST_OFFLINE),
+    ('delete-sku', 'api delete_product_skus', 1, queries.DELETE_SKU_ITEMS.format(table='c2c_items_archive')),
+)
+
+# 各表每轮大致的写入次数，每个索引在每次写入时都要维护
+WRITE_WEIGHTS = {
+    'c2c_items': 200,
+    'listing_events': 50,
+    'sellers': 20,
+    'c2c_item_relists': 10,
+    'c2c_items_archive': 5,
+    'seller_name_history': 1,
+    'blacklist': 1,
+}
+
+# 候选索引（现有索引之外）：按上面的查询设计的组合索引和覆盖索引
+CANDIDATE_INDEXES = (
+    ('idx_c2c_items_sku_status_price', 'c2c_items', ('sku_id', 'publish_status', 'price_cents')),
+    ('idx_c2c_items_sku_price', 'c2c_items', ('sku_id', 'price_cents')),
+    ('idx_c2c_items_brand_sku_price', 'c2c_items', ('brand_id', 'sku_id', 'price_cents')),
+    ('idx_c2c_items_uid_sku_created', 'c2c_items', ('uid', 'sku_id', 'created_ms')),
+    ('idx_c2c_items_created_uid_sku', 'c2c_items', ('created_ms', 'uid', 'sku_id')),
+    ('idx_c2c_items_created_uid_sku_price', 'c2c_items', ('created_ms', 'uid', 'sku_id', 'price_cents')),
+    ('idx_c2c_items_status_check', 'c2c_items', ('publish_status', 'last_check_ms')),
+    ('idx_c2c_items_status_uid_sku', 'c2c_items', ('publish_status', 'uid', 'sku_id', 'created_ms')),
+    ('idx_c2c_items_uid_sku_price_status', 'c2c_items', ('uid', 'sku_id', 'price_cents', 'publish_status', 'created_ms')),
+    ('idx_listing_events_time_status_item', 'listing_events', ('event_time', 'new_status', 'item_id')),
+    ('idx_listing_events_status_time_item', 'listing_events', ('new_status', 'event_time', 'item_id')),
+    ('idx_c2c_item_relists_listed', 'c2c_item_relists', ('listed_ms', 'canonical_id')),
+    ('idx_blacklist_created', 'blacklist', ('created_at',)),
+    ('idx_c2c_items_archive_brand_sku', 'c2c_items_archive', ('brand_id', 'sku_id')),
+    ('idx_c2c_items_archive_uid_sku', 'c2c_items_archive', ('uid', 'sku_id')),
+)
+
+# 商品数少于此值时数据没有代表性（空表上任何索引都不划算），建议仅供参考，不执行 --apply
+MIN_REPRESENTATIVE_ITEMS = 10000
+
+# 查询计划中的一步：SCAN/SEARCH 表（或别名），以及使用的索引和条件
+PLAN_STEP = re.compile(
+    r'^(SCAN|SEARCH) (\w+)'
+    r'(?: USING (AUTOMATIC (?:PARTIAL )?COVERING INDEX|COVERING INDEX \w+|INDEX \w+|INTEGER PRIMARY KEY|PRIMARY KEY))?'
+    r'(?: \((.*)\))?'
+)
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+NOT_ALIASES = {'where', 'join', 'left', 'inner', 'cross', 'on', 'group', 'order', 'limit', 'union', 'using', 'natural'}
+
+
+def query_params(conn):
+    """查询参数：取数据库中商品最多的 SKU、卖家和品牌，以及一个在售商品"""
+    cursor = conn.cursor()
+    now_ms = int(time.time() * 1000)
+
+    def first(sql, *args):
+        row = cursor.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    uid = first('SELECT uid FROM c2c_items GROUP BY uid ORDER BY COUNT(*) DESC LIMIT 1')
+    sku_id = first('SELECT sku_id FROM c2c_items GROUP BY sku_id ORDER BY COUNT(*) DESC LIMIT 1')
+    return {
+        'uid': uid,
+        'sku_id': sku_id,
+        'brand_id': first('SELECT brand_id FROM c2c_items GROUP BY brand_id ORDER BY COUNT(*) DESC LIMIT 1'),
+        'item_id': first('SELECT MAX(id) FROM c2c_items WHERE publish_status = 1'),
+        'price_cents': first('SELECT price_cents FROM c2c_items WHERE uid = ? LIMIT 1', uid) or 0,
+        'now_ms': now_ms,
+        'seen_since': now_ms - 600 * 1000,
+        'since': now_ms - 24 * 3600 * 1000,  # 统计类接口的最长时间段
+        'since_1h': now_ms - 3600 * 1000,
+        'since_24h': now_ms - 24 * 3600 * 1000,
+        'archive_cutoff': now_ms - 7 * 86400 * 1000,
+        'compact_cutoff': now_ms - 30 * 86400 * 1000,
+        'threshold': 20,
+        'max_listings': 3,
+        'search': None,
+        'limit': 20,
+        'offset': 0,
+    }
+
+
+def table_rows(conn):
+    """各表的记录数"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    tables = [row[0] for row in cursor.fetchall()]
+    return {table: cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+
+
+def list_indexes(conn, manual_only=True):
+    """数据库中的索引：{索引名: (表名, 字段)}，manual_only 时不含主键和 UNIQUE 约束自动创建的索引"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    indexes = {}
+    for (table,) in cursor.fetchall():
+        for _, name, _, origin, _ in cursor.execute(f'PRAGMA index_list({table})').fetchall():
+            if manual_only and origin != 'c':
+                continue
+            columns = tuple(row[2] for row in cursor.execute(f'PRAGMA index_info({name})').fetchall())
+            if None not in columns:  # 表达式索引不参与分析
+                indexes[name] = (table, columns)
+    return indexes
+
+
+def integer_primary_keys(conn):
+    """各表的 INTEGER PRIMARY KEY 字段（即 rowid，不需要再建索引）"""
+    keys = {}
+    for table in table_rows(conn):
+        columns = conn.execute(f'PRAGMA table_info({table})').fetchall()
+        primary = [column for column in columns if column[5]]
+        if len(primary) == 1 and primary[0][2].upper() == 'INTEGER':
+            keys[table] = primary[0][1]
+    return keys
+
+
+def aliases(sql):
+    """查询和视图中表名、别名对应的表（或视图、CTE）名"""
+    names = {}
+    for source in [sql] + list(migrations.VIEWS_SQL):
+        for table, alias in TABLE_REFERENCE.findall(source):
+            names.setdefault(table, set()).add(table)
+            if alias and alias.lower() not in NOT_ALIASES:
+                names.setdefault(alias, set()).add(table)
+    return names
+
+
+class IndexStats:
+    """按实际数据计算索引前缀的统计，结果缓存
+
+    averages 为每个前缀平均匹配的行数（sqlite_stat1 的格式，供查询优化器使用）；
+    largest 为匹配行数最多的值匹配的行数。卖家和 SKU 的商品数相差很大，只按平均值估算
+    会低估热门卖家和 SKU 的单次查询。
+    """
+    def __init__(self, conn, rows):
+        self.conn = conn
+        self.rows = rows
+        self.cache = {}
+
+    def distinct(self, table, columns):
+        key = (table, columns)
+        if key not in self.cache:
+            self.cache[key] = self.conn.execute(
+                f'SELECT COUNT(*) FROM (SELECT DISTINCT {", ".join(columns)} FROM {table})'
+            ).fetchone()[0]
+        return self.cache[key]
+
+    def largest(self, table, columns):
+        key = ('largest', table, columns)
+        if key not in self.cache:
+            self.cache[key] = self.conn.execute(
+                f'SELECT MAX(count) FROM (SELECT COUNT(*) as count FROM {table} GROUP BY {", ".join(columns)})'
+            ).fetchone()[0] or 0
+        return self.cache[key]
+
+    def averages(self, table, columns):
+        total = self.rows.get(table, 0)
+        return [max(1, math.ceil(total / max(1, self.distinct(table, columns[:k]))))
+                for k in range(1, len(columns) + 1)]
+
+    def stat(self, table, columns):
+        return ' '.join(str(value) for value in [self.rows.get(table, 0)] + self.averages(table, columns))
+
+
+class Shadow:
+    """只有表结构的内存数据库，用于比较不同索引组合下的查询计划
+
+    表的记录数和索引的统计由实际数据计算后写入 sqlite_stat1，查询计划与在实际数据库中一致，
+    建立和删除索引不需要读取数据。
+    """
+    def __init__(self, conn, rows, stats):
+        self.rows = rows
+        self.stats = stats
+        self.db = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT sql FROM sqlite_master
+            WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' AND sql IS NOT NULL
+            ORDER BY type = 'view'
+        ''')
+        for (sql,) in cursor.fetchall():
+            self.db.execute(sql)
+        self.db.execute('ANALYZE')  # 创建 sqlite_stat1
+        # 主键和 UNIQUE 约束自动创建的索引
+        self.constraints = {
+            name: spec for name, spec in list_indexes(self.db, manual_only=False).items()
+            if name.startswith('sqlite_autoindex')
+        }
+        self.current = set()
+
+    def use(self, indexes):
+        """切换到给定的索引组合 {索引名: (表名, 字段)}"""
+        for name in self.current - set(indexes):
+            self.db.execute(f'DROP INDEX {name}')
+        for name in set(indexes) - self.current:
+            table, columns = indexes[name]
+            self.db.execute(f'CREATE INDEX {name} ON {table}({", ".join(columns)})')
+        self.current = set(indexes)
+
+        self.db.execute('DELETE FROM sqlite_stat1')
+        self.db.executemany('INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, NULL, ?)',
+                            [(table, str(count)) for table, count in self.rows.items()])
+        self.db.executemany('INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)', [
+            (table, name, self.stats.stat(table, columns))
+            for name, (table, columns) in {**self.constraints, **indexes}.items()
+        ])
+        self.db.commit()
+        self.db.execute('ANALYZE sqlite_schema')  # 重新加载统计
+
+
+def explain(db, sql, params):
+    """查询计划：(步骤ID, 上层步骤ID, 说明) 列表"""
+    return [(row[0], row[1], row[3]) for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+
+
+def analyze_plan(plan, sql, rows, stats, indexes):
+    """从查询计划中找出全表扫描、临时B树和使用的索引，并估算查询成本（读取的行数）
+
+    同一上层步骤下的 SCAN/SEARCH 是嵌套循环：后面的步骤对前面步骤的每一行执行一次。
+    CTE、子查询和视图本身的扫描不计成本，其中的表按各自的步骤计算。
+    """
+    names = aliases(sql)
+    result = {'scans': [], 'temp_btrees': [], 'indexes': set(), 'cost': 0.0}
+    outer = {}
+    for _, parent, detail in plan:
+        loops = outer.get(parent, 1.0)
+        if detail.startswith('USE TEMP B-TREE'):
+            result['temp_btrees'].append(detail[len('USE TEMP B-TREE FOR '):])
+            result['cost'] += loops * math.log2(loops + 2)
+            continue
+        match = PLAN_STEP.match(detail)
+        if not match:
+            continue
+        operation, name, using, condition = match.groups()
+        tables = [table for table in names.get(name, {name}) if table in rows]
+        if not tables:
+            continue
+        table = max(tables, key=lambda table: rows[table])
+        total = rows[table]
+        using = using or ''
+        index_name = using.split()[-1] if using.startswith(('INDEX', 'COVERING INDEX')) else None
+        if index_name:
+            result['indexes'].add(index_name)
+
+        if operation == 'SCAN':
+            matched = total
+            if not using:
+                result['scans'].append((table, total))
+                step = total
+            elif 'COVERING' in using:
+                step = total / 2
+            else:
+                step = total * 2  # 按索引顺序逐行回表
+        else:
+            # 索引前缀上的条件：等值条件，或跳跃扫描的 ANY(字段)，之后可能还有一个范围条件
+            terms = condition.split(' AND ') if condition else []
+            prefix, skipped = 0, 1
+            for term in terms:
+                if term.startswith('ANY('):
+                    skipped *= stats.distinct(table, (term[4:-1],))
+                elif not re.search(r'(?<![<>!])=', term):
+                    break
+                prefix += 1
+            ranged = any(re.search(r'[<>]', term) for term in terms)
+            if using.startswith(('INTEGER PRIMARY KEY', 'PRIMARY KEY')) or (
+                    index_name and index_name.startswith('sqlite_autoindex') and prefix):
+                matched = 1 if not ranged else total / 4
+            elif index_name in indexes and prefix:
+                index_table, columns = indexes[index_name]
+                matched = stats.averages(index_table, columns[:prefix])[-1]
+                if loops == 1:
+                    # 单次查找：热门卖家和 SKU 的商品远多于平均值，取平均值和最大值的几何平均
+                    matched = math.sqrt(matched * stats.largest(index_table, columns[:prefix]))
+                matched = min(total, matched * skipped)
+            else:
+                matched = total / 10 ** prefix
+            if ranged:
+                matched /= 4
+            matched = max(1.0, matched)
+            if using.startswith('AUTOMATIC'):
+                step = total + matched  # 每次查询临时建索引
+            else:
+                step = math.log2(total + 2) + matched * (1 if 'COVERING' in using or 'PRIMARY' in using else 2)
+        result['cost'] += loops * step
+        outer[parent] = loops * matched
+    return result
+
+
+def evaluate(db, params, rows, stats, indexes):
+    """所有查询在给定索引下的计划分析，以及加权总成本（查询成本加索引维护成本）"""
+    results = {}
+    total = 0.0
+    for name, _, weight, sql in QUERIES:
+        plan = explain(db, sql, params)
+        results[name] = analyze_plan(plan, sql, rows, stats, indexes)
+        results[name]['plan'] = plan
+        total += weight * results[name]['cost']
+    for table, _ in indexes.values():
+        total += WRITE_WEIGHTS.get(table, 1) * math.log2(rows.get(table, 0) + 2)
+    return total, results
+
+
+def advise(shadow, params, rows, stats, existing):
+    """贪心选择索引：每次加入使总成本下降最多的候选索引，再去掉不再需要的索引，直到不能再降低"""
+    candidates = {**existing}
+    candidates.update({name: (table, columns) for name, table, columns in CANDIDATE_INDEXES})
+    # 字段完全相同的候选只保留一个（优先现有索引的名称）
+    seen = {}
+    for name, spec in list(candidates.items()):
+        if spec in seen:
+            del candidates[name]
+        else:
+            seen[spec] = name
+
+    def cost(indexes):
+        shadow.use(indexes)
+        return evaluate(shadow.db, params, rows, stats, indexes)[0]
+
+    chosen = {}
+    best = cost(chosen)
+    while True:
+        improved = False
+        trials = [(cost({**chosen, name: spec}), name) for name, spec in candidates.items() if name not in chosen]
+        if trials:
+            trial_cost, name = min(trials)
+            if trial_cost < best - 1:
+                chosen[name] = candidates[name]
+                best = trial_cost
+                improved = True
+        for name in list(chosen):
+            remaining = {key: value for key, value in chosen.items() if key != name}
+            trial_cost = cost(remaining)
+            if trial_cost <= best:
+                chosen = remaining
+                best = trial_cost
+                improved = True
+        if not improved:
+            return chosen, best
+
+
+def redundant_indexes(existing, primary_keys):
+    """重复的索引：只包含 INTEGER PRIMARY KEY 的索引，以及字段是同表另一个索引前缀的索引"""
+    redundant = {}
+    for name, (table, columns) in existing.items():
+        if columns == (primary_keys.get(table),):
+            redundant[name] = '与 INTEGER PRIMARY KEY 重复'
+            continue
+        for other, (other_table, other_columns) in existing.items():
+            if other != name and other_table == table and len(other_columns) > len(columns) \
+                    and other_columns[:len(columns)] == columns:
+                redundant[name] = f'是 {other}({", ".join(other_columns)}) 的前缀'
+                break
+    return redundant
+
+
+def benchmark(conn, params, repeat):
+    """每个只读查询的平均耗时(毫秒)；写语句只检查查询计划，不执行"""
+    timings = {}
+    for name, _, _, sql in QUERIES:
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        # 第一次执行预热页缓存；超过1秒的慢查询不再重复，直接使用这次的耗时
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        elapsed = time.perf_counter() - start
+        if elapsed > 1:
+            timings[name] = elapsed * 1000
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params).fetchall()
+        timings[name] = (time.perf_counter() - start) / repeat * 1000
+    return timings
+
+
+def apply_indexes(conn, create, drop):
+    """在线建立和删除索引：每个索引一个短事务，期间其他程序照常读取，写入等待当前索引完成"""
+    for name, (table, columns) in create.items():
+        start = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({", ".join(columns)})')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"已建立索引 {name} ON {table}({', '.join(columns)})，耗时 {time.time() - start:.1f} 秒")
+    for name in drop:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"已删除索引 {name}")
+    start = time.time()
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA optimize')
+    conn.commit()
+    print(f"已更新查询统计（ANALYZE），耗时 {time.time() - start:.1f} 秒")
+
+
+def print_report(results, existing, redundant):
+    print("\n=== 查询计划 ===")
+    for name, source, weight, _ in QUERIES:
+        result = results[name]
+        problems = [f"全表扫描 {table}({count} 行)" for table, count in result['scans'] if count > 1000]
+        problems += [f"临时B树({usage})" for usage in result['temp_btrees']]
+        print(f"- {name} [{source}，每轮约 {weight} 次]: 估算读取 {result['cost']:.0f} 行"
+              + (f"，索引: {', '.join(sorted(result['indexes']))}" if result['indexes'] else "")
+              + (f"\n    问题: {'；'.join(problems)}" if problems else ""))
+
+    used = set().union(*(result['indexes'] for result in results.values()))
+    print("\n=== 现有索引 ===")
+    for name, (table, columns) in sorted(existing.items()):
+        notes = []
+        if name not in used:
+            notes.append('没有查询使用')
+        if name in redundant:
+            notes.append(redundant[name])
+        print(f"- {name} ON {table}({', '.join(columns)})" + (f"：{'，'.join(notes)}" if notes else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='用 EXPLAIN QUERY PLAN 检查 API 和爬虫的查询，报告全表扫描、临时B树和未使用的索引，并给出建议的索引组合')
+    parser.add_argument('--db', type=str, default=migrations.DB_PATH, help=f'数据库路径，默认 {migrations.DB_PATH}')
+    parser.add_argument('--apply', action='store_true', help='按建议在线建立缺少的索引，并更新查询统计')
+    parser.add_argument('--drop', action='store_true', help='与 --apply 一起使用：同时删除建议之外的现有索引')
+    parser.add_argument('--benchmark', action='store_true', help='测量只读查询的耗时（--apply 时测量建索引前后的耗时）')
+    parser.add_argument('--repeat', type=int, default=5, help='测量耗时时每个查询重复次数，默认5')
+    parser.add_argument('--verbose', action='store_true', help='打印每个查询的完整查询计划')
+    args = parser.parse_args()
+    if args.drop and not args.apply:
+        parser.error('--drop 需要和 --apply 一起使用')
+
+    if not os.path.exists(args.db):
+        parser.error(f"数据库 {args.db} 不存在")
+    migrations.migrate(args.db)
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute('PRAGMA busy_timeout = 30000')
+
+    start = time.time()
+    params = query_params(conn)
+    rows = table_rows(conn)
+    existing = list_indexes(conn)
+    redundant = redundant_indexes(existing, integer_primary_keys(conn))
+    stats = IndexStats(conn, rows)
+    print(f"数据库 {args.db}：" + "，".join(f"{table} {count} 行" for table, count in rows.items() if count))
+
+    # 实际数据库中的查询计划
+    _, results = evaluate(conn, params, rows, stats, existing)
+    print_report(results, existing, redundant)
+    if args.verbose:
+        for name, result in results.items():
+            print(f"\n{name}:\n  " + "\n  ".join(result['plan']))
+
+    shadow = Shadow(conn, rows, stats)
+    shadow.use(existing)
+    current_cost, _ = evaluate(shadow.db, params, rows, stats, existing)
+    proposed, proposed_cost = advise(shadow, params, rows, stats, existing)
+    shadow.use(proposed)
+    _, proposed_results = evaluate(shadow.db, params, rows, stats, proposed)
+
+    print("\n=== 建议的索引组合 ===")
+    for name, (table, columns) in sorted(proposed.items()):
+        benefits = [query for query, result in proposed_results.items() if name in result['indexes']]
+        print(f"- {name} ON {table}({', '.join(columns)})" + ("" if name in existing else "（新建）")
+              + f"：{', '.join(benefits) or '-'}")
+    create = {name: spec for name, spec in proposed.items() if name not in existing}
+    drop = sorted(name for name in existing if name not in proposed)
+    if drop:
+        print(f"建议删除: {', '.join(drop)}")
+    print(f"估算每轮成本（查询读取行数 x 次数 + 索引维护）: {current_cost:.0f} -> {proposed_cost:.0f}，"
+          f"索引数 {len(existing)} -> {len(proposed)}，分析耗时 {time.time() - start:.1f} 秒")
+
+    representative = rows.get('c2c_items', 0) >= MIN_REPRESENTATIVE_ITEMS
+    if not representative:
+        print(f"c2c_items 只有 {rows.get('c2c_items', 0)} 行（少于 {MIN_REPRESENTATIVE_ITEMS}），"
+              f"数据没有代表性，以上建议仅供参考，请在生产数据库的副本上运行")
+    if not args.apply or not representative:
+        if args.benchmark:
+            timings = benchmark(conn, params, args.repeat)
+            print("\n=== 查询耗时 ===")
+            for name, elapsed in timings.items():
+                print(f"- {name}: {elapsed:.2f} ms")
+        if (create or drop) and representative and not args.apply:
+            print("\n使用 --apply 建立缺少的索引" + ("，--apply --drop 同时删除建议之外的索引" if drop else ""))
+        conn.close()
+        return
+
+    before = benchmark(conn, params, args.repeat) if args.benchmark else {}
+    print("\n=== 应用索引 ===")
+    apply_indexes(conn, create, drop if args.drop else [])
+    if args.benchmark:
+        after = benchmark(conn, params, args.repeat)
+        print("\n=== 查询耗时（应用前 -> 应用后） ===")
+        for name in before:
+            print(f"- {name}: {before[name]:.2f} ms -> {after[name]:.2f} ms")
+        print(f"合计: {sum(before.values()):.1f} ms -> {sum(after.values()):.1f} ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
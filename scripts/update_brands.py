@@ -1,127 +1,212 @@
-import sqlite3
+import argparse
+import hashlib
+import os
 import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from spider import migrations  # noqa: E402
+from spider.db_writer import connect  # noqa: E402
+
+TABLES = ('c2c_items', 'c2c_items_archive')
 
 def extract_brand_name(name):
     """从商品名称中提取品牌名"""
     # 移除特殊字符和多余空格
     name = re.sub(r'[【】\[\]（）()]', ' ', name)
     name = ' '.join(name.split())
-    
+
     # 获取第一个空格前的内容作为品牌名
     parts = name.split(' ', 1)
     if parts:
         return parts[0].strip().upper()  # 转为大写以便统一处理
     return None
 
-def update_brands():
-    """更新品牌数据"""
+def load_rules(cursor):
+    """读取品牌规则：按ID顺序的 (品牌ID, 品牌名, 关键词列表)"""
+    cursor.execute('SELECT id, name, keywords FROM brands ORDER BY id')
+    return [(brand_id, name, [keyword.lower() for keyword in keywords.split('|') if keyword])
+            for brand_id, name, keywords in cursor.fetchall()]
+
+def rules_checksum(rules):
+    digest = hashlib.sha256()
+    for brand_id, name, keywords in rules:
+        digest.update(f"{brand_id}\t{name}\t{'|'.join(keywords)}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def match_brand(item_name, rules):
+    """与列表爬虫的 match_brand 规则相同：按品牌ID顺序，商品名称包含任一关键词即匹配"""
+    item_name = item_name.lower()
+    for brand_id, _, keywords in rules:
+        if any(keyword in item_name for keyword in keywords):
+            return brand_id
+    return None
+
+def discover_brands(cursor, rules):
+    """从 SKU 名称的第一个词中发现尚未收录的品牌名"""
+    known = {name.upper() for _, name, _ in rules}
+    cursor.execute('SELECT DISTINCT name FROM skus WHERE name IS NOT NULL')
+    brand_names = set()
+    for (name,) in cursor.fetchall():
+        brand = extract_brand_name(name)
+        if brand and len(brand) >= 2 and brand not in known:  # 忽略太短的品牌名
+            brand_names.add(brand)
+    return sorted(brand_names)
+
+def collect_candidates(cursor, rules, scopes):
+    """按商品名称（而不是每条商品）匹配品牌，写入临时表 brand_candidates
+
+    scopes 为 {表名: 起始商品ID}，只处理ID大于起始ID的商品。返回需要改变品牌的
+    (表名, 商品名称, 原品牌ID, 新品牌ID, 商品数) 列表。
+    """
+    cursor.execute('DROP TABLE IF EXISTS temp.brand_candidates')
+    cursor.execute('CREATE TEMP TABLE brand_candidates (name TEXT PRIMARY KEY, brand_id INTEGER NOT NULL)')
+
+    groups = []
+    for table, start_id in scopes.items():
+        cursor.execute(f'''
+            SELECT name, brand_id, COUNT(*)
+            FROM {table}
+            WHERE id > ? AND name IS NOT NULL
+            GROUP BY name, brand_id
+        ''', (start_id,))
+        groups.extend((table, name, brand_id, count) for name, brand_id, count in cursor.fetchall())
+
+    brands = {}
+    for _, name, _, _ in groups:
+        if name not in brands:
+            brands[name] = match_brand(name, rules)
+    # 没有匹配到任何品牌的商品保留原来的品牌
+    cursor.executemany(
+        'INSERT INTO brand_candidates (name, brand_id) VALUES (?, ?)',
+        [(name, brand_id) for name, brand_id in brands.items() if brand_id is not None]
+    )
+    return [
+        (table, name, old_brand_id, brands[name], count)
+        for table, name, old_brand_id, count in groups
+        if brands[name] is not None and brands[name] != old_brand_id
+    ]
+
+def apply_candidates(conn, table, start_id, chunk_size):
+    """按商品ID分段批量更新品牌，每段一个短事务，返回更新的商品数"""
+    cursor = conn.cursor()
+    updated = 0
+    while True:
+        cursor.execute(f'''
+            SELECT MAX(id) FROM (
+                SELECT id FROM {table}
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            )
+        ''', (start_id, chunk_size))
+        end_id = cursor.fetchone()[0]
+        if end_id is None:
+            break
+        cursor.execute(f'''
+            UPDATE {table}
+            SET brand_id = c.brand_id
+            FROM brand_candidates c
+            WHERE {table}.name = c.name
+              AND {table}.id > ? AND {table}.id <= ?
+              AND {table}.brand_id IS NOT c.brand_id
+        ''', (start_id, end_id))
+        updated += cursor.rowcount
+        conn.commit()
+        start_id = end_id
+    return updated
+
+def update_brands(dry_run=False, discover=False, full=False, chunk_size=5000):
+    """按品牌规则重新匹配商品品牌
+
+    只处理上次运行后新增的商品；品牌规则变化后（或 full=True）处理全部商品。
+    品牌按商品名称匹配，再按商品ID分段批量更新，不会长时间占用写锁。
+    """
+    migrations.migrate()
+    conn = connect()
+    cursor = conn.cursor()
+
     try:
-        conn = sqlite3.connect('./db/bilibili_mall.db')
-        cursor = conn.cursor()
+        rules = load_rules(cursor)
         
-        print("开始处理品牌数据...")
+        if discover:
+            new_brands = discover_brands(cursor, rules)
+            print(f"从 SKU 名称中发现 {len(new_brands)} 个新品牌" + ("：" + "、".join(new_brands) if new_brands else ""))
+            if new_brands and not dry_run:
+                cursor.executemany('INSERT OR IGNORE INTO brands (name, keywords) VALUES (?, ?)',
+                                   [(brand, brand) for brand in new_brands])
+                conn.commit()
+                rules = load_rules(cursor)
+            elif new_brands:
+                # 预览时把新品牌加在规则末尾（与写入后的顺序一致）
+                rules = rules + [(f"新品牌 {brand}", brand, [brand.lower()]) for brand in new_brands]
         
-        # 获取所有商品名称
-        cursor.execute('''
-            SELECT DISTINCT name 
-            FROM skus 
-            WHERE name IS NOT NULL
-        ''')
+        checksum = rules_checksum(rules)
+        cursor.execute('SELECT table_name, high_water_id, rules_checksum FROM brand_tagging_state')
+        states = {table: (high_water_id, last_checksum) for table, high_water_id, last_checksum in cursor.fetchall()}
         
-        # 收集所有可能的品牌名
-        brand_names = set()
-        skipped_names = set()
-        
-        for (name,) in cursor.fetchall():
-            brand = extract_brand_name(name)
-            if brand and len(brand) >= 2:  # 忽略太短的品牌名
-                brand_names.add(brand)
+        scopes = {}
+        high_water = {}
+        for table in TABLES:
+            cursor.execute(f'SELECT MAX(id) FROM {table}')
+            high_water[table] = cursor.fetchone()[0] or 0
+            high_water_id, last_checksum = states.get(table, (None, None))
+            if full or high_water_id is None or last_checksum != checksum:
+                scopes[table] = 0  # 首次运行或品牌规则已变化：处理全部商品
             else:
-                skipped_names.add(name)
+                scopes[table] = high_water_id
         
-        print(f"\n发现 {len(brand_names)} 个可能的品牌名:")
-        for brand in sorted(brand_names):
-            print(f"- {brand}")
+        for table, start_id in scopes.items():
+            print(f"{table}: " + ("全部商品" if start_id == 0 else f"ID 大于 {start_id} 的新商品"))
         
-        print(f"\n跳过 {len(skipped_names)} 个无法解析的商品名:")
-        for name in sorted(skipped_names):
-            print(f"- {name}")
+        start = time.time()
+        changes = collect_candidates(cursor, rules, scopes)
+        brand_names = {brand_id: name for brand_id, name, _ in rules}
+        brand_names[None] = '无品牌'
         
-        # 确认是否继续
-        confirm = input("\n是否继续更新品牌数据？(y/N): ")
-        if confirm.lower() != 'y':
-            print("操作已取消")
+        if dry_run:
+            print(f"\n需要改变品牌的商品名称 {len({name for _, name, _, _, _ in changes})} 个，"
+                  f"商品 {sum(count for *_, count in changes)} 条：")
+            for table, name, old_brand_id, new_brand_id, count in sorted(changes, key=lambda change: -change[4]):
+                print(f"- [{table}] {name}: {brand_names.get(old_brand_id, old_brand_id)} -> "
+                      f"{brand_names.get(new_brand_id, new_brand_id)}（{count} 条）")
+            print("\n预览模式，未修改数据")
             return
         
-        # 开始事务
-        cursor.execute("BEGIN")
+        updated = {}
+        for table, start_id in scopes.items():
+            updated[table] = apply_candidates(conn, table, start_id, chunk_size)
         
-        try:
-            # 创建临时品牌表
-            cursor.execute('''
-                CREATE TEMP TABLE new_brands (
-                    name TEXT PRIMARY KEY,
-                    keywords TEXT
-                )
-            ''')
-            
-            # 插入新品牌
-            for brand in brand_names:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO new_brands (name, keywords)
-                    VALUES (?, ?)
-                ''', (brand, brand))
-            
-            # 插入到正式品牌表
-            cursor.execute('''
-                INSERT OR IGNORE INTO brands (name, keywords)
-                SELECT name, keywords FROM new_brands
-            ''')
-            
-            # 获取品牌ID映射
+        # 本次开始时的最大ID：之后新增的商品下次处理
+        for table in TABLES:
             cursor.execute('''
-                SELECT id, name FROM brands
-                WHERE name IN (
-                    SELECT DISTINCT substr(s.name, 1, instr(s.name || ' ', ' ') - 1)
-                    FROM skus s
-                )
-            ''')
-            brand_map = {name.upper(): id for id, name in cursor.fetchall()}
-            
-            # 更新商品的品牌ID
-            updated = 0
-            skipped = 0
-            
-            cursor.execute('SELECT id, name FROM c2c_items')
-            for item_id, name in cursor.fetchall():
-                brand = extract_brand_name(name)
-                if brand and brand in brand_map:
-                    cursor.execute('''
-                        UPDATE c2c_items 
-                        SET brand_id = ? 
-                        WHERE id = ?
-                    ''', (brand_map[brand], item_id))
-                    updated += 1
-                else:
-                    skipped += 1
-            
-            conn.commit()
-            
-            print(f"\n更新完成!")
-            print(f"- 添加了 {len(brand_names)} 个新品牌")
-            print(f"- 更新了 {updated} 个商品的品牌")
-            print(f"- 跳过了 {skipped} 个商品")
-            
-        except Exception as e:
-            conn.rollback()
-            print(f"发生错误: {e}")
-            raise
-            
+                INSERT INTO brand_tagging_state (table_name, high_water_id, rules_checksum, updated_ms)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(table_name) DO UPDATE SET
+                    high_water_id = excluded.high_water_id,
+                    rules_checksum = excluded.rules_checksum,
+                    updated_ms = excluded.updated_ms
+            ''', (table, high_water[table], checksum, int(time.time() * 1000)))
+        conn.commit()
+        
+        print(f"\n更新完成，耗时 {time.time() - start:.1f} 秒")
+        for table, count in updated.items():
+            print(f"- {table}: 更新了 {count} 条商品的品牌")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"发生错误: {e}")
+        raise
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        cursor.close()
+        conn.close()
 
 if __name__ == "__main__":
-    update_brands() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='按品牌规则（brands 表的关键词）重新匹配商品的品牌')
+    parser.add_argument('--dry-run', action='store_true', help='只列出将要改变品牌的商品，不修改数据')
+    parser.add_argument('--discover', action='store_true', help='先把 SKU 名称第一个词中尚未收录的品牌加入 brands 表')
+    parser.add_argument('--full', action='store_true', help='处理全部商品，默认只处理上次运行后新增的商品（品牌规则变化时自动处理全部）')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='每个事务更新的商品ID范围大小，默认5000')
+    args = parser.parse_args()
+    update_brands(dry_run=args.dry_run, discover=args.discover, full=args.full, chunk_size=args.chunk_size)
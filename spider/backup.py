@@ -0,0 +1,304 @@
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from spider.db_writer import DB_PATH, connect
+
+BACKUP_DIR = './backups'
+SNAPSHOT_PREFIX = 'bilibili_mall-'
+SNAPSHOT_SUFFIX = '.db.gz'
+CHECKSUM_SUFFIX = '.sha256'
+MIN_INTERVAL_HOURS = 1  # 每次都是全量快照，间隔按小时/天计
+
+
+class LockProbe(threading.Thread):
+    """备份期间定时申请写锁（BEGIN IMMEDIATE 后立即回滚），记录写入方等锁的时间"""
+    def __init__(self, path, interval=0.05):
+        super().__init__(name='backup-lock-probe', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.waits = []
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            while not self.stopped.wait(self.interval):
+                start = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                self.waits.append(time.perf_counter() - start)
+                conn.execute('ROLLBACK')
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return {
+            'probes': len(self.waits),
+            'lock_wait_max_ms': max(self.waits, default=0) * 1000,
+            'lock_wait_avg_ms': sum(self.waits) / len(self.waits) * 1000 if self.waits else 0,
+        }
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot(db_path, target, method='backup', pages=256, sleep=0.05, check=True):
+    """把数据库在线复制到 target，返回耗时统计
+
+    method='backup' 使用 SQLite 在线备份接口，每步复制 pages 页，步间休眠 sleep 秒让出磁盘；
+    复制期间保持一个读事务，其他进程的写入不会让备份从头开始（WAL 模式下读不阻塞写）。
+    method='vacuum' 使用 VACUUM INTO，一条语句完成，顺便整理碎片，但不能限速。
+    check=False 时跳过快照的完整性检查。
+    """
+    src = connect(db_path)
+    stats = {'method': method, 'wal_before': file_size(db_path + '-wal')}
+    start = time.perf_counter()
+    try:
+        if method == 'vacuum':
+            src.execute('VACUUM INTO ?', (target,))
+            stats['steps'] = 1
+            stats['step_max_ms'] = (time.perf_counter() - start) * 1000
+        else:
+            steps = []
+            last = [time.perf_counter()]
+
+            def progress(status, remaining, total):
+                steps.append((time.perf_counter() - last[0]) * 1000)
+                stats['pages'] = total
+                if remaining:
+                    time.sleep(sleep)  # 限速：步间让出磁盘，休眠不计入单步耗时
+                last[0] = time.perf_counter()
+
+            # 固定读快照：整个备份期间看到的是同一个一致的数据库版本
+            src.execute('BEGIN')
+            src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            dst = sqlite3.connect(target)
+            try:
+                src.backup(dst, pages=pages, progress=progress)
+            finally:
+                dst.close()
+                src.rollback()
+            stats['steps'] = len(steps)
+            stats['step_max_ms'] = max(steps, default=0)
+    finally:
+        stats['snapshot_seconds'] = time.perf_counter() - start
+        stats['wal_after'] = file_size(db_path + '-wal')
+        src.close()
+
+    # 快照改为单文件（回滚日志）模式，并检查完整性
+    conn = sqlite3.connect(target)
+    try:
+        conn.execute('PRAGMA journal_mode = DELETE')
+        result = conn.execute('PRAGMA quick_check').fetchone()[0] if check else 'ok'
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise sqlite3.DatabaseError(f"快照完整性检查失败: {result}")
+    stats['raw_size'] = file_size(target)
+    return stats
+
+
+def compress(source, target, level=6):
+    """gzip 压缩到 target（先写临时文件再改名），并写入 sha256sum 格式的校验文件"""
+    temp = target + '.tmp'
+    with open(source, 'rb') as src, open(temp, 'wb') as raw:
+        with gzip.GzipFile(filename=os.path.basename(source), mode='wb', compresslevel=level, fileobj=raw) as gz:
+            shutil.copyfileobj(src, gz, 1024 * 1024)
+        raw.flush()
+        os.fsync(raw.fileno())
+    checksum = sha256_file(temp)
+    os.replace(temp, target)
+    with open(target + CHECKSUM_SUFFIX, 'w') as f:
+        f.write(f"{checksum}  {os.path.basename(target)}\n")
+    return checksum
+
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    """按时间从旧到新返回快照路径"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(name for name in os.listdir(backup_dir)
+                   if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX))
+    return [os.path.join(backup_dir, name) for name in names]
+
+
+def verify(path):
+    """校验快照的 sha256，不一致时抛出 ValueError"""
+    checksum_path = path + CHECKSUM_SUFFIX
+    if not os.path.exists(checksum_path):
+        raise ValueError(f"缺少校验文件: {checksum_path}")
+    with open(checksum_path) as f:
+        expected = f.read().split()[0]
+    actual = sha256_file(path)
+    if actual != expected:
+        raise ValueError(f"校验失败: {path} 的 sha256 为 {actual}，应为 {expected}")
+    return actual
+
+
+def rotate(backup_dir=BACKUP_DIR, keep=14):
+    """只保留最新的 keep 个快照，返回删除的快照"""
+    removed = []
+    snapshots = list_snapshots(backup_dir)
+    for path in snapshots[:max(len(snapshots) - keep, 0)]:
+        for name in (path, path + CHECKSUM_SUFFIX):
+            if os.path.exists(name):
+                os.remove(name)
+        removed.append(path)
+    return removed
+
+
+def backup(db_path=DB_PATH, backup_dir=BACKUP_DIR, method='backup', pages=256, sleep=0.05,
+           keep=14, level=6, probe_locks=False):
+    """生成一个压缩、带校验的快照并按保留数量轮换，返回统计信息"""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = SNAPSHOT_PREFIX + time.strftime('%Y%m%d-%H%M%S')
+    raw_path = os.path.join(backup_dir, name + '.db.tmp')
+    target = os.path.join(backup_dir, name + SNAPSHOT_SUFFIX)
+    for path in (raw_path, raw_path + '-journal'):
+        if os.path.exists(path):
+            os.remove(path)  # 上次中断留下的临时文件
+
+    probe = None
+    if probe_locks:
+        probe = LockProbe(db_path)
+        probe.start()
+    try:
+        stats = snapshot(db_path, raw_path, method=method, pages=pages, sleep=sleep)
+    finally:
+        if probe:
+            probe_stats = probe.stop()
+    if probe:
+        stats.update(probe_stats)
+
+    try:
+        start = time.perf_counter()
+        stats['sha256'] = compress(raw_path, target, level=level)
+        stats['compress_seconds'] = time.perf_counter() - start
+    finally:
+        os.remove(raw_path)
+    stats['path'] = target
+    stats['size'] = file_size(target)
+    stats['removed'] = rotate(backup_dir, keep)
+    return stats
+
+
+def print_stats(stats):
+    print(f"快照已生成: {stats['path']}")
+    print(f"- 方式 {stats['method']}，{stats['steps']} 步" + (f"（共 {stats['pages']} 页）" if 'pages' in stats else "")
+          + f"，复制耗时 {stats['snapshot_seconds']:.2f} 秒，单步最长 {stats['step_max_ms']:.1f} ms")
+    print(f"- 压缩耗时 {stats['compress_seconds']:.2f} 秒，{stats['raw_size'] / 1024 / 1024:.1f} MB -> "
+          f"{stats['size'] / 1024 / 1024:.1f} MB，sha256 {stats['sha256'][:16]}")
+    print(f"- 备份期间 WAL 文件 {stats['wal_before'] / 1024:.0f} KB -> {stats['wal_after'] / 1024:.0f} KB"
+          "（读快照期间检查点无法回收 WAL）")
+    if 'probes' in stats:
+        print(f"- 写锁探测 {stats['probes']} 次，等锁最长 {stats['lock_wait_max_ms']:.1f} ms，"
+              f"平均 {stats['lock_wait_avg_ms']:.2f} ms")
+    for path in stats['removed']:
+        print(f"- 已删除旧快照: {os.path.basename(path)}")
+
+
+def restore(snapshot_path, db_path=DB_PATH):
+    """从快照恢复数据库
+
+    先校验 sha256 并解压到数据库所在目录的临时文件。数据库不存在时直接改名；
+    否则通过备份接口一次性写入现有数据库（持有写锁直到完成），其他进程的连接
+    无需重启即可看到恢复后的数据，也不会与旧的 WAL 文件混用。
+    """
+    start = time.perf_counter()
+    verify(snapshot_path)
+    temp = db_path + '.restore'
+    with gzip.open(snapshot_path, 'rb') as src, open(temp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    try:
+        conn = sqlite3.connect(temp)
+        try:
+            result = conn.execute('PRAGMA quick_check').fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"快照完整性检查失败: {result}")
+            if not os.path.exists(db_path):
+                conn.close()
+                os.replace(temp, db_path)
+            else:
+                dst = connect(db_path)
+                try:
+                    conn.backup(dst)
+                finally:
+                    dst.close()
+        finally:
+            conn.close()
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='在线备份数据库：分步复制、压缩、校验并轮换快照；也可从快照恢复',
+                                     allow_abbrev=False)  # 旧的 --interval（秒）不能被当成 --interval-hours
+    parser.add_argument('--db', type=str, default=DB_PATH, help=f'数据库路径，默认 {DB_PATH}')
+    parser.add_argument('--dir', type=str, default=BACKUP_DIR, help=f'快照目录，默认 {BACKUP_DIR}')
+    parser.add_argument('--method', choices=('backup', 'vacuum'), default='backup',
+                        help='backup: 在线备份接口分步复制（可限速，默认）；vacuum: VACUUM INTO（整理碎片，不限速）')
+    parser.add_argument('--pages', type=int, default=256, help='每步复制的页数，默认256')
+    parser.add_argument('--sleep', type=float, default=0.05, help='每步之间的休眠时间(秒)，默认0.05秒')
+    parser.add_argument('--keep', type=int, default=14, help='保留的快照数，默认14')
+    parser.add_argument('--level', type=int, default=6, help='gzip 压缩级别，默认6')
+    parser.add_argument('--interval-hours', type=float, default=0,
+                        help=f'定时备份的间隔(小时，至少{MIN_INTERVAL_HOURS})；每次都是全量复制、压缩和校验，默认0表示只备份一次')
+    parser.add_argument('--probe-locks', action='store_true', help='备份期间探测写锁等待时间')
+    parser.add_argument('--list', action='store_true', help='列出快照并校验')
+    parser.add_argument('--restore', type=str, metavar='SNAPSHOT', help='从指定快照恢复数据库')
+    args = parser.parse_args()
+    if args.interval_hours and args.interval_hours < MIN_INTERVAL_HOURS:
+        parser.error(f"--interval-hours 至少为 {MIN_INTERVAL_HOURS} 小时：每次备份都是全量快照")
+
+    if args.list:
+        for path in list_snapshots(args.dir):
+            try:
+                verify(path)
+                status = '校验通过'
+            except ValueError as e:
+                status = str(e)
+            print(f"{os.path.basename(path)}  {file_size(path) / 1024 / 1024:.1f} MB  {status}")
+    elif args.restore:
+        try:
+            elapsed = restore(args.restore, args.db)
+        except (ValueError, sqlite3.DatabaseError) as e:
+            parser.error(str(e))
+        print(f"已从 {args.restore} 恢复到 {args.db}，耗时 {elapsed:.2f} 秒")
+    else:
+        options = dict(db_path=args.db, backup_dir=args.dir, method=args.method, pages=args.pages,
+                       sleep=args.sleep, keep=args.keep, level=args.level, probe_locks=args.probe_locks)
+        if not args.interval_hours:
+            print_stats(backup(**options))
+        else:
+            interval = args.interval_hours * 3600
+            print(f"定时备份已启动: 每 {args.interval_hours:g} 小时备份 {args.db} 到 {args.dir}，保留 {args.keep} 个快照")
+            try:
+                next_run = time.monotonic()
+                while True:
+                    try:
+                        print_stats(backup(**options))
+                    except (sqlite3.Error, OSError) as e:
+                        print(f"备份失败: {e}")
+                    # 按固定时刻安排下一次，备份本身的耗时不累积到间隔里
+                    next_run += interval
+                    time.sleep(max(next_run - time.monotonic(), 0))
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,154 @@
+import random
+import threading
+import time
+
+
+class Credential:
+    """单个 Cookie 的令牌桶和健康状态"""
+    def __init__(self, name, cookie, burst):
+        self.name = name
+        self.cookie = cookie
+        self.tokens = burst  # 当前可用令牌数
+        self.refilled_at = time.monotonic()
+        self.health = 1.0  # 健康分，失败时下降，成功时恢复
+        self.benched_until = 0  # 停用截止时间（monotonic）
+        self.bench_count = 0  # 连续停用次数，用于计算停用时长
+        self.requests = 0
+        self.failures = 0
+
+    def apply_headers(self, headers):
+        """返回带有该 Cookie 的请求头"""
+        headers = dict(headers)
+        if self.cookie:
+            headers['cookie'] = self.cookie
+        return headers
+
+
+class CredentialPool:
+    """Cookie 池：每个 Cookie 有独立的令牌桶限速，请求分散到健康的 Cookie 上
+
+    接口返回非0 code 或 HTTP 错误时降低健康分，健康分过低的 Cookie 自动停用一段时间，
+    多次停用时停用时长翻倍。多个抓取线程可以共用同一个 Cookie 池。
+    """
+    def __init__(self, cookies):
+        self.rate = 0.5  # 每个 Cookie 每秒补充的令牌数
+        self.burst = 1  # 每个 Cookie 最多积攒的令牌数
+        self.jitter = 0.5  # 等待令牌时额外的随机等待(秒)，避免请求过于规律
+        self.failure_penalty = 0.5  # 失败时健康分乘以该系数
+        self.recovery = 0.2  # 成功时健康分向1恢复的比例
+        self.bench_health = 0.3  # 健康分低于该值时停用
+        self.bench_seconds = 300  # 首次停用时长(秒)
+        self.max_bench_seconds = 7200  # 最长停用时长(秒)
+        self.lock = threading.Lock()
+        # 未提供 Cookie 时使用一个不带 Cookie 的凭据
+        cookies = [cookie for cookie in cookies if cookie] or [None]
+        self.credentials = [
+            Credential(f"cookie#{index + 1}", cookie, self.burst)
+            for index, cookie in enumerate(cookies)
+        ]
+
+    @classmethod
+    def from_file(cls, path):
+        """从文件读取 Cookie，每行一个，忽略空行和 # 开头的注释"""
+        with open(path, encoding='utf-8') as f:
+            cookies = [
+                line.strip() for line in f
+                if line.strip() and not line.strip().startswith('#')
+            ]
+        if not cookies:
+            raise ValueError(f"Cookie 文件 {path} 中没有可用的 Cookie")
+        return cls(cookies)
+
+    def set_interval(self, min_sleep, max_sleep):
+        """按原有的请求间隔设置每个 Cookie 的速率：平均间隔为 (min_sleep + max_sleep) / 2"""
+        with self.lock:
+            self.rate = 2 / max(min_sleep + max_sleep, 0.001)
+            self.jitter = max(max_sleep - min_sleep, 0) / 2
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def refill(self, credential, now):
+        """按经过的时间补充令牌"""
+        elapsed = now - credential.refilled_at
+        credential.tokens = min(self.burst, credential.tokens + elapsed * self.rate)
+        credential.refilled_at = now
+
+    def acquire(self):
+        """取得一个有令牌的健康 Cookie，没有时等待；优先使用健康分高的 Cookie"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                ready = []
+                wait = None
+                for credential in self.credentials:
+                    if credential.benched_until > now:
+                        benched_wait = credential.benched_until - now
+                        wait = benched_wait if wait is None else min(wait, benched_wait)
+                        continue
+                    self.refill(credential, now)
+                    if credential.tokens >= 1:
+                        ready.append(credential)
+                    else:
+                        token_wait = (1 - credential.tokens) / self.rate
+                        wait = token_wait if wait is None else min(wait, token_wait)
+
+                if ready:
+                    best_health = max(credential.health for credential in ready)
+                    credential = random.choice([c for c in ready if c.health == best_health])
+                    credential.tokens -= 1
+                    credential.requests += 1
+                    return credential
+
+            time.sleep(wait + random.uniform(0, self.jitter))
+
+    def report(self, credential, success):
+        """记录请求结果，更新健康分，必要时停用该 Cookie"""
+        with self.lock:
+            if success:
+                credential.health += (1 - credential.health) * self.recovery
+                if credential.health >= 0.9:
+                    credential.bench_count = 0
+                return
+
+            credential.failures += 1
+            credential.health *= self.failure_penalty
+            if credential.health < self.bench_health:
+                credential.bench_count += 1
+                bench_seconds = min(
+                    self.bench_seconds * 2 ** (credential.bench_count - 1),
+                    self.max_bench_seconds
+                )
+                credential.benched_until = time.monotonic() + bench_seconds
+                credential.tokens = 0
+                # 恢复后处于观察期，再次失败会立即停用
+                credential.health = self.bench_health
+                print(f"{credential.name} 连续异常，停用 {bench_seconds} 秒")
+
+    def healthy_count(self):
+        """当前未停用的 Cookie 数量"""
+        with self.lock:
+            now = time.monotonic()
+            return sum(1 for credential in self.credentials if credential.benched_until <= now)
+
+    def get_stats(self):
+        """返回各 Cookie 的请求数、失败数、健康分和剩余停用时间"""
+        with self.lock:
+            now = time.monotonic()
+            return [
+                {
+                    'name': credential.name,
+                    'requests': credential.requests,
+                    'failures': credential.failures,
+                    'health': round(credential.health, 3),
+                    'benched_seconds': max(0, round(credential.benched_until - now)),
+                }
+                for credential in self.credentials
+            ]
+
+    def print_stats(self):
+        """输出各 Cookie 的状态"""
+        for stats in self.get_stats():
+            status = f"停用中（剩余{stats['benched_seconds']}秒）" if stats['benched_seconds'] else "可用"
+            print(f"{stats['name']}: 请求 {stats['requests']}，失败 {stats['failures']}，"
+                  f"健康分 {stats['health']:.2f}，{status}")
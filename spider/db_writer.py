@@ -0,0 +1,433 @@
+import argparse
+import importlib
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from spider import log
+
+DB_PATH = './db/bilibili_mall.db'
+
+# 写服务返回的错误类型，客户端按名称还原为对应的 sqlite3 异常
+SQLITE_ERRORS = {
+    'IntegrityError': sqlite3.IntegrityError,
+    'OperationalError': sqlite3.OperationalError,
+    'ProgrammingError': sqlite3.ProgrammingError,
+}
+
+# 过程任务：先读后写、需要读到本事务中刚写入的数据的写入，不能事先生成语句，按名称在写连接上执行。
+# 值为 "模块:类"，类用写连接创建（每个写连接一次），调用时传入请求的参数，返回可序列化为 JSON 的结果
+PROCEDURES = {
+    'list_page': 'spider.list_writer:PageWriter',  # 列表爬虫保存一页商品
+}
+
+
+def connect(path=DB_PATH, busy_timeout=30):
+    """打开数据库连接
+
+    使用 WAL 模式，读连接不阻塞写入，写入也不阻塞读；写锁被占用时最多等待 busy_timeout 秒，
+    而不是立即报 database is locked。
+    """
+    conn = sqlite3.connect(path, timeout=busy_timeout)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')  # WAL 模式下只在检查点时 fsync，断电不会损坏数据库
+    return conn
+
+
+class WriterStats:
+    """写入统计：等锁时间、每次提交的任务数、提交耗时"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commits = 0
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.statements = 0
+        self.max_batch = 0
+        self.lock_wait_total = 0
+        self.lock_wait_max = 0
+        self.commit_total = 0
+        self.commit_max = 0
+
+    def record(self, jobs, failed_jobs, statements, lock_wait, commit_time):
+        with self.lock:
+            self.commits += 1
+            self.jobs += jobs
+            self.failed_jobs += failed_jobs
+            self.statements += statements
+            self.max_batch = max(self.max_batch, jobs)
+            self.lock_wait_total += lock_wait
+            self.lock_wait_max = max(self.lock_wait_max, lock_wait)
+            self.commit_total += commit_time
+            self.commit_max = max(self.commit_max, commit_time)
+
+    def snapshot(self):
+        """当前统计，时间单位为毫秒"""
+        with self.lock:
+            commits = self.commits or 1
+            return {
+                'commits': self.commits,
+                'jobs': self.jobs,
+                'failed_jobs': self.failed_jobs,
+                'statements': self.statements,
+                'avg_batch': round(self.jobs / commits, 2),
+                'max_batch': self.max_batch,
+                'avg_lock_wait_ms': round(self.lock_wait_total / commits * 1000, 2),
+                'max_lock_wait_ms': round(self.lock_wait_max * 1000, 2),
+                'avg_commit_ms': round(self.commit_total / commits * 1000, 2),
+                'max_commit_ms': round(self.commit_max * 1000, 2),
+            }
+
+    def print_stats(self):
+        print_stats(self.snapshot())
+
+
+def print_stats(stats):
+    print(f"写入统计: 提交 {stats['commits']} 次，任务 {stats['jobs']} 个（失败 {stats['failed_jobs']}），"
+          f"语句 {stats['statements']} 条，每次提交平均 {stats['avg_batch']} 个任务（最多 {stats['max_batch']}），"
+          f"等锁平均 {stats['avg_lock_wait_ms']} ms（最长 {stats['max_lock_wait_ms']} ms），"
+          f"提交平均 {stats['avg_commit_ms']} ms（最长 {stats['max_commit_ms']} ms）")
+
+
+class DbWriter:
+    """单写线程：独占写连接，把排队的写任务合并到一个事务中提交（组提交）
+
+    每个写任务是一组 (sql, params) 或一个过程任务（PROCEDURES），在事务内的 SAVEPOINT 中执行，
+    任务之间互不影响：某个任务出错只回滚该任务，对应的 Future 抛出异常，其余任务照常提交。
+    Future 的结果为每条语句的 rowcount 和 lastrowid，过程任务为过程的返回值。
+    """
+    def __init__(self, path=DB_PATH, max_batch=200, max_delay=0.005, busy_timeout=30):
+        self.path = path
+        self.max_batch = max_batch  # 每个事务最多合并的任务数
+        self.max_delay = max_delay  # 收到第一个任务后等待更多任务的时间(秒)
+        self.busy_timeout = busy_timeout  # 其他进程占用写锁时的最长等待时间(秒)
+        self.stats = WriterStats()
+        self.procedures = {}  # 过程名 -> 用写连接创建的过程对象
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, statements):
+        """提交写任务，返回 Future，不等待提交完成"""
+        future = Future()
+        self.queue.put((list(statements), future))
+        return future
+
+    def execute(self, statements):
+        """提交写任务并等待事务提交，返回每条语句的 rowcount 和 lastrowid"""
+        return self.submit(statements).result()
+
+    def submit_procedure(self, name, **args):
+        """提交过程任务，返回 Future，不等待提交完成"""
+        if name not in PROCEDURES:
+            raise sqlite3.ProgrammingError(f"未知的过程任务: {name}")
+        future = Future()
+        self.queue.put(({'procedure': name, 'args': args}, future))
+        return future
+
+    def call(self, name, **args):
+        """提交过程任务并等待事务提交，返回过程的结果"""
+        return self.submit_procedure(name, **args).result()
+
+    def wait(self, future):
+        """等待 submit 返回的 Future 完成"""
+        return future.result()
+
+    def run_procedure(self, conn, name, args):
+        procedure = self.procedures.get(name)
+        if procedure is None:
+            module, cls = PROCEDURES[name].split(':')
+            procedure = self.procedures[name] = getattr(importlib.import_module(module), cls)(conn)
+        return procedure(**args)
+
+    def run(self):
+        conn = connect(self.path, self.busy_timeout)
+        conn.isolation_level = None  # 手动控制事务
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            jobs = [job]
+            # 等待 max_delay 秒收集更多任务，一起提交
+            deadline = time.perf_counter() + self.max_delay
+            while len(jobs) < self.max_batch:
+                try:
+                    job = self.queue.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.queue.put(None)
+                    break
+                jobs.append(job)
+            self.write_batch(conn, jobs)
+        conn.close()
+
+    def write_batch(self, conn, jobs):
+        """在一个事务中执行一批任务并提交"""
+        start = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')  # 立即取得写锁，等锁时间计入统计
+        except sqlite3.Error as e:
+            for _, future in jobs:
+                future.set_exception(e)
+            self.stats.record(len(jobs), len(jobs), 0, time.perf_counter() - start, 0)
+            return
+        lock_wait = time.perf_counter() - start
+        
+        outcomes = []
+        statement_count = 0
+        for statements, future in jobs:
+            conn.execute('SAVEPOINT job')
+            try:
+                if isinstance(statements, dict):
+                    results = self.run_procedure(conn, statements['procedure'], statements['args'])
+                else:
+                    results = []
+                    for sql, params in statements:
+                        cursor = conn.execute(sql, params or ())
+                        results.append({'rowcount': cursor.rowcount, 'lastrowid': cursor.lastrowid})
+                    statement_count += len(statements)
+                conn.execute('RELEASE job')
+                outcomes.append((future, results, None))
+            except Exception as e:
+                conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+                outcomes.append((future, None, e))
+        
+        commit_start = time.perf_counter()
+        try:
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            conn.execute('ROLLBACK')
+            outcomes = [(future, None, e) for future, _, _ in outcomes]
+        commit_time = time.perf_counter() - commit_start
+        
+        failed = sum(1 for _, _, error in outcomes if error is not None)
+        self.stats.record(len(jobs), failed, statement_count, lock_wait, commit_time)
+        for future, results, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results)
+
+    def print_stats(self):
+        self.stats.print_stats()
+
+    def close(self):
+        """处理完已提交的任务后停止写线程"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+class WriterRequestHandler(socketserver.StreamRequestHandler):
+    """写服务的连接：每行一个 JSON 请求，不等待前一个请求完成即可发送下一个
+
+    请求 {"id": 1, "statements": [[sql, params], ...]} 或过程任务 {"id": 1, "procedure": "list_page", "args": {...}}，
+    响应 {"id": 1, "ok": true, "results": ...} 或 {"id": 1, "ok": false, "type": "IntegrityError", "error": "..."}。
+    请求 {"id": 2, "stats": true} 返回写入统计。
+    """
+    def handle(self):
+        write_lock = threading.Lock()
+        
+        def respond(response):
+            with write_lock:
+                try:
+                    self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                    self.wfile.flush()
+                except OSError:
+                    pass  # 客户端已断开
+        
+        def on_done(request_id, future):
+            error = future.exception()
+            if error is None:
+                respond({'id': request_id, 'ok': True, 'results': future.result()})
+            else:
+                respond({'id': request_id, 'ok': False, 'type': type(error).__name__, 'error': str(error)})
+        
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                respond({'id': None, 'ok': False, 'type': 'ProgrammingError', 'error': f"请求格式错误: {e}"})
+                continue
+            if request.get('stats'):
+                respond({'id': request.get('id'), 'ok': True, 'stats': self.server.writer.stats.snapshot()})
+                continue
+            if 'procedure' in request:
+                try:
+                    future = self.server.writer.submit_procedure(request['procedure'], **request.get('args', {}))
+                except sqlite3.ProgrammingError as e:
+                    respond({'id': request.get('id'), 'ok': False, 'type': 'ProgrammingError', 'error': str(e)})
+                    continue
+            else:
+                future = self.server.writer.submit(request['statements'])
+            future.add_done_callback(lambda f, request_id=request.get('id'): on_done(request_id, f))
+
+
+class WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, writer):
+        self.writer = writer
+        super().__init__(socket_path, WriterRequestHandler)
+
+
+class WriterClient:
+    """写服务的客户端，接口与 DbWriter 相同
+
+    请求按行发送，不等待响应，由读取线程按 id 完成对应的 Future，
+    连续提交的任务可以被写服务合并到同一个事务中。连接断开时该连接上未完成的请求全部失败，
+    下次提交时自动重连；等待超时的请求不再保留。
+    """
+    def __init__(self, socket_path, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout  # 等待写服务响应的最长时间(秒)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.pending = {}  # 请求 id -> Future
+        self.sock = None
+        self.file = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        self.sock = sock
+        self.file = sock.makefile('rwb')
+        threading.Thread(target=self.read_responses, args=(self.file,), name='db-writer-client', daemon=True).start()
+
+    def send(self, request):
+        future = Future()
+        with self.lock:
+            if self.sock is None:
+                self.connect()
+            request['id'] = next(self.ids)
+            future.request_id = request['id']
+            future.connection = self.file
+            self.pending[request['id']] = future
+            try:
+                self.file.write((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+                self.file.flush()
+            except OSError as e:
+                self.pending.pop(request['id'], None)
+                self.disconnect()
+                raise ConnectionError(f"写服务连接已断开: {e}")
+        return future
+
+    def submit(self, statements):
+        # 命名参数（dict）原样发送，位置参数转为列表
+        return self.send({'statements': [
+            [sql, params if isinstance(params, dict) else list(params or ())] for sql, params in statements
+        ]})
+
+    def execute(self, statements):
+        return self.wait(self.submit(statements))
+
+    def submit_procedure(self, name, **args):
+        return self.send({'procedure': name, 'args': args})
+
+    def call(self, name, **args):
+        return self.wait(self.submit_procedure(name, **args))
+
+    def wait(self, future):
+        """最多等待 timeout 秒，超时的请求从 pending 中移除（之后到达的响应被忽略）"""
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                self.pending.pop(future.request_id, None)
+            raise
+
+    def fetch_stats(self):
+        """写服务的写入统计"""
+        return self.wait(self.send({'stats': True}))
+
+    def print_stats(self):
+        try:
+            print_stats(self.fetch_stats())
+        except Exception as e:
+            print(f"获取写入统计失败: {e}")
+
+    def read_responses(self, file):
+        reason = "写服务连接已断开"
+        try:
+            for line in file:
+                response = json.loads(line)
+                with self.lock:
+                    future = self.pending.pop(response['id'], None)
+                if future is None:
+                    continue
+                if response['ok']:
+                    future.set_result(response.get('results', response.get('stats')))
+                else:
+                    future.set_exception(SQLITE_ERRORS.get(response['type'], sqlite3.OperationalError)(response['error']))
+        except (OSError, json.JSONDecodeError) as e:
+            reason = f"写服务连接已断开: {e}"
+        # 连接断开（写服务重启等）：该连接上未完成的请求全部失败，重连后的请求不受影响
+        with self.lock:
+            if self.file is file:
+                self.disconnect()
+            lost = [request_id for request_id, future in self.pending.items() if future.connection is file]
+            lost = [self.pending.pop(request_id) for request_id in lost]
+        for future in lost:
+            future.set_exception(ConnectionError(reason))
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.file = None
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+
+def open_writer(socket_path=None, path=DB_PATH):
+    """打开写入端：配置了写服务 socket（参数或环境变量 BMALL_WRITER_SOCKET）时通过写服务写入，
+    否则在本进程内启动写线程"""
+    socket_path = socket_path or os.environ.get('BMALL_WRITER_SOCKET')
+    if socket_path:
+        return WriterClient(socket_path)
+    return DbWriter(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='数据库写服务：独占写连接，合并各组件提交的写任务')
+    parser.add_argument('--socket', type=str, default='./db/writer.sock', help='监听的 Unix socket 路径，默认 ./db/writer.sock')
+    parser.add_argument('--db', type=str, default=DB_PATH, help=f'数据库路径，默认 {DB_PATH}')
+    parser.add_argument('--max-batch', type=int, default=200, help='每个事务最多合并的任务数，默认200')
+    parser.add_argument('--max-delay', type=float, default=0.005, help='收到任务后等待更多任务的时间(秒)，默认0.005秒')
+    parser.add_argument('--stats-interval', type=int, default=300, help='输出写入统计的间隔(秒)，默认300秒')
+    parser.add_argument('--log-level', type=str.upper, choices=log.LEVELS, default=log.DEFAULT_LEVEL, help='日志级别（过程任务的日志，如列表页逐个商品的处理过程），默认读取环境变量 BMALL_LOG_LEVEL，未设置时为 INFO')
+    args = parser.parse_args()
+
+    log.setup(args.log_level)
+
+    writer = DbWriter(args.db, max_batch=args.max_batch, max_delay=args.max_delay)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)  # 上次异常退出留下的 socket 文件
+    server = WriterServer(args.socket, writer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"写服务已启动: {args.socket} -> {args.db}")
+
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            writer.print_stats()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        writer.close()
+        os.remove(args.socket)
+        writer.print_stats()
@@ -0,0 +1,28 @@
+"""爬虫心跳：各组件最近一次成功工作的时间，供 API 的 /readyz 判断数据管道是否停滞"""
+import json
+import time
+
+LIST_PAGE = 'list_page'  # 列表爬虫成功写入一页商品
+STATUS_CHECK = 'status_check'  # 状态爬虫成功检查一批到期商品
+
+HEARTBEAT_SQL = '''
+    INSERT INTO spider_heartbeats (component, last_success_ms, detail, updated_ms)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(component) DO UPDATE SET
+        last_success_ms = excluded.last_success_ms,
+        detail = excluded.detail,
+        updated_ms = excluded.updated_ms
+'''
+
+
+def heartbeat(component, **detail):
+    """返回记录心跳的 (sql, params)，与本次工作的写入放在同一个事务中提交"""
+    now_ms = int(time.time() * 1000)
+    return HEARTBEAT_SQL, (component, now_ms, json.dumps(detail, ensure_ascii=False), now_ms)
+
+
+def load_heartbeats(cursor):
+    """返回 {组件: (最近一次成功的毫秒时间戳, 详情)}"""
+    cursor.execute('SELECT component, last_success_ms, detail FROM spider_heartbeats')
+    return {component: (last_success_ms, json.loads(detail) if detail else {})
+            for component, last_success_ms, detail in cursor.fetchall()}
@@ -0,0 +1,391 @@
+"""列表爬虫的页面写入，在写服务的写连接上执行
+
+保存一页商品时要读取本事务刚写入的数据（已有商品、重新上架、可疑用户计数），不能事先生成语句，
+因此列表爬虫把整页作为一个过程任务（db_writer.PROCEDURES 中的 list_page）提交给写服务，
+与 API 和状态爬虫的写入一样由唯一的写连接合并提交；列表爬虫自身只读取数据库。
+"""
+import sqlite3
+import time
+from collections import Counter
+
+from spider import heartbeat, log, migrations, queries
+
+logger = log.get_logger('list_writer')
+
+
+class PageWriter:
+    """在写连接上保存列表页，由写线程在任务的 SAVEPOINT 中调用，不提交事务
+
+    每个写连接创建一次，移回归档商品时复制的字段在创建时读取。
+    """
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+        self.archive_columns = migrations.archive_columns(self.cursor)
+        self.compact_relists = False
+        self.results = Counter()  # 本页各处理结果的商品数
+
+    def __call__(self, records, seen_ids, checkpoint=None, compact_relists=False):
+        """保存一页商品，返回 {'saved': 新增/更新的商品数, 'results': {处理结果: 商品数}}
+
+        records 为 [(商品, 品牌ID), ...]；checkpoint 为 (crawl_key, next_id, pending_high_water_id)，
+        与页面数据在同一事务中保存。
+        """
+        self.compact_relists = compact_relists
+        self.results = Counter()
+        saved_count = 0
+        for item, brand_id in records:
+            # 单个商品出错只回滚该商品
+            self.cursor.execute('SAVEPOINT save_item')
+            try:
+                if self.save_to_db(item, brand_id):
+                    saved_count += 1
+                self.cursor.execute('RELEASE save_item')
+            except Exception as e:
+                logger.warning('item_save_failed', item_id=item['c2cItemsId'], error=str(e))
+                self.results['error'] += 1
+                self.cursor.execute('ROLLBACK TO save_item')
+                self.cursor.execute('RELEASE save_item')
+
+        # 记录本页所有商品的列表出现时间，供状态爬虫跳过检查
+        self.mark_seen_in_list(seen_ids)
+        if checkpoint:
+            self.save_crawl_checkpoint(*checkpoint)
+        # 心跳与本页数据同时提交：/readyz 据此判断列表爬虫是否停滞
+        self.cursor.execute(*heartbeat.heartbeat(
+            heartbeat.LIST_PAGE, crawl_key=checkpoint[0] if checkpoint else None, saved=saved_count))
+        return {'saved': saved_count, 'results': dict(self.results)}
+
+    def check_item_exists(self, item_id):
+        """检查商品是否已存在，并返回当前信息
+
+        已归档的商品重新出现在列表中时先移回 c2c_items，按已有商品处理；
+        只有 c2c_items 中没有该商品时才查询归档表。
+        """
+        self.cursor.execute(queries.EXISTING_ITEM, {'item_id': item_id})
+        existing_item = self.cursor.fetchone()
+        if existing_item or not self.restore_archived_item(item_id):
+            return existing_item
+        self.cursor.execute(queries.EXISTING_ITEM, {'item_id': item_id})
+        return self.cursor.fetchone()
+
+    def restore_archived_item(self, item_id):
+        """把归档表中的商品移回 c2c_items，返回是否移回；调用前已确认 c2c_items 中没有该商品"""
+        self.cursor.execute(queries.ARCHIVED_ITEM, {'item_id': item_id})
+        if not self.cursor.fetchone():
+            return False
+
+        self.cursor.execute(f'''
+            INSERT INTO c2c_items ({self.archive_columns})
+            SELECT {self.archive_columns} FROM c2c_items_archive WHERE id = ?
+        ''', (item_id,))
+        self.cursor.execute("DELETE FROM c2c_items_archive WHERE id = ?", (item_id,))
+        logger.info('item_restored', item_id=item_id)
+        return True
+
+    def save_crawl_checkpoint(self, crawl_key, next_id, pending_high_water_id):
+        """保存本轮的游标和已见过的最新商品ID，与页面数据一同提交"""
+        self.cursor.execute('''
+            INSERT INTO crawl_state (crawl_key, pending_high_water_id, next_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(crawl_key) DO UPDATE SET
+                pending_high_water_id = excluded.pending_high_water_id,
+                next_id = excluded.next_id,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (crawl_key, pending_high_water_id, next_id))
+
+    def check_suspicious_user(self, uid: str, uname: str, sku_id: int):
+        """检查用户是否可疑（1小时内对同一商品上架超过20次）"""
+        try:
+            # 检查用户在过去1小时内对该商品的上架次数
+            self.cursor.execute(queries.SELLER_LISTINGS_1H, {
+                'uid': uid,
+                'sku_id': sku_id,
+                'since_1h': int((time.time() - 3600) * 1000)
+            })
+
+            count = self.cursor.fetchone()[0]
+
+            if count >= 20:  # 如果1小时内上架超过20次
+                try:
+                    # 获取商品名称
+                    self.cursor.execute("SELECT name FROM skus WHERE sku_id = ?", (sku_id,))
+                    sku_name = self.cursor.fetchone()[0]
+
+                    # 添加到黑名单
+                    self.cursor.execute("""
+                        INSERT INTO blacklist (uid, uname, reason)
+                        VALUES (?, ?, ?)
+                    """, (
+                        uid,
+                        uname,
+                        f"自动加入黑名单：1小时内对商品 {sku_name} 上架 {count} 次"
+                    ))
+
+                    logger.info('user_blacklisted', uid=uid, uname=uname, sku=sku_name, listings_1h=count)
+                    return True
+
+                except sqlite3.IntegrityError:
+                    # 用户已在黑名单中
+                    return True
+
+            return False
+
+        except Exception as e:
+            logger.warning('suspicious_check_failed', uid=uid, error=str(e))
+            return False
+
+    def check_blacklist(self, uid: str):
+        """检查用户是否在黑名单中"""
+        try:
+            self.cursor.execute(queries.IN_BLACKLIST, {'uid': uid})
+            return self.cursor.fetchone() is not None
+        except Exception as e:
+            logger.warning('blacklist_check_failed', uid=uid, error=str(e))
+            return False
+
+    def save_to_db(self, item, brand_id=None):
+        """保存一个商品，返回是否新增或更新
+
+        brand_id 由列表爬虫的解析阶段预先匹配
+        """
+        try:
+            # 检查用户是否在黑名单中
+            is_blacklisted = self.check_blacklist(item['uid'])
+            if is_blacklisted:
+                logger.debug('item_seller_blacklisted', item_id=item['c2cItemsId'], uid=item['uid'], uname=item['uname'])
+
+            # 检查是否已存在
+            existing_item = self.check_item_exists(item['c2cItemsId'])
+
+            # 检查商品类型
+            if item['type'] != 1:
+                logger.debug('item_skipped', item_id=item['c2cItemsId'], reason='type', type=item['type'])
+                self.results['skipped_type'] += 1
+                return False
+
+            # 检查是否有多个SKU
+            if len(item['detailDtoList']) > 1:
+                logger.debug('item_skipped', item_id=item['c2cItemsId'], reason='multi_sku')
+                self.results['skipped_multi_sku'] += 1
+                return False
+
+            # 更新卖家资料（商品本身无需更新时也可能有变化）
+            self.save_seller(item)
+
+            # 合并模式下，重新上架的商品合并到同一卖家同一SKU同价格的在售商品
+            if not existing_item and self.compact_relists:
+                canonical_id = self.find_relist_canonical(item)
+                if canonical_id is not None:
+                    folded = self.fold_relist(canonical_id, item)
+                    if folded and self.check_suspicious_user(item['uid'], item['uname'], item['detailDtoList'][0]['skuId']):
+                        logger.debug('user_suspicious', uid=item['uid'], uname=item['uname'])
+                    self.results['relisted' if folded else 'unchanged'] += 1
+                    return folded
+
+            # 如果商品已存在，检查是否需要更新
+            publish_status = 1
+            if existing_item:
+                # 已售出/已下架的商品重新出现在列表中时改回在售；黑名单卖家的商品保持原状态，
+                # 否则被黑名单检查下架（-1）的商品每轮都会被改回在售再下架
+                if is_blacklisted or existing_item[9]:
+                    publish_status = existing_item[8]
+                changed_fields = {}
+                fields_to_check = [
+                    ('price_cents', int(item['price'])),
+                    ('show_price', item['showPrice']),
+                    ('show_market_price', item['showMarketPrice']),
+                    ('uid', int(item['uid'])),
+                    ('total_items_count', item['totalItemsCount']),
+                    ('payment_time', item['paymentTime']),
+                    ('is_my_publish', 1 if item['isMyPublish'] else 0),
+                    ('publish_status', publish_status),
+                    ('is_blacklisted', 1 if is_blacklisted else 0)
+                ]
+
+                for idx, (field, new_value) in enumerate(fields_to_check):
+                    if existing_item[idx + 1] != new_value:  # +1 因为第一个字段是id
+                        changed_fields[field] = f"{existing_item[idx + 1]}->{new_value}"
+
+                if not changed_fields:
+                    logger.debug('item_unchanged', item_id=item['c2cItemsId'])
+                    self.results['unchanged'] += 1  # 卖家资料的更新随本页一同提交
+                    return False
+                else:
+                    logger.debug('item_changed', item_id=item['c2cItemsId'], **changed_fields)
+
+            # 处理SKU数据
+            for sku in item['detailDtoList']:
+                # 先更新SKU主表（只更新接口返回的字段，保留 created_at）
+                self.cursor.execute('''
+                    INSERT INTO skus (
+                        sku_id, name, img, market_price_cents, type
+                    ) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(sku_id) DO UPDATE SET
+                        name = excluded.name,
+                        img = excluded.img,
+                        market_price_cents = excluded.market_price_cents,
+                        type = excluded.type,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (
+                    sku['skuId'],
+                    sku['name'],
+                    sku['img'],
+                    int(sku['marketPrice']),  # 单位为分
+                    sku['type']
+                ))
+
+                # 插入或更新商品主表数据：已有商品只更新接口返回的字段，
+                # 保留上架时间、检查调度字段、列表出现时间和重新上架记录
+                self.cursor.execute('''
+                    INSERT INTO c2c_items (
+                        id, type, name, brand_id, sku_id, items_id,
+                        total_items_count, price_cents, show_price, show_market_price,
+                        uid, payment_time, is_my_publish, publish_status, is_blacklisted
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        type = excluded.type,
+                        name = excluded.name,
+                        brand_id = excluded.brand_id,
+                        sku_id = excluded.sku_id,
+                        items_id = excluded.items_id,
+                        total_items_count = excluded.total_items_count,
+                        price_cents = excluded.price_cents,
+                        show_price = excluded.show_price,
+                        show_market_price = excluded.show_market_price,
+                        uid = excluded.uid,
+                        payment_time = excluded.payment_time,
+                        is_my_publish = excluded.is_my_publish,
+                        publish_status = excluded.publish_status,
+                        is_blacklisted = excluded.is_blacklisted
+                ''', (
+                    item['c2cItemsId'],
+                    item['type'],
+                    item['c2cItemsName'],
+                    brand_id,
+                    sku['skuId'],
+                    sku['itemsId'],
+                    item['totalItemsCount'],
+                    int(item['price']),
+                    item['showPrice'],
+                    item['showMarketPrice'],
+                    int(item['uid']),
+                    item['paymentTime'],
+                    1 if item['isMyPublish'] else 0,
+                    publish_status,
+                    1 if is_blacklisted else 0  # 是否是黑名单用户
+                ))
+
+                # 已有商品被重新写为在售时记录状态变更事件
+                if existing_item and existing_item[8] != publish_status:
+                    self.cursor.execute('''
+                        INSERT INTO listing_events (item_id, old_status, new_status, price_cents, source, event_time)
+                        VALUES (?, ?, ?, ?, 'mall_spider', ?)
+                    ''', (
+                        item['c2cItemsId'],
+                        existing_item[8],
+                        publish_status,
+                        int(item['price']),
+                        int(time.time() * 1000)
+                    ))
+
+                # 检查是否是可疑用户
+                if self.check_suspicious_user(item['uid'], item['uname'], sku['skuId']):
+                    logger.debug('user_suspicious', uid=item['uid'], uname=item['uname'])
+
+            logger.debug('item_saved', item_id=item['c2cItemsId'], result='updated' if existing_item else 'new')
+            self.results['updated' if existing_item else 'new'] += 1
+            return True
+
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE constraint failed" in str(e):
+                self.results['duplicate'] += 1
+                return False
+            raise
+
+    def save_seller(self, item):
+        """更新卖家的最新资料，昵称变化时记录到昵称历史"""
+        uid = int(item['uid'])
+        profile = (item['uname'], item['uface'], item['uspaceJumpUrl'])
+        self.cursor.execute(queries.SELLER_PROFILE, {'uid': uid})
+        current = self.cursor.fetchone()
+        if current == profile:
+            return
+
+        if current is None or current[0] != item['uname']:
+            if current is not None:
+                logger.debug('seller_renamed', uid=uid, old=current[0], new=item['uname'])
+            self.cursor.execute('''
+                INSERT INTO seller_name_history (uid, uname)
+                VALUES (?, ?)
+            ''', (uid, item['uname']))
+
+        self.cursor.execute('''
+            INSERT INTO sellers (uid, uname, uface, uspace_jump_url)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(uid) DO UPDATE SET
+                uname = excluded.uname,
+                uface = excluded.uface,
+                uspace_jump_url = excluded.uspace_jump_url,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (uid, *profile))
+
+    def find_relist_canonical(self, item):
+        """查找重新上架的商品应合并到的在售商品ID，没有时返回 None
+
+        已合并过的商品ID在原来的商品仍在售时直接返回该商品；原来的商品已售出或下架时
+        删除这条合并记录，再按卖家、SKU和价格匹配最新的在售商品。
+        """
+        self.cursor.execute(queries.RELIST_CANONICAL, {'item_id': item['c2cItemsId']})
+        row = self.cursor.fetchone()
+        if row and row[1] == 1:
+            return row[0]
+        if row:
+            self.cursor.execute("DELETE FROM c2c_item_relists WHERE item_id = ?", (item['c2cItemsId'],))
+
+        self.cursor.execute(queries.RELIST_MATCH, {
+            'uid': int(item['uid']),
+            'sku_id': item['detailDtoList'][0]['skuId'],
+            'price_cents': int(item['price'])
+        })
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def fold_relist(self, canonical_id, item):
+        """把重新上架的商品合并到在售商品，返回是否新合并
+
+        商品ID记入 c2c_item_relists，在售商品累加重新上架次数并记录最新的商品ID，
+        状态爬虫按最新的商品ID检查在售状态。
+        """
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO c2c_item_relists (item_id, canonical_id)
+            VALUES (?, ?)
+        ''', (item['c2cItemsId'], canonical_id))
+        if self.cursor.rowcount == 0:
+            logger.debug('item_relist_known', item_id=item['c2cItemsId'], canonical_id=canonical_id)
+            return False
+
+        now_ms = int(time.time() * 1000)
+        self.cursor.execute('''
+            UPDATE c2c_items
+            SET relist_count = COALESCE(relist_count, 0) + 1,
+                latest_item_id = ?,
+                last_listed_ms = ?,
+                last_seen_ms = ?
+            WHERE id = ?
+        ''', (item['c2cItemsId'], now_ms, now_ms, canonical_id))
+        logger.debug('item_relist_folded', item_id=item['c2cItemsId'], canonical_id=canonical_id)
+        return True
+
+    def mark_seen_in_list(self, item_ids):
+        """批量更新商品最近一次出现在列表中的时间（即使商品数据没有变化）"""
+        if not item_ids:
+            return
+        try:
+            id_list, id_params = queries.in_params('item_id', item_ids)
+            params = {'now_ms': int(time.time() * 1000), **id_params}
+            self.cursor.execute(queries.MARK_SEEN.format(item_ids=id_list), params)
+            if self.compact_relists:
+                # 已合并的重新上架商品，更新其在售商品
+                self.cursor.execute(queries.MARK_SEEN_RELISTS.format(item_ids=id_list), params)
+        except Exception:
+            logger.exception('mark_seen_error', items=len(item_ids))
@@ -0,0 +1,107 @@
+"""爬虫的结构化日志：分级输出 key=value 格式的单行日志，同一事件按令牌桶限速
+
+逐个商品的处理过程（跳过、无需更新、字段变化等）记为 DEBUG，默认不输出；
+接口错误等可能成批出现的事件记为 WARNING，超过限速的日志被丢弃，
+下一条输出时附带 suppressed=N 说明期间丢弃了多少条。
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+DEFAULT_LEVEL = os.environ.get('BMALL_LOG_LEVEL', 'INFO').upper()
+
+
+class RateLimitFilter(logging.Filter):
+    """同一事件（日志器名 + 事件名）每秒补充 rate 个令牌，最多积累 burst 个；ERROR 不限速"""
+    def __init__(self, rate=1.0, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}  # 事件 -> [令牌数, 上次补充时间, 丢弃数]
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.setdefault(key, [self.burst, now, 0])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+def format_field(value):
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    if not text or any(char in text for char in ' ="\n'):
+        text = json.dumps(text, ensure_ascii=False)
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """2025-01-01T12:00:00 INFO mall_spider page_written shard=2312 saved=3"""
+    def format(self, record):
+        fields = dict(getattr(record, 'fields', {}))
+        if getattr(record, 'suppressed', 0):
+            fields['suppressed'] = record.suppressed
+        parts = [time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                 record.levelname, record.name, record.getMessage()]
+        parts.extend(f"{name}={format_field(value)}" for name, value in fields.items())
+        line = ' '.join(parts)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class StructuredLogger:
+    """log.info('event', key=value, ...)：事件名固定，变化的内容放在字段中，便于检索和限速"""
+    def __init__(self, logger):
+        self.logger = logger
+
+    def log(self, level, event, exc_info=False, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(f"bmall.{name}"))
+
+
+def setup(level=DEFAULT_LEVEL, rate=1.0, burst=20, stream=None):
+    """配置 bmall.* 日志器的级别、输出格式和限速，重复调用时替换之前的设置"""
+    logger = logging.getLogger('bmall')
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(KeyValueFormatter())
+    handler.addFilter(RateLimitFilter(rate, burst))
+    logger.addHandler(handler)
+    return logger
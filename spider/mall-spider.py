@@ -1,25 +1,56 @@
 import requests
 import json
-import sqlite3
 from datetime import datetime
 import time
-import random
+import math
 import argparse
+import queue
+import threading
+from spider.credentials import CredentialPool
+from spider.db_writer import connect, open_writer
+from spider import log, metrics, migrations, queries
+from spider.recorder import LiveSession, ReplaySession, TrafficRecorder, ReplayFinished
+
+logger = log.get_logger('mall_spider')
 
 class BiliMallSpider:
-    def __init__(self, cookie=None):
-        self.duplicate_count = 0
+    def __init__(self, cookie=None, credentials=None, writer_socket=None):
         self.max_duplicate_pages = 5
         self.min_sleep = 2  # 最小休眠时间(秒)
         self.max_sleep = 5  # 最大休眠时间(秒)
         self.error_sleep = 30  # 错误重试休眠时间(秒)
         self.fatal_sleep = 60  # 严重错误休眠时间(秒)
-        self.round_sleep = 300  # 每轮结束后的休眠时间(秒)，默认5分钟
+        self.round_sleep = 300  # 还没有到达率估计时每轮结束后的休眠时间(秒)，默认5分钟
+        self.target_freshness = 300  # 目标新鲜度：新上架商品最迟多少秒内被抓取
+        self.request_budget = 720  # 列表接口每小时请求预算（所有分类合计）
+        self.min_round_sleep = 30  # 两轮之间的最短间隔(秒)
+        self.max_round_sleep = 1800  # 两轮之间的最长间隔(秒)
+        self.arrival_alpha = 0.3  # 到达率（每秒新增商品数）的指数平滑系数
+        self.items_per_page = 20  # 列表接口每页商品数
         self.page_sleep = 3  # 每页处理后的休眠时间(秒)
         self.max_retry_sleep = 7200  # 最大重试休眠时间(秒)，默认2小时
         self.retry_multiplier = 2  # 重试时间翻倍系数
         self.url = 'https://mall.bilibili.com/mall-magic-c/internet/c2c/v2/list'
-        self.category = "2312"  # 商品分类ID
+        self.categories = ["2312"]  # 商品分类ID列表
+        self.sort_types = ["TIME_DESC"]  # 排序方式列表
+        self.price_bands = []  # 价格区间列表（分），如 "0-5000"，为空时不按价格分片
+        self.shard_workers = 3  # 同时抓取的分片数
+        self.min_shard_pages = 1  # 每个分片每轮至少爬取的页数（用于探测产出）
+        self.yield_alpha = 0.5  # 分片产出（每次请求新增商品数）的指数平滑系数
+        self.prefetch_pages = 1  # 流水线各阶段队列长度（预取页数）
+        self.max_listings_per_sku = 3  # 每个用户每个SKU保留的在售记录数
+        self.cleanup_batch_size = 500  # 清理超额记录时每批删除的记录数
+        self.compact_relists = False  # 同一卖家同一SKU同价格的重新上架合并为一条商品记录
+        self.stage_lock = threading.Lock()
+        self.stage_stats = {}  # 各阶段处理页数及耗时
+        self.raw_queue = None  # 抓取 -> 解析
+        self.parsed_queue = None  # 解析 -> 写入
+        self.metrics = metrics.spider_metrics('bmall_list_spider')
+        self.metrics.gauge('queue_depth', '流水线队列中等待处理的页数，stage 为 parse 或 write')
+        self.metrics.gauge('healthy_credentials', '当前未停用的 Cookie 数量')
+        self.metrics.gauge_function('queue_depth', lambda: self.raw_queue.qsize() if self.raw_queue else 0, stage='parse')
+        self.metrics.gauge_function('queue_depth', lambda: self.parsed_queue.qsize() if self.parsed_queue else 0, stage='write')
+        self.metrics.gauge_function('healthy_credentials', lambda: self.credentials.healthy_count())
         self.headers = {
             'accept': 'application/json, text/plain, */*',
             'accept-language': 'zh-CN,zh;q=0.9,en;q=0.8',
@@ -34,132 +65,32 @@ class BiliMallSpider:
             'sec-fetch-site': 'same-origin',
             'user-agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Mobile Safari/537.36'
         }
-        if cookie:
-            self.headers['cookie'] = cookie
+        # Cookie 池：每个 Cookie 独立限速，请求分散到健康的 Cookie 上
+        self.credentials = credentials or CredentialPool([cookie])
+        self.session = LiveSession()  # HTTP 会话，可替换为录制或回放会话
         self.init_db()
+        # 写入通过写服务（配置了 socket 时）或本进程的写线程提交，本连接只用于读取；
+        # 保存列表页要读取本页刚写入的数据，作为过程任务在写连接上执行（spider/list_writer.py）
+        self.writer = open_writer(writer_socket)
 
     def init_db(self):
         """初始化数据库"""
-        self.conn = sqlite3.connect('./db/bilibili_mall.db')
+        # WAL 模式：写服务提交时本连接的读取不被阻塞
+        self.conn = connect()
         self.cursor = self.conn.cursor()
         
-        # 创建品牌表
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS brands (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            keywords TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # 创建SKU主表
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS skus (
-            sku_id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            img TEXT,
-            market_price REAL,
-            type INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # 创建商品主表
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS c2c_items (
-            id INTEGER PRIMARY KEY,
-            type INTEGER,
-            name TEXT,
-            brand_id INTEGER,
-            sku_id INTEGER,
-            items_id INTEGER,
-            total_items_count INTEGER,
-            price REAL,
-            show_price TEXT,
-            show_market_price TEXT,
-            uid TEXT,
-            payment_time INTEGER,
-            is_my_publish INTEGER,
-            uspace_jump_url TEXT,
-            uface TEXT,
-            uname TEXT,
-            publish_status INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (brand_id) REFERENCES brands(id),
-            FOREIGN KEY (sku_id) REFERENCES skus(sku_id)
-        )
-        ''')
-        
-        # 添加索引以提高查询性能
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_c2c_items_id ON c2c_items(id)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_c2c_items_sku_id ON c2c_items(sku_id)')
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_c2c_items_items_id ON c2c_items(items_id)')
-        
-        # 添加品牌索引
-        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_c2c_items_brand_id ON c2c_items(brand_id)')
-        
-        # 初始化品牌数据
-        self.init_brands()
-        
-        # 创建黑名单表（如果不存在）
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS blacklist (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            uid TEXT NOT NULL,
-            uname TEXT NOT NULL,
-            reason TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(uid)
-        )
-        ''')
-        
-        # 添加 is_blacklisted 字段（如果不存在）
-        try:
-            self.cursor.execute('''
-                ALTER TABLE c2c_items 
-                ADD COLUMN is_blacklisted INTEGER DEFAULT 0
-            ''')
-            self.conn.commit()
-        except sqlite3.OperationalError:
-            pass  # 字段已存在，忽略错误
-        
-        self.conn.commit()
-
-    def init_brands(self):
-        """初始化品牌数据"""
-        brands = [
-            ('TAITO', 'TAITO|タイトー|太东'),
-            ('SEGA', 'SEGA|世嘉|セガ'),
-            ('BANPRESTO', 'BANPRESTO|万代南梦宫|バンプレスト'),
-            ('FURYU', 'FURYU|フリュー|福龙'),
-            ('BANDAI', 'BANDAI|万代|バンダイ'),
-            ('GOODSMILE', 'GOODSMILE|GSC|굿스마일|グッドスマイル'),
-            ('ALTER', 'ALTER|阿尔塔|アルター'),
-            ('KOTOBUKIYA', 'KOTOBUKIYA|寿屋|コトブキヤ'),
-            ('ANIPLEX', 'ANIPLEX|アニプレックス'),
-            ('HOBBY STOCK', 'HOBBY STOCK|ホビーストック'),
-            ('KADOKAWA', 'KADOKAWA|角川|カドカワ'),
-            ('WAVE', 'WAVE|ウェーブ'),
-            ('BROCCOLI', 'BROCCOLI|ブロッコリー'),
-            ('AQUAMARINE', 'AQUAMARINE|アクアマリン'),
-            ('MEDICOS', 'MEDICOS|メディコス'),
-            ('MEGAHOUSE', 'MEGAHOUSE|メガハウス'),
-            ('ORANGE ROUGE', 'ORANGE ROUGE|オランジュ・ルージュ'),
-            ('STRONGER', 'STRONGER|ストロンガー'),
-        ]
-        
-        for brand_name, keywords in brands:
-            self.cursor.execute('''
-                INSERT OR IGNORE INTO brands (name, keywords)
-                VALUES (?, ?)
-            ''', (brand_name, keywords))
+        # 表结构由 spider/migrations.py 统一维护；数据库已是最新时只读取 schema_version
+        migrations.migrate()
 
-    def match_brand(self, item_name):
-        """匹配商品品牌"""
+    def load_brands(self):
+        """读取品牌及关键词列表"""
         self.cursor.execute('SELECT id, name, keywords FROM brands')
-        brands = self.cursor.fetchall()
+        return self.cursor.fetchall()
+
+    def match_brand(self, item_name, brands=None):
+        """匹配商品品牌，brands 为预先读取的品牌列表（解析线程中使用，避免访问数据库）"""
+        if brands is None:
+            brands = self.load_brands()
         
         for brand_id, brand_name, keywords in brands:
             # 将关键词分割成列表
@@ -169,256 +100,235 @@ class BiliMallSpider:
                 return brand_id
         return None
 
-    def check_item_exists(self, item_id):
-        """检查商品是否已存在，并返回当前信息"""
+    def get_crawl_key(self, shard):
+        """爬取进度的键：分类、排序方式和价格区间（未按价格分片时省略）"""
+        crawl_key = f"{shard['category']}:{shard['sort_type']}"
+        if shard['price_band']:
+            crawl_key += f":{shard['price_band']}"
+        return crawl_key
+
+    def plan_shards(self):
+        """按分类 × 排序方式 × 价格区间划分分片，每个分片有独立的 nextId 游标"""
+        shards = []
+        for category in self.categories:
+            for sort_type in self.sort_types:
+                for price_band in self.price_bands or [None]:
+                    shard = {
+                        'category': category,
+                        'sort_type': sort_type,
+                        'price_band': price_band,
+                    }
+                    shard['key'] = self.get_crawl_key(shard)
+                    shards.append(shard)
+        return shards
+
+    def allocate_pages(self, shards, states, max_pages):
+        """按各分片的历史产出（每次请求的新增商品数）分配本轮的页数预算
+        
+        每个分片至少分配 min_shard_pages 页，没有历史数据的分片按已知分片的平均产出计算。
+        """
+        if len(shards) == 1:
+            return {shards[0]['key']: max_pages}
+        
+        yields = {shard['key']: states[shard['key']].get('yield_rate') for shard in shards}
+        known = [rate for rate in yields.values() if rate is not None]
+        default_rate = sum(known) / len(known) if known else 1.0
+        weights = {key: default_rate if rate is None else rate for key, rate in yields.items()}
+        total_weight = sum(weights.values())
+        
+        spare_pages = max(max_pages - self.min_shard_pages * len(shards), 0)
+        budgets = {}
+        for key, weight in weights.items():
+            share = spare_pages * weight / total_weight if total_weight > 0 else spare_pages / len(shards)
+            budgets[key] = self.min_shard_pages + int(round(share))
+        return budgets
+
+    def load_crawl_state(self, crawl_key):
+        """读取爬取进度，不存在时返回 None"""
         self.cursor.execute('''
-            SELECT 
-                id, price, show_price, show_market_price, 
-                uid, uname, uface, uspace_jump_url,
-                total_items_count, payment_time, is_my_publish
-            FROM c2c_items 
-            WHERE id = ?
-        ''', (item_id,))
-        return self.cursor.fetchone()
+            SELECT high_water_id, pending_high_water_id, next_id, round_stats, yield_rate
+            FROM crawl_state
+            WHERE crawl_key = ?
+        ''', (crawl_key,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        return {
+            'high_water_id': row[0],
+            'pending_high_water_id': row[1],
+            'next_id': row[2],
+            'round_stats': json.loads(row[3]) if row[3] else None,
+            'yield_rate': row[4],
+        }
+
+    def finish_crawl_round(self, crawl_key, high_water_id, round_stats, yield_rate=None):
+        """一轮完成：更新高水位和分片产出，清除游标，保存本轮统计"""
+        try:
+            self.writer.execute([('''
+                INSERT INTO crawl_state (crawl_key, high_water_id, round_stats, yield_rate, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(crawl_key) DO UPDATE SET
+                    high_water_id = excluded.high_water_id,
+                    pending_high_water_id = NULL,
+                    next_id = NULL,
+                    round_stats = excluded.round_stats,
+                    yield_rate = COALESCE(excluded.yield_rate, crawl_state.yield_rate),
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (crawl_key, high_water_id, json.dumps(round_stats, ensure_ascii=False), yield_rate))])
+        except Exception:
+            logger.exception('crawl_state_save_error', crawl_key=crawl_key)
 
-    def fetch_data(self, next_id=None):
-        """获取数据"""
+    def load_crawl_schedule(self):
+        """读取各分类的到达率估计和下一轮计划，返回 {分类: 调度信息}"""
+        self.cursor.execute('''
+            SELECT category, arrival_rate, rate_samples, last_new_items,
+                   last_round_at, next_round_at, planned_interval, planned_pages
+            FROM crawl_schedule
+        ''')
+        return {
+            row[0]: {
+                'arrival_rate': row[1],
+                'rate_samples': row[2],
+                'last_new_items': row[3],
+                'last_round_at': row[4],
+                'next_round_at': row[5],
+                'planned_interval': row[6],
+                'planned_pages': row[7],
+            }
+            for row in self.cursor.fetchall()
+        }
+
+    def plan_category_round(self, arrival_rate, max_pages):
+        """根据到达率选择下一轮的间隔(秒)和页数
+        
+        间隔取目标新鲜度，到达率很低时延长到预计至少有一个新商品；页数覆盖间隔内到达的新商品，
+        并多留一页用于到达高水位。超出每小时请求预算时先延长间隔，仍然不够时限制页数。
+        """
+        if arrival_rate is None:
+            return self.round_sleep, max_pages
+        
+        budget = self.request_budget / max(len(self.categories), 1)
+        if arrival_rate > 0:
+            interval = max(self.target_freshness, 1 / arrival_rate)
+        else:
+            interval = self.max_round_sleep
+        interval = min(max(interval, self.min_round_sleep), self.max_round_sleep)
+        pages = math.ceil(arrival_rate * interval / self.items_per_page) + 1
+        
+        if interval > 0 and pages * 3600 / interval > budget:
+            # 每小时请求数 ≈ 到达商品所需页数 + 每轮多出的一页
+            arrival_pages = 3600 * arrival_rate / self.items_per_page
+            if budget > arrival_pages:
+                interval = min(max(interval, 3600 / (budget - arrival_pages)), self.max_round_sleep)
+                pages = math.ceil(arrival_rate * interval / self.items_per_page) + 1
+            pages = min(pages, max(1, int(budget * interval / 3600)))
+        return interval, max(1, min(pages, max_pages))
+
+    def update_arrival_estimate(self, category, new_items, round_start, truncated, max_pages):
+        """用本轮新增商品数更新分类的到达率估计，并计划下一轮的时间和页数
+        
+        truncated 表示本轮因页数限制没有抓完新商品，此时样本只是下限。
+        """
+        schedule = self.load_crawl_schedule().get(category, {})
+        arrival_rate = schedule.get('arrival_rate')
+        rate_samples = schedule.get('rate_samples') or 0
+        last_round_at = schedule.get('last_round_at')
+        
+        if last_round_at and round_start > last_round_at:
+            sample = new_items / (round_start - last_round_at)
+            if arrival_rate is None:
+                arrival_rate = sample
+            else:
+                arrival_rate = self.arrival_alpha * sample + (1 - self.arrival_alpha) * arrival_rate
+            if truncated:
+                arrival_rate = max(arrival_rate, sample)
+            rate_samples += 1
+        
+        interval, pages = self.plan_category_round(arrival_rate, max_pages)
+        next_round_at = max(round_start + interval, time.time())
+        try:
+            self.writer.execute([('''
+                INSERT INTO crawl_schedule (
+                    category, arrival_rate, rate_samples, last_new_items,
+                    last_round_at, next_round_at, planned_interval, planned_pages, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(category) DO UPDATE SET
+                    arrival_rate = excluded.arrival_rate,
+                    rate_samples = excluded.rate_samples,
+                    last_new_items = excluded.last_new_items,
+                    last_round_at = excluded.last_round_at,
+                    next_round_at = excluded.next_round_at,
+                    planned_interval = excluded.planned_interval,
+                    planned_pages = excluded.planned_pages,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (category, arrival_rate, rate_samples, new_items, round_start, next_round_at, interval, pages))])
+        except Exception:
+            logger.exception('crawl_schedule_save_error', category=category)
+        
+        rate_text = f"{arrival_rate * 60:.2f} 个/分钟" if arrival_rate is not None else "未知"
+        print(f"分类 {category}: 本轮新增 {new_items}，到达率 {rate_text}，"
+              f"{interval:.0f} 秒后爬取下一轮，计划 {pages} 页")
+        return next_round_at
+
+    def reached_high_water(self, item_ids, high_water_id):
+        """本页是否已到达上一轮的高水位（过半商品ID不大于高水位，避免被个别旧商品误判）"""
+        if high_water_id is None or not item_ids:
+            return False
+        old_count = sum(1 for item_id in item_ids if item_id <= high_water_id)
+        return old_count * 2 >= len(item_ids)
+
+    def fetch_data(self, next_id=None, shard=None):
+        """获取数据，shard 指定分类、排序方式和价格区间，默认使用第一个分片"""
+        if shard is None:
+            shard = self.plan_shards()[0]
         data = {
-            "sortType": "TIME_DESC",
+            "sortType": shard['sort_type'],
             "nextId": next_id if next_id else "",
-            "categoryFilter": self.category
+            "categoryFilter": shard['category']
         }
+        if shard['price_band']:
+            data["priceFilters"] = [shard['price_band']]
         
-        delay = random.uniform(self.min_sleep, self.max_sleep)
-        print(f"等待 {delay:.1f} 秒后发起请求...")
-        print(f"请求参数: {json.dumps(data, ensure_ascii=False)}")
-        time.sleep(delay)
+        # 等待某个健康的 Cookie 有可用令牌
+        credential = self.credentials.acquire()
+        logger.debug('list_request', credential=credential.name, shard=shard['key'], next_id=data['nextId'])
         
+        start = time.perf_counter()
         try:
-            response = requests.post(self.url, headers=self.headers, json=data, timeout=10)
-            print(f"请求状态码: {response.status_code}")
+            response = self.session.post(self.url, headers=credential.apply_headers(self.headers), json=data, timeout=10)
+            self.metrics.observe('request_seconds', time.perf_counter() - start, endpoint='list')
             
             response_json = response.json()
+            self.metrics.inc('responses_total', endpoint='list', status=response.status_code, code=response_json['code'])
+            self.credentials.report(credential, response.status_code == 200 and response_json['code'] == 0)
             if response_json['code'] != 0:
-                print("异常响应详情:")
-                print(f"URL: {self.url}")
-                print(f"Headers: {json.dumps(dict(response.request.headers), ensure_ascii=False, indent=2)}")
-                print(f"Request Body: {json.dumps(data, ensure_ascii=False, indent=2)}")
-                print(f"Response Body: {json.dumps(response_json, ensure_ascii=False, indent=2)}")
+                # 请求头中有 Cookie，不输出
+                logger.warning('list_api_error', credential=credential.name, status=response.status_code,
+                               code=response_json['code'], message=response_json.get('message'), request=data)
             
             return response_json
             
         except requests.exceptions.RequestException as e:
-            print(f"请求异常: {e}")
-            print("请求详情:")
-            print(f"URL: {self.url}")
-            print(f"Headers: {json.dumps(self.headers, ensure_ascii=False, indent=2)}")
-            print(f"Request Body: {json.dumps(data, ensure_ascii=False, indent=2)}")
-            if hasattr(e.response, 'text'):
-                print(f"Response Body: {e.response.text}")
+            self.metrics.observe('request_seconds', time.perf_counter() - start, endpoint='list')
+            self.metrics.inc('responses_total', endpoint='list', status='error', code=type(e).__name__)
+            logger.warning('list_request_failed', credential=credential.name, error=str(e), request=data,
+                           response=getattr(e.response, 'text', None))
             return None
         except json.JSONDecodeError as e:
-            print(f"JSON解析异常: {e}")
-            print("响应内容:")
-            print(response.text)
+            self.metrics.inc('responses_total', endpoint='list', status=response.status_code, code='invalid_json')
+            # 风控拦截时通常返回非JSON页面
+            logger.warning('list_invalid_json', credential=credential.name, status=response.status_code,
+                           error=str(e), response=response.text[:500])
+            self.credentials.report(credential, False)
             return None
 
-    def check_suspicious_user(self, uid: str, uname: str, sku_id: int):
-        """检查用户是否可疑（1小时内对同一商品上架超过20次）"""
-        try:
-            # 检查用户在过去1小时内对该商品的上架次数
-            self.cursor.execute("""
-                SELECT COUNT(*) as count
-                FROM c2c_items
-                WHERE uid = ? 
-                AND sku_id = ?
-                AND created_at >= datetime('now', '-1 hour')
-            """, (uid, sku_id))
-            
-            count = self.cursor.fetchone()[0]
-            
-            if count >= 20:  # 如果1小时内上架超过20次
-                try:
-                    # 获取商品名称
-                    self.cursor.execute("SELECT name FROM skus WHERE sku_id = ?", (sku_id,))
-                    sku_name = self.cursor.fetchone()[0]
-                    
-                    # 添加到黑名单
-                    self.cursor.execute("""
-                        INSERT INTO blacklist (uid, uname, reason)
-                        VALUES (?, ?, ?)
-                    """, (
-                        uid,
-                        uname,
-                        f"自动加入黑名单：1小时内对商品 {sku_name} 上架 {count} 次"
-                    ))
-                    
-                    self.conn.commit()
-                    print(f"用户 {uname}(UID:{uid}) 已自动加入黑名单")
-                    print(f"原因：1小时内对商品 {sku_name} 上架 {count} 次")
-                    return True
-                    
-                except sqlite3.IntegrityError:
-                    # 用户已在黑名单中
-                    return True
-            
-            return False
-            
-        except Exception as e:
-            print(f"检查可疑用户时出错: {e}")
-            return False
-
-    def check_blacklist(self, uid: str):
-        """检查用户是否在黑名单中"""
-        try:
-            self.cursor.execute("SELECT 1 FROM blacklist WHERE uid = ?", (uid,))
-            return self.cursor.fetchone() is not None
-        except Exception as e:
-            print(f"检查黑名单时出错: {e}")
-            return False
-
-    def save_to_db(self, item):
-        """保存数据到数据库"""
-        try:
-            # 检查用户是否在黑名单中
-            is_blacklisted = self.check_blacklist(item['uid'])
-            if is_blacklisted:
-                print(f"商品 {item['c2cItemsId']} 的卖家 {item['uname']}(UID:{item['uid']}) 在黑名单中")
-            
-            # 检查是否已存在
-            existing_item = self.check_item_exists(item['c2cItemsId'])
-            
-            # 检查商品类型
-            if item['type'] != 1:
-                print(f"商品 {item['c2cItemsId']} 类型不是1，跳过")
-                return False
-            
-            # 检查是否有多个SKU
-            if len(item['detailDtoList']) > 1:
-                print(f"商品 {item['c2cItemsId']} 包含多个SKU，跳过")
-                return False
-            
-            # 匹配品牌
-            brand_id = self.match_brand(item['c2cItemsName'])
-            
-            # 如果商品已存在，检查是否需要更新
-            if existing_item:
-                needs_update = False
-                fields_to_check = [
-                    ('price', float(item['price']) / 100),
-                    ('show_price', item['showPrice']),
-                    ('show_market_price', item['showMarketPrice']),
-                    ('uid', item['uid']),
-                    ('uname', item['uname']),
-                    ('uface', item['uface']),
-                    ('uspace_jump_url', item['uspaceJumpUrl']),
-                    ('total_items_count', item['totalItemsCount']),
-                    ('payment_time', item['paymentTime']),
-                    ('is_my_publish', 1 if item['isMyPublish'] else 0)
-                ]
-                
-                for idx, (field, new_value) in enumerate(fields_to_check):
-                    if existing_item[idx + 1] != new_value:  # +1 因为第一个字段是id
-                        needs_update = True
-                        print(f"字段 {field} 需要更新: {existing_item[idx + 1]} -> {new_value}")
-                
-                if not needs_update:
-                    print(f"商品 {item['c2cItemsId']} 无需更新")
-                    return False
-                else:
-                    print(f"商品 {item['c2cItemsId']} 需要更新")
-            
-            # 处理SKU数据
-            for sku in item['detailDtoList']:
-                # 先更新SKU主表
-                self.cursor.execute('''
-                    INSERT OR REPLACE INTO skus (
-                        sku_id, name, img, market_price, type
-                    ) VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    sku['skuId'],
-                    sku['name'],
-                    sku['img'],
-                    float(sku['marketPrice']) / 100,  # 转换为元
-                    sku['type']
-                ))
-                
-                # 插入或更新商品主表数据
-                self.cursor.execute('''
-                    INSERT OR REPLACE INTO c2c_items (
-                        id, type, name, brand_id, sku_id, items_id,
-                        total_items_count, price, show_price, show_market_price,
-                        uid, payment_time, is_my_publish, uspace_jump_url,
-                        uface, uname, publish_status, is_blacklisted
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    item['c2cItemsId'],
-                    item['type'],
-                    item['c2cItemsName'],
-                    brand_id,
-                    sku['skuId'],
-                    sku['itemsId'],
-                    item['totalItemsCount'],
-                    float(item['price']) / 100,
-                    item['showPrice'],
-                    item['showMarketPrice'],
-                    item['uid'],
-                    item['paymentTime'],
-                    1 if item['isMyPublish'] else 0,
-                    item['uspaceJumpUrl'],
-                    item['uface'],
-                    item['uname'],
-                    1,  # 默认在售状态
-                    1 if is_blacklisted else 0  # 是否是黑名单用户
-                ))
-                
-                # 检查是否是可疑用户
-                if self.check_suspicious_user(item['uid'], item['uname'], sku['skuId']):
-                    print(f"用户 {item['uname']}(UID:{item['uid']}) 被标记为可疑用户")
-            
-            self.conn.commit()
-            print(f"商品 {item['c2cItemsId']} {'更新' if existing_item else '新增'} 成功")
-            return True
-            
-        except sqlite3.IntegrityError as e:
-            if "UNIQUE constraint failed" in str(e):
-                self.conn.rollback()
-                return False
-            raise
-        except Exception as e:
-            print(f"保存数据出错: {e}")
-            self.conn.rollback()
-            raise
-
     def check_blacklist_users(self):
         """检查一天内频���上架的用户"""
         try:
             print("\n=== 检查黑名单用户 ===")
             
             # 查找一天内对同一SKU上架超过20次的用户
-            self.cursor.execute("""
-                WITH user_stats AS (
-                    SELECT 
-                        c.uid,
-                        c.uname,
-                        c.sku_id,
-                        s.name as sku_name,
-                        COUNT(*) as listing_count,
-                        MIN(c.created_at) as first_listing,
-                        MAX(c.created_at) as last_listing
-                    FROM c2c_items c
-                    JOIN skus s ON c.sku_id = s.sku_id
-                    WHERE c.created_at >= datetime('now', '-24 hours')
-                    GROUP BY c.uid, c.uname, c.sku_id
-                    HAVING listing_count >= 20
-                )
-                SELECT us.*
-                FROM user_stats us
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM blacklist b 
-                    WHERE b.uid = us.uid
-                )
-            """)
+            self.cursor.execute(queries.BLACKLIST_USERS_24H, {'since_24h': int((time.time() - 24 * 3600) * 1000)})
             
             suspicious_users = self.cursor.fetchall()
             
@@ -428,259 +338,588 @@ class BiliMallSpider:
             
             print(f"发现 {len(suspicious_users)} 个黑名单用户")
             
-            for user in suspicious_users:
-                try:
-                    # 添加到黑名单
-                    self.cursor.execute("""
-                        INSERT INTO blacklist (uid, uname, reason)
-                        VALUES (?, ?, ?)
-                    """, (
-                        user[0],  # uid
-                        user[1],  # uname
-                        f"自动加入黑名单：24小时内对商品 {user[3]} 上架 {user[4]} 次"  # sku_name, listing_count
-                    ))
-                    
-                    # 更新该用户在该SKU下所有商品的状态为-1
-                    self.cursor.execute("""
-                        UPDATE c2c_items 
-                        SET publish_status = -1,
-                            is_blacklisted = 1,
-                            last_check_time = CURRENT_TIMESTAMP
-                        WHERE uid = ? AND sku_id = ?
-                    """, (user[0], user[2]))  # uid, sku_id
-                    
+            # 每个用户一个写任务：加入黑名单（已在黑名单中时跳过）并下架该用户在该SKU下的商品
+            futures = [
+                self.writer.submit([("""
+                    INSERT INTO blacklist (uid, uname, reason)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(uid) DO NOTHING
+                """, (
+                    user[0],  # uid
+                    user[1],  # uname
+                    f"自动加入黑名单：24小时内对商品 {user[3]} 上架 {user[4]} 次"  # sku_name, listing_count
+                ))] + self.offline_user_sku_items(user[0], user[2]))  # uid, sku_id
+                for user in suspicious_users
+            ]
+            
+            for user, future in zip(suspicious_users, futures):
+                results = self.writer.wait(future)
+                if results[0]['rowcount']:
                     print(f"用户 {user[1]}(UID:{user[0]}) 已加入黑名单")
                     print(f"原因：24小时内对商品 {user[3]} 上架 {user[4]} 次")
                     print(f"首次上架时间：{user[5]}")
                     print(f"最后上架时间：{user[6]}")
-                    
-                except sqlite3.IntegrityError:
-                    # 用户已在黑名单中，只更新商品状态
-                    self.cursor.execute("""
-                        UPDATE c2c_items 
-                        SET publish_status = -1,
-                            is_blacklisted = 1,
-                            last_check_time = CURRENT_TIMESTAMP
-                        WHERE uid = ? AND sku_id = ?
-                    """, (user[0], user[2]))  # uid, sku_id
-                    continue
             
-            self.conn.commit()
             print("=== 黑名单用户检查完成 ===\n")
             
-        except Exception as e:
-            print(f"检查黑名单用户时出错: {e}")
-            import traceback
-            print(traceback.format_exc())
-            self.conn.rollback()
+        except Exception:
+            logger.exception('blacklist_check_error')
+
+    def offline_user_sku_items(self, uid, sku_id):
+        """将黑名单用户在该SKU下的商品下架并记录状态变更事件的写入语句"""
+        now_ms = int(time.time() * 1000)
+        return [("""
+            INSERT INTO listing_events (item_id, old_status, new_status, price_cents, source, event_time)
+            SELECT id, publish_status, -1, price_cents, 'blacklist', ?
+            FROM c2c_items
+            WHERE uid = ? AND sku_id = ? AND publish_status IS NOT -1
+        """, (now_ms, uid, sku_id)), (queries.OFFLINE_USER_SKU, {
+            'now_ms': now_ms,
+            'uid': uid,
+            'sku_id': sku_id
+        })]
+
+    def record_stage(self, stage, elapsed):
+        """记录流水线阶段的处理耗时"""
+        with self.stage_lock:
+            stats = self.stage_stats[stage]
+            stats['pages'] += 1
+            stats['total_time'] += elapsed
+            stats['last_time'] = elapsed
+
+    def get_pipeline_stats(self):
+        """返回各阶段的队列深度和平均/最近耗时"""
+        with self.stage_lock:
+            stats = {}
+            for stage, values in self.stage_stats.items():
+                stats[stage] = {
+                    'pages': values['pages'],
+                    'avg_time': values['total_time'] / values['pages'] if values['pages'] else 0,
+                    'last_time': values['last_time'],
+                }
+        stats['fetch']['queue_depth'] = self.raw_queue.qsize() if self.raw_queue else 0
+        stats['parse']['queue_depth'] = self.parsed_queue.qsize() if self.parsed_queue else 0
+        return stats
+
+    def fetch_stage(self, shard, plan):
+        """抓取阶段：沿分片的 nextId 翻页，在当前页处理期间预取下一页
+        
+        到达上一轮高水位的页面之后不再继续请求。
+        """
+        page = 0
+        next_id = plan['next_id']
+        high_water_id = plan['high_water_id']
+        stop_event = plan['stop_event']
+        while page < plan['max_pages'] and not stop_event.is_set():
+            try:
+                logger.debug('page_fetch', shard=shard['key'], page=page + 1)
+                start = time.time()
+                response_data = self.fetch_data(next_id, shard)
+                
+                if not response_data:
+                    logger.warning('page_fetch_failed', shard=shard['key'], page=page + 1, retry_in=self.error_sleep)
+                    time.sleep(self.error_sleep)
+                    continue
+                
+                if response_data['code'] != 0:
+                    # 还有可用的 Cookie 时直接换一个重试
+                    retry_in = self.error_sleep if self.credentials.healthy_count() == 0 else 0
+                    logger.warning('page_fetch_failed', shard=shard['key'], page=page + 1,
+                                   message=response_data.get('message'), retry_in=retry_in)
+                    if retry_in:
+                        time.sleep(retry_in)
+                    continue
+                
+                self.record_stage('fetch', time.time() - start)
+                plan['requests'] += 1
+                items = response_data['data']['data']
+                if not items:
+                    logger.info('shard_exhausted', shard=shard['key'], page=page + 1)
+                    break
+                
+                next_id = response_data['data']['nextId']
+                reached = self.reached_high_water([item['c2cItemsId'] for item in items], high_water_id)
+                
+                # 队列已满时阻塞，形成背压
+                self.raw_queue.put((shard['key'], page, items, next_id, reached))
+                page += 1
+                
+                if reached:
+                    logger.info('shard_reached_high_water', shard=shard['key'], page=page, high_water_id=high_water_id)
+                    break
+            
+            except Exception:
+                logger.exception('page_fetch_error', shard=shard['key'], page=page + 1, retry_in=self.fatal_sleep)
+                time.sleep(self.fatal_sleep)
+                continue
+
+    def fetch_worker(self, shard_queue, plans):
+        """抓取线程：依次领取分片并抓取，全部分片领取完后发送结束标记"""
+        try:
+            while True:
+                try:
+                    shard = shard_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.fetch_stage(shard, plans[shard['key']])
+        except ReplayFinished as e:
+            print(f"回放结束: {e}")
+        finally:
+            self.raw_queue.put(None)  # 结束标记
+
+    def parse_stage(self, brands, producers=1):
+        """解析阶段：过滤不需要的商品并预先匹配品牌，收到所有抓取线程的结束标记后退出"""
+        finished = 0
+        while True:
+            page_data = self.raw_queue.get()
+            if page_data is None:
+                finished += 1
+                if finished >= producers:
+                    self.parsed_queue.put(None)
+                    return
+                continue
+            
+            shard_key, page, items, next_id, reached = page_data
+            start = time.time()
+            records = []
+            skipped_type = 0
+            skipped_multi_sku = 0
+            try:
+                for item in items:
+                    if item['type'] != 1:
+                        skipped_type += 1
+                        continue
+                    if len(item['detailDtoList']) > 1:
+                        skipped_multi_sku += 1
+                        continue
+                    records.append((item, self.match_brand(item['c2cItemsName'], brands)))
+            except Exception as e:
+                logger.warning('page_parse_failed', shard=shard_key, page=page + 1, error=str(e))
+            
+            self.record_stage('parse', time.time() - start)
+            if skipped_type:
+                self.metrics.inc('items_total', skipped_type, result='skipped_type')
+            if skipped_multi_sku:
+                self.metrics.inc('items_total', skipped_multi_sku, result='skipped_multi_sku')
+            self.parsed_queue.put({
+                'shard_key': shard_key,
+                'page': page,
+                'records': records,
+                'seen_ids': [item['c2cItemsId'] for item in items],
+                'skipped_type': skipped_type,
+                'skipped_multi_sku': skipped_multi_sku,
+                'next_id': next_id,
+                'reached_high_water': reached,
+            })
+
+    def write_page(self, records, seen_ids, checkpoint=None):
+        """写入阶段：把一页商品作为一个过程任务提交给写服务，等待提交后返回新增/更新的商品数
+        
+        checkpoint 为 (crawl_key, next_id, pending_high_water_id)，与页面数据在同一事务中保存。
+        逐个商品的处理在写连接上执行（list_writer.PageWriter），返回各处理结果的商品数。
+        """
+        start = time.time()
+        try:
+            result = self.writer.call(
+                'list_page',
+                records=records,
+                seen_ids=seen_ids,
+                checkpoint=checkpoint,
+                compact_relists=self.compact_relists
+            )
+        finally:
+            self.record_stage('write', time.time() - start)
+            self.metrics.observe('db_write_seconds', time.time() - start, stage='page')
+        for outcome, count in result['results'].items():
+            self.metrics.inc('items_total', count, result=outcome)
+        self.metrics.inc('pages_total')
+        metrics.mark_success(self.metrics)
+        return result['saved']
 
     def run(self, max_pages=100):
-        """持续运行爬虫，达到最大页数后从头开始"""
+        """持续运行爬虫，达到最大页数后从头开始
+        
+        每个分类按新商品到达率决定下一轮的时间和页数（不超过 max_pages），每轮只爬取到达计划时间的分类。
+        分类再按排序方式和价格区间划分分片，按各分片的历史产出分配该分类的页数预算。
+        多个抓取线程各自沿分片的 nextId 翻页，解析线程过滤并匹配品牌，主线程去重后批量写入数据库。
+        每页写入后保存该分片的游标，按时间排序的分片到达上一轮的高水位即结束；异常退出后从保存的游标继续。
+        """
         while True:  # 外层循环，确保持续运行
+            if self.session.finished:
+                print("回放数据已用完，停止爬取")
+                return
+            
+            # 所有分类都未到计划时间时，等待最早的一个
+            schedule = self.load_crawl_schedule()
+            now = time.time()
+            due_categories = [
+                category for category in self.categories
+                if (schedule.get(category, {}).get('next_round_at') or 0) <= now
+            ]
+            if not due_categories:
+                wait = min(schedule[category]['next_round_at'] for category in self.categories) - now
+                print(f"等待{wait:.0f}秒（{wait/60:.1f}分钟）后开始下一轮爬取...")
+                time.sleep(wait)
+                continue
+            
             # 在每轮开始前检查黑名单用户
             self.check_blacklist_users()
             
-            next_id = None
             page = 0
             total_items = 0
             new_items_count = 0
-            updated_items_count = 0  # 记录更新的商品数量
+            updated_at_start = self.metrics.get('items_total', result='updated')  # 本轮更新数按指标差值计算
             skipped_items = 0  # 记录跳过的多SKU商品数量
             skipped_type_items = 0  # 记录跳过的非类型1商品数量
-            self.duplicate_count = 0  # 重置重复计数
+            cross_shard_items = 0  # 记录其他分片本轮已写入的商品数量
+            written_ids = set()  # 本轮已写入的商品ID，用于分片间去重
+            round_start = time.time()
+            
+            shards = [shard for shard in self.plan_shards() if shard['category'] in due_categories]
+            states = {shard['key']: self.load_crawl_state(shard['key']) or {} for shard in shards}
+            budgets = {}
+            for category in due_categories:
+                planned_pages = schedule.get(category, {}).get('planned_pages') or max_pages
+                budgets.update(self.allocate_pages(
+                    [shard for shard in shards if shard['category'] == category],
+                    states,
+                    min(planned_pages, max_pages)
+                ))
+            plans = {}
+            for shard in shards:
+                state = states[shard['key']]
+                plans[shard['key']] = {
+                    'max_pages': budgets[shard['key']],
+                    'next_id': state.get('next_id'),
+                    # 只有按时间倒序的分片可以根据商品ID判断是否到达上一轮的位置
+                    'high_water_id': state.get('high_water_id') if shard['sort_type'] == 'TIME_DESC' else None,
+                    'pending_high_water_id': state.get('pending_high_water_id'),
+                    'yield_rate': state.get('yield_rate'),
+                    'stop_event': threading.Event(),
+                    'requests': 0,
+                    'pages': 0,
+                    'total_items': 0,
+                    'new_items': 0,
+                    'duplicate_count': 0,
+                    'reached_high_water': False,
+                }
+            
+            self.credentials.set_interval(self.min_sleep, self.max_sleep)
             
             print("\n=== 开始新一轮爬取 ===")
-            print(f"计划爬取最大页数: {max_pages}")
+            print(f"本轮爬取分类: {', '.join(due_categories)}，每个分类最多 {max_pages} 页")
+            print(f"Cookie 数: {len(self.credentials)}，可用: {self.credentials.healthy_count()}")
             print(f"连续重复数据页数阈值: {self.max_duplicate_pages}")
-            
-            while page < max_pages and self.duplicate_count < self.max_duplicate_pages:
+            print(f"分片数: {len(shards)}，同时抓取: {min(self.shard_workers, len(shards))}")
+            for shard in shards:
+                plan = plans[shard['key']]
+                yield_rate = f"{plan['yield_rate']:.2f}" if plan['yield_rate'] is not None else "未知"
+                print(f"分片 {shard['key']}: 预算 {plan['max_pages']} 页，历史产出 {yield_rate} 个/请求，"
+                      f"上一轮高水位 {plan['high_water_id']}")
+                if plan['next_id']:
+                    print(f"分片 {shard['key']} 从上次中断的位置继续: nextId={plan['next_id']}")
+            
+            # 产出高的分片优先抓取，没有历史数据的分片最先探测
+            shard_queue = queue.Queue()
+            for shard in sorted(
+                shards,
+                key=lambda s: float('inf') if plans[s['key']]['yield_rate'] is None else plans[s['key']]['yield_rate'],
+                reverse=True
+            ):
+                shard_queue.put(shard)
+            
+            worker_count = max(1, min(self.shard_workers, len(shards)))
+            self.stage_stats = {
+                stage: {'pages': 0, 'total_time': 0.0, 'last_time': 0.0}
+                for stage in ('fetch', 'parse', 'write')
+            }
+            self.raw_queue = queue.Queue(maxsize=self.prefetch_pages * worker_count)
+            self.parsed_queue = queue.Queue(maxsize=self.prefetch_pages * worker_count)
+            fetch_threads = [
+                threading.Thread(target=self.fetch_worker, args=(shard_queue, plans), daemon=True)
+                for _ in range(worker_count)
+            ]
+            parse_thread = threading.Thread(
+                target=self.parse_stage,
+                args=(self.load_brands(), worker_count),
+                daemon=True
+            )
+            for fetch_thread in fetch_threads:
+                fetch_thread.start()
+            parse_thread.start()
+            
+            while True:
+                page_data = self.parsed_queue.get()
+                if page_data is None:
+                    break
+                shard_key = page_data['shard_key']
+                plan = plans[shard_key]
+                if plan['stop_event'].is_set():
+                    # 该分片已达到停止条件，丢弃预取的页面
+                    continue
+                
+                seen_ids = page_data['seen_ids']
+                # 同一商品可能出现在多个分片中，本轮已写入的不再重复处理
+                records = [
+                    (item, brand_id) for item, brand_id in page_data['records']
+                    if item['c2cItemsId'] not in written_ids
+                ]
+                page_cross_shard = len(page_data['records']) - len(records)
+                page_skipped_items = page_data['skipped_multi_sku']
                 try:
-                    print(f"\n正在爬取第 {page + 1} 页...")
-                    response_data = self.fetch_data(next_id)
-                    
-                    if not response_data:
-                        print("获取数据失败，等待30秒后重试...")
-                        time.sleep(self.error_sleep)
-                        continue
-                    
-                    if response_data['code'] != 0:
-                        print(f"获取数据失败: {response_data['message']}")
-                        print(f"等待{self.error_sleep}秒后重试...")
-                        time.sleep(self.error_sleep)
-                        continue
-                    
-                    items = response_data['data']['data']
-                    if not items:
-                        print("没有更多数据了")
-                        break
-                    
-                    print(f"本页获取到 {len(items)} 个商品")
-                    page_new_items = 0
-                    page_skipped_items = 0
-                    
-                    for item in items:
-                        if item['type'] != 1:
-                            skipped_type_items += 1
-                            continue
-                        if len(item['detailDtoList']) > 1:
-                            page_skipped_items += 1
-                            continue
-                        if self.save_to_db(item):
-                            page_new_items += 1
-                        total_items += 1
+                    skipped_type_items += page_data['skipped_type']
+                    plan['pending_high_water_id'] = max([plan['pending_high_water_id'] or 0] + seen_ids)
+                    page_new_items = self.write_page(
+                        records,
+                        seen_ids,
+                        checkpoint=(shard_key, page_data['next_id'], plan['pending_high_water_id'])
+                    )
+                    written_ids.update(item['c2cItemsId'] for item, _ in records)
+                    total_items += len(records)
+                    cross_shard_items += page_cross_shard
+                    plan['total_items'] += len(records)
                     
                     # 检查本页新增商品数量
                     if page_new_items == 0:
-                        self.duplicate_count += 1
-                        print(f"本页没有新商品，连续重复页数: {self.duplicate_count}")
+                        plan['duplicate_count'] += 1
                     else:
-                        self.duplicate_count = 0
+                        plan['duplicate_count'] = 0
+                        plan['new_items'] += page_new_items
                         new_items_count += page_new_items
                         skipped_items += page_skipped_items
-                        print(f"本页新增商品数: {page_new_items}, 跳过多SKU商品: {page_skipped_items}")
                     
-                    next_id = response_data['data']['nextId']
                     page += 1
+                    plan['pages'] += 1
+                    if page_data['reached_high_water']:
+                        plan['reached_high_water'] = True
+                    if plan['duplicate_count'] >= self.max_duplicate_pages:
+                        plan['stop_event'].set()
                     
-                    print(f"当前进度: {page}/{max_pages} 页")
-                    print(f"已爬取商品总数: {total_items}")
-                    print(f"新增商品数: {new_items_count}")
-                    print(f"更新商品数: {updated_items_count}")
-                    print(f"跳过多SKU商品: {skipped_items}")
-                    print(f"跳过非类型1商品: {skipped_type_items}")
-                    print(f"连续重复页数: {self.duplicate_count}/{self.max_duplicate_pages}")
-                    
-                except Exception as e:
-                    print(f"爬取过程出错: {e}")
-                    import traceback
-                    print("详细错误信息:")
-                    print(traceback.format_exc())
-                    print(f"等待{self.fatal_sleep}秒后继续...")
-                    time.sleep(self.fatal_sleep)
+                    # 每页一行进度，逐页的累计数据见 /metrics
+                    logger.info('page_written', shard=shard_key, page=f"{plan['pages']}/{plan['max_pages']}",
+                                items=len(seen_ids), saved=page_new_items, cross_shard=page_cross_shard,
+                                skipped_multi_sku=page_skipped_items, skipped_type=page_data['skipped_type'],
+                                duplicate_pages=f"{plan['duplicate_count']}/{self.max_duplicate_pages}",
+                                round_pages=f"{page}/{max_pages}", round_saved=new_items_count)
+                
+                except Exception:
+                    logger.exception('page_write_error', shard=shard_key, page=page_data['page'] + 1)
                     continue
-
-            # 一轮爬取结束
-            if self.duplicate_count >= self.max_duplicate_pages:
-                print(f"\n已连续 {self.max_duplicate_pages} 页没有新数据")
-            elif page >= max_pages:
-                print(f"\n已达到最大页数限制 {max_pages}")
             
+            for fetch_thread in fetch_threads:
+                fetch_thread.join()
+            parse_thread.join()
+            
+            # 一轮爬取结束，保存各分片的进度和产出
             print("\n=== 本轮爬取完成 ===")
+            requests_count = 0
+            for shard in shards:
+                plan = plans[shard['key']]
+                if plan['reached_high_water']:
+                    stop_reason = 'high_water'
+                elif plan['duplicate_count'] >= self.max_duplicate_pages:
+                    stop_reason = 'duplicate_pages'
+                elif plan['pages'] >= plan['max_pages']:
+                    stop_reason = 'max_pages'
+                else:
+                    stop_reason = 'end_of_list'
+                plan['stop_reason'] = stop_reason
+                
+                # 每次请求新增商品数的指数平滑，用于下一轮分配页数
+                yield_rate = plan['yield_rate']
+                if plan['requests']:
+                    round_yield = plan['new_items'] / plan['requests']
+                    yield_rate = round_yield if yield_rate is None else (
+                        self.yield_alpha * round_yield + (1 - self.yield_alpha) * yield_rate
+                    )
+                
+                requests_count += plan['requests']
+                self.finish_crawl_round(
+                    shard['key'],
+                    max(plan['high_water_id'] or 0, plan['pending_high_water_id'] or 0) or None,
+                    {
+                        'pages': plan['pages'],
+                        'max_pages': plan['max_pages'],
+                        'requests': plan['requests'],
+                        'wasted_requests': plan['requests'] - plan['pages'],
+                        'total_items': plan['total_items'],
+                        'new_items': plan['new_items'],
+                        'stop_reason': stop_reason,
+                        'resumed': bool(plan['next_id']),
+                        'started_at': round_start,
+                        'finished_at': time.time(),
+                    },
+                    yield_rate
+                )
+                print(f"分片 {shard['key']}: 页数 {plan['pages']}/{plan['max_pages']}，请求数 {plan['requests']}，"
+                      f"新增 {plan['new_items']}，结束原因 {stop_reason}")
+            
             print(f"总计爬取页数: {page}")
+            print(f"总计请求数: {requests_count}")
             print(f"总计商品数: {total_items}")
             print(f"新增商品数: {new_items_count}")
-            print(f"更新商品数: {updated_items_count}")
+            print(f"更新商品数: {self.metrics.get('items_total', result='updated') - updated_at_start}")
             print(f"跳过多SKU商品: {skipped_items}")
             print(f"跳过非类型1商品: {skipped_type_items}")
-            print(f"连续重复页数: {self.duplicate_count}/{self.max_duplicate_pages}")
+            print(f"其他分片已写入商品: {cross_shard_items}")
+            elapsed = max(time.time() - round_start, 1e-6)
+            print(f"速率: {page / elapsed:.2f} 页/秒，{total_items / elapsed:.2f} 商品/秒")
+            print("流水线状态: " + ", ".join(
+                f"{stage} 平均{values['avg_time']:.2f}s/页"
+                for stage, values in self.get_pipeline_stats().items()
+            ))
+            self.credentials.print_stats()
+            
+            # 更新各分类的到达率估计并计划下一轮
+            for category in due_categories:
+                category_shards = [shard for shard in shards if shard['category'] == category]
+                self.update_arrival_estimate(
+                    category,
+                    sum(plans[shard['key']]['new_items'] for shard in category_shards),
+                    round_start,
+                    # 按时间排序的分片没到高水位就用完了页数，说明还有新商品没抓到
+                    any(
+                        plans[shard['key']]['stop_reason'] == 'max_pages'
+                        for shard in category_shards if shard['sort_type'] == 'TIME_DESC'
+                    ),
+                    max_pages
+                )
             
             # 清理超额记录
             self.cleanup_excess_listings()
-            
-            print(f"等待{self.round_sleep}秒（{self.round_sleep/60:.1f}分钟）后开始下一轮爬取...")
-            time.sleep(self.round_sleep)
 
     def close(self):
-        """关闭数据库连接"""
+        """关闭数据库连接和HTTP会话"""
+        if hasattr(self, 'session') and self.session:
+            self.session.close()
+        if hasattr(self, 'writer') and self.writer:
+            self.writer.close()
         if hasattr(self, 'cursor') and self.cursor:
             self.cursor.close()
         if hasattr(self, 'conn') and self.conn:
             self.conn.close()
 
     def cleanup_excess_listings(self):
-        """清理每个用户每个SKU超过3条的在售记录"""
+        """清理每个用户每个SKU超过 max_listings_per_sku 条的在售记录
+        
+        用窗口函数一次找出所有需要删除的记录，再按 cleanup_batch_size 分批删除，
+        每批一个事务，避免长时间持有写锁。
+        """
         try:
             print("\n=== 开始清理超额记录 ===")
+            start = time.time()
             
-            # 查找每个用户每个SKU的在售记录数量
-            self.cursor.execute("""
-                WITH user_sku_counts AS (
-                    SELECT 
-                        uid,
-                        uname,
-                        sku_id,
-                        COUNT(*) as listing_count
-                    FROM c2c_items
-                    WHERE publish_status = 1
-                    GROUP BY uid, uname, sku_id
-                    HAVING listing_count > 3
-                )
-                SELECT 
-                    usc.*,
-                    s.name as sku_name
-                FROM user_sku_counts usc
-                JOIN skus s ON usc.sku_id = s.sku_id
-                ORDER BY listing_count DESC
-            """)
-            
+            # 每个用户每个SKU按上架时间保留最新的 max_listings_per_sku 条
+            self.cursor.execute(queries.EXCESS_LISTINGS, {'max_listings': self.max_listings_per_sku})
             excess_records = self.cursor.fetchall()
             
             if not excess_records:
                 print("没有需要清理的超额记录")
-                return
+                return {}
             
             total_deleted = 0
-            print(f"发现 {len(excess_records)} 个用户/SKU组合需要清理")
-            
-            for record in excess_records:
-                # 获取该用户该SKU的所有在售记录
-                self.cursor.execute("""
-                    SELECT id
-                    FROM c2c_items
-                    WHERE uid = ? AND sku_id = ? AND publish_status = 1
-                    ORDER BY created_at DESC
-                    LIMIT -1 OFFSET 3
-                """, (record[0], record[2]))  # uid, sku_id
-                
-                to_delete = self.cursor.fetchall()
-                if to_delete:
-                    # 删除多余的记录
-                    self.cursor.execute("""
-                        DELETE FROM c2c_items
-                        WHERE id IN (
-                            SELECT id
-                            FROM c2c_items
-                            WHERE uid = ? AND sku_id = ? AND publish_status = 1
-                            ORDER BY created_at DESC
-                            LIMIT -1 OFFSET 3
-                        )
-                    """, (record[0], record[2]))
-                    
-                    deleted_count = len(to_delete)
-                    total_deleted += deleted_count
-                    print(f"用户 {record[1]} 的商品 {record[4]} "
-                          f"(SKU:{record[2]}) 删除了 {deleted_count} 条旧记录")
-            
-            self.conn.commit()
-            print(f"=== 清理完成，共删除 {total_deleted} 条记录 ===\n")
-            
-        except Exception as e:
-            print(f"清理超额记录时出错: {e}")
-            import traceback
-            print(traceback.format_exc())
-            self.conn.rollback()
+            for offset in range(0, len(excess_records), self.cleanup_batch_size):
+                batch_ids = [record[0] for record in excess_records[offset:offset + self.cleanup_batch_size]]
+                placeholders = ','.join('?' * len(batch_ids))
+                # 查询之后状态已变化（如已售出）的记录不再删除
+                results = self.writer.execute([(f"""
+                    DELETE FROM c2c_items
+                    WHERE publish_status = 1 AND id IN ({placeholders})
+                """, batch_ids)])
+                total_deleted += results[0]['rowcount']
+            
+            # 按卖家汇总删除的记录数和涉及的SKU数
+            seller_totals = {}
+            for _, uid, uname, sku_id in excess_records:
+                totals = seller_totals.setdefault(uid, {'uname': uname, 'deleted': 0, 'skus': set()})
+                totals['deleted'] += 1
+                totals['skus'].add(sku_id)
+            
+            print(f"涉及 {len(seller_totals)} 个用户，"
+                  f"{len({(record[1], record[3]) for record in excess_records})} 个用户/SKU组合")
+            for uid, totals in sorted(seller_totals.items(), key=lambda item: item[1]['deleted'], reverse=True):
+                print(f"用户 {totals['uname']}(UID:{uid}) 删除了 {totals['deleted']} 条旧记录，"
+                      f"涉及 {len(totals['skus'])} 个SKU")
+            
+            print(f"=== 清理完成，共删除 {total_deleted} 条记录，耗时 {time.time() - start:.2f} 秒 ===\n")
+            return {uid: totals['deleted'] for uid, totals in seller_totals.items()}
+        
+        except Exception:
+            logger.exception('excess_cleanup_error')
+            return {}
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='B站商城爬虫')
-    parser.add_argument('--cookie', type=str, required=True, help='浏览器Cookie字符串')
-    parser.add_argument('--pages', type=int, default=100, help='要爬取的最大页数，默认100页')
+    parser.add_argument('--cookie', type=str, help='浏览器Cookie字符串')
+    parser.add_argument('--cookie-file', type=str, help='Cookie文件，每行一个Cookie，请求分散到各个Cookie上')
+    parser.add_argument('--bench-seconds', type=int, default=300, help='Cookie连续异常时的首次停用时长(秒)，默认300秒')
+    parser.add_argument('--base-url', type=str, default='https://mall.bilibili.com', help='接口地址，可指向本地模拟服务 scripts/fake_mall_server.py')
+    parser.add_argument('--record', type=str, metavar='DIR', help='把接口请求和响应录制到该目录（gzip 分段文件）')
+    parser.add_argument('--replay', type=str, metavar='DIR', help='从该目录回放录制的响应，不访问网络')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='回放速度：1 按录制时的间隔，2 为两倍速，0 为尽可能快，默认1')
+    parser.add_argument('--pages', type=int, default=100, help='每个分类每轮最多爬取的页数（按分片产出分配给各分片），默认100页')
     parser.add_argument('--duplicate-threshold', type=int, default=5, help='连续重复页数阈值，默认5页')
-    parser.add_argument('--min-sleep', type=float, default=2, help='最小休眠时间(秒)，默认2秒')
-    parser.add_argument('--max-sleep', type=float, default=5, help='最大休眠时间(秒)，默认5秒')
+    parser.add_argument('--min-sleep', type=float, default=2, help='每个Cookie的最小请求间隔(秒)，默认2秒')
+    parser.add_argument('--max-sleep', type=float, default=5, help='每个Cookie的最大请求间隔(秒)，默认5秒')
     parser.add_argument('--error-sleep', type=int, default=30, help='错误重试休眠时间(秒)，默认30秒')
     parser.add_argument('--fatal-sleep', type=int, default=60, help='严重错误休眠时间(秒)，默认60秒')
-    parser.add_argument('--round-sleep', type=int, default=300, help='每轮结束后的休眠时间(秒)，默认300秒')
-    parser.add_argument('--category', type=str, default="2312", help='商品分类ID，默认2312')
+    parser.add_argument('--round-sleep', type=int, default=300, help='还没有到达率估计时每轮结束后的休眠时间(秒)，默认300秒')
+    parser.add_argument('--target-freshness', type=int, default=300, help='目标新鲜度：新上架商品最迟多少秒内被抓取，默认300秒')
+    parser.add_argument('--request-budget', type=int, default=720, help='列表接口每小时请求预算（所有分类合计），默认720次')
+    parser.add_argument('--min-round-sleep', type=int, default=30, help='两轮之间的最短间隔(秒)，默认30秒')
+    parser.add_argument('--max-round-sleep', type=int, default=1800, help='两轮之间的最长间隔(秒)，默认1800秒')
+    parser.add_argument('--category', type=str, default="2312", help='商品分类ID，多个用逗号分隔，默认2312')
+    parser.add_argument('--sort-types', type=str, default="TIME_DESC", help='排序方式，多个用逗号分隔，如 TIME_DESC,PRICE_ASC,PRICE_DESC，默认TIME_DESC')
+    parser.add_argument('--price-bands', type=str, default="", help='价格区间（元），多个用逗号分隔，如 0-50,50-200,200-100000，默认不按价格分片')
+    parser.add_argument('--shard-workers', type=int, default=3, help='同时抓取的分片数，默认3')
+    parser.add_argument('--compact-relists', action='store_true', help='同一卖家同一SKU同价格的重新上架合并为一条商品记录，商品ID记入 c2c_item_relists')
+    parser.add_argument('--keep-listings', type=int, default=3, help='每个用户每个SKU保留的在售记录数，默认3条')
+    parser.add_argument('--prefetch-pages', type=int, default=1, help='流水线预取页数（队列长度），默认1页')
+    parser.add_argument('--writer-socket', type=str, help='写服务的 Unix socket 路径（python -m spider.db_writer），默认读取环境变量 BMALL_WRITER_SOCKET，都未设置时在本进程内写入')
+    parser.add_argument('--metrics-port', type=int, default=0, help='在该端口提供 Prometheus 格式的 /metrics，默认0不提供')
+    parser.add_argument('--log-level', type=str.upper, choices=log.LEVELS, default=log.DEFAULT_LEVEL, help='日志级别，DEBUG 时输出逐个商品的处理过程，默认读取环境变量 BMALL_LOG_LEVEL，未设置时为 INFO')
     args = parser.parse_args()
+    if not args.cookie and not args.cookie_file and not args.replay:
+        parser.error('需要提供 --cookie 或 --cookie-file')
+    if args.record and args.replay:
+        parser.error('--record 和 --replay 不能同时使用')
 
-    spider = BiliMallSpider(cookie=args.cookie)
+    log.setup(args.log_level)
+    credentials = CredentialPool.from_file(args.cookie_file) if args.cookie_file else CredentialPool([args.cookie])
+    credentials.bench_seconds = args.bench_seconds
+    spider = BiliMallSpider(credentials=credentials, writer_socket=args.writer_socket)
+    if args.metrics_port:
+        metrics.serve(spider.metrics, args.metrics_port)
     spider.max_duplicate_pages = args.duplicate_threshold
     spider.min_sleep = args.min_sleep
     spider.max_sleep = args.max_sleep
     spider.error_sleep = args.error_sleep
     spider.fatal_sleep = args.fatal_sleep
     spider.round_sleep = args.round_sleep
-    spider.category = args.category
+    spider.target_freshness = args.target_freshness
+    spider.request_budget = args.request_budget
+    spider.min_round_sleep = args.min_round_sleep
+    spider.max_round_sleep = args.max_round_sleep
+    spider.categories = [category.strip() for category in args.category.split(',') if category.strip()]
+    spider.sort_types = [sort_type.strip() for sort_type in args.sort_types.split(',') if sort_type.strip()]
+    # 接口的价格筛选以分为单位
+    spider.price_bands = [
+        '-'.join(str(int(float(price) * 100)) for price in band.split('-'))
+        for band in args.price_bands.split(',') if band.strip()
+    ]
+    spider.shard_workers = args.shard_workers
+    spider.url = spider.url.replace('https://mall.bilibili.com', args.base_url.rstrip('/'))
+    if args.record:
+        spider.session = LiveSession(TrafficRecorder(args.record))
+    if args.replay:
+        # 回放时由回放会话控制节奏，关闭爬虫自身的等待
+        spider.session = ReplaySession(args.replay, speed=args.replay_speed)
+        spider.min_sleep = spider.max_sleep = 0
+        spider.error_sleep = spider.fatal_sleep = 0
+        spider.round_sleep = spider.min_round_sleep = spider.max_round_sleep = 0
+    spider.prefetch_pages = args.prefetch_pages
+    spider.max_listings_per_sku = args.keep_listings
+    spider.compact_relists = args.compact_relists
     try:
         spider.run(max_pages=args.pages)
     finally:
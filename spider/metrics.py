@@ -0,0 +1,197 @@
+"""爬虫指标：计数器、直方图和仪表，以 Prometheus 文本格式通过 HTTP /metrics 暴露
+
+只依赖标准库。指标在各线程中直接更新（加锁），抓取 /metrics 时生成文本，
+不需要单独的统计线程；每秒页数、每秒商品数等速率由 Prometheus 按计数器计算。
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 接口请求和数据库写入耗时（秒）的直方图桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """线程安全的指标表，name 自动加上 prefix 前缀
+
+    先用 counter/histogram/gauge 声明指标，再按标签更新：
+    inc 累加计数器，observe 记录直方图样本，set 设置仪表，
+    gauge_function 注册在抓取时才计算的仪表（如距上次成功的秒数）。
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> (类型, 说明, 直方图桶)
+        self.values = {}  # name -> {标签: 值}，直方图的值为 [各桶计数, 总和, 样本数]
+        self.functions = {}  # name -> {标签: 函数}
+
+    def declare(self, kind, name, help, buckets=None):
+        with self.lock:
+            self.metrics[name] = (kind, help, buckets)
+            self.values.setdefault(name, {})
+
+    def counter(self, name, help):
+        self.declare('counter', name, help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.declare('histogram', name, help, tuple(buckets))
+
+    def gauge(self, name, help):
+        self.declare('gauge', name, help)
+
+    def inc(self, name, value=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = label_key(labels)
+        buckets = self.metrics[name][2]
+        with self.lock:
+            series = self.values[name]
+            if key not in series:
+                series[key] = [[0] * len(buckets), 0.0, 0]
+            histogram = series[key]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def time(self, name, **labels):
+        """with metrics.time(name): ... 记录代码块的耗时（秒）"""
+        return Timer(self, name, labels)
+
+    def gauge_function(self, name, func, **labels):
+        """抓取时调用 func() 得到仪表的值，返回 None 时不输出该序列"""
+        with self.lock:
+            self.functions.setdefault(name, {})[label_key(labels)] = func
+
+    def get(self, name, **labels):
+        """计数器或仪表的当前值（直方图为样本数），没有记录时为 0"""
+        with self.lock:
+            value = self.values[name].get(label_key(labels), 0)
+        return value[2] if isinstance(value, list) else value
+
+    def render(self):
+        """生成 Prometheus 文本格式"""
+        with self.lock:
+            metrics = dict(self.metrics)
+            values = {name: {key: [list(v[0]), v[1], v[2]] if isinstance(v, list) else v
+                             for key, v in series.items()}
+                      for name, series in self.values.items()}
+            functions = {name: dict(series) for name, series in self.functions.items()}
+
+        lines = []
+        for name, (kind, help, buckets) in metrics.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            series = values.get(name, {})
+            for key, func in functions.get(name, {}).items():
+                try:
+                    value = func()
+                except Exception:
+                    value = None
+                if value is not None:
+                    series[key] = value
+            for key, value in sorted(series.items()):
+                if kind != 'histogram':
+                    lines.append(f"{full_name}{format_labels(key)} {format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{format_labels(key, [('le', format_value(bound))])} {cumulative}")
+                lines.append(f"{full_name}_bucket{format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{full_name}_sum{format_labels(key)} {format_value(total)}")
+                lines.append(f"{full_name}_count{format_labels(key)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def spider_metrics(prefix):
+    """两个爬虫共用的指标：请求耗时、接口返回码、商品处理结果、写入耗时和最近一次成功的时间"""
+    metrics = Metrics(prefix)
+    metrics.histogram('request_seconds', '接口请求耗时（秒），endpoint 为 list 或 detail')
+    metrics.counter('responses_total', '接口响应数，按 HTTP 状态码和接口返回码 code 区分；请求异常时 status="error"')
+    metrics.counter('pages_total', '成功处理的列表页数')
+    metrics.counter('items_total', '处理的商品数，按结果 result 区分（新增/更新/无变化/跳过/失败等）')
+    metrics.histogram('db_write_seconds', '数据库写入耗时（秒）')
+    metrics.gauge('last_success_timestamp_seconds', '最近一次成功写入的 Unix 时间戳')
+    metrics.gauge('seconds_since_last_success', '距最近一次成功写入的秒数（进程启动后尚未成功时为距启动的秒数）')
+    started = time.time()
+    metrics.gauge_function(
+        'seconds_since_last_success',
+        lambda: time.time() - (metrics.get('last_success_timestamp_seconds') or started))
+    return metrics
+
+
+def mark_success(metrics):
+    metrics.set('last_success_timestamp_seconds', time.time())
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取请求很频繁，不输出访问日志
+
+
+def serve(metrics, port, host='0.0.0.0'):
+    """在后台线程中提供 http://host:port/metrics，返回 HTTP 服务（server.shutdown() 停止）"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
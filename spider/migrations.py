@@ -0,0 +1,1010 @@
+"""数据库表结构和迁移
+
+表结构只在本模块中定义。MIGRATIONS 按版本号顺序执行，执行过的版本和校验和记录在 schema_version 表中；
+启动时只读取 schema_version，数据库已是最新时不执行任何建表语句。已执行的迁移不能修改（校验和不一致时报错），
+表结构的变化需要新增一个版本。新数据库不逐个执行迁移，直接创建最终结构（SCHEMA）。
+
+迁移分两种：
+- 离线迁移（建表、重建表等）必须可以重复执行，执行完才记录版本；
+- 在线迁移（online=True，建索引、回填数据等耗时操作）分步执行，每步一个短事务，
+  进度记录在 schema_version.progress 中，中断后从上次的进度继续，执行期间其他程序照常读写。
+"""
+import fcntl
+import hashlib
+import inspect
+import sqlite3
+import time
+
+DB_PATH = './db/bilibili_mall.db'
+
+# 迁移到 sellers 表时从 c2c_items 移除的卖家资料字段
+SELLER_PROFILE_COLUMNS = ('uname', 'uface', 'uspace_jump_url')
+
+# 当前时间的毫秒时间戳（SQL 表达式，用作字段默认值）
+NOW_MS_SQL = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+BRANDS_TABLE = '''
+CREATE TABLE IF NOT EXISTS brands (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    keywords TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+# 时间以毫秒时间戳、价格以分为单位存储；原来的 created_at、price 等字段保留为虚拟生成列，
+# 由整数字段计算得到，读取结果与迁移前一致
+SKUS_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {{name}} (
+    sku_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    img TEXT,
+    market_price_cents INTEGER,
+    market_price REAL GENERATED ALWAYS AS (market_price_cents / 100.0) VIRTUAL,
+    type INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+# next_check_at、check_count、unchanged_streak 为状态爬虫的调度字段
+C2C_ITEMS_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {{name}} (
+    id INTEGER PRIMARY KEY,
+    type INTEGER,
+    name TEXT,
+    brand_id INTEGER,
+    sku_id INTEGER,
+    items_id INTEGER,
+    total_items_count INTEGER,
+    price_cents INTEGER,
+    price REAL GENERATED ALWAYS AS (price_cents / 100.0) VIRTUAL,
+    show_price TEXT,
+    show_market_price TEXT,
+    uid INTEGER,
+    payment_time INTEGER,
+    is_my_publish INTEGER,
+    publish_status INTEGER DEFAULT 1,
+    is_blacklisted INTEGER DEFAULT 0,
+    created_ms INTEGER DEFAULT ({NOW_MS_SQL}),
+    created_at TIMESTAMP GENERATED ALWAYS AS (datetime(created_ms / 1000, 'unixepoch')) VIRTUAL,
+    last_check_ms INTEGER,
+    last_check_time TIMESTAMP GENERATED ALWAYS AS (datetime(last_check_ms / 1000, 'unixepoch')) VIRTUAL,
+    last_seen_in_list TIMESTAMP,
+    relist_count INTEGER DEFAULT 0,
+    latest_item_id INTEGER,
+    last_listed_at TIMESTAMP,
+    next_check_at TIMESTAMP,
+    check_count INTEGER DEFAULT 0,
+    unchanged_streak INTEGER DEFAULT 0,
+    FOREIGN KEY (brand_id) REFERENCES brands(id),
+    FOREIGN KEY (sku_id) REFERENCES skus(sku_id)
+)
+'''
+
+# 迁移 11 之后的 c2c_items 结构（C2C_ITEMS_TABLE 由已执行的迁移使用，不能修改）：
+# 下次检查时间、列表出现时间和重新上架时间也改存毫秒时间戳，原字段保留为虚拟生成列
+C2C_ITEMS_MS_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {{name}} (
+    id INTEGER PRIMARY KEY,
+    type INTEGER,
+    name TEXT,
+    brand_id INTEGER,
+    sku_id INTEGER,
+    items_id INTEGER,
+    total_items_count INTEGER,
+    price_cents INTEGER,
+    price REAL GENERATED ALWAYS AS (price_cents / 100.0) VIRTUAL,
+    show_price TEXT,
+    show_market_price TEXT,
+    uid INTEGER,
+    payment_time INTEGER,
+    is_my_publish INTEGER,
+    publish_status INTEGER DEFAULT 1,
+    is_blacklisted INTEGER DEFAULT 0,
+    created_ms INTEGER DEFAULT ({NOW_MS_SQL}),
+    created_at TIMESTAMP GENERATED ALWAYS AS (datetime(created_ms / 1000, 'unixepoch')) VIRTUAL,
+    last_check_ms INTEGER,
+    last_check_time TIMESTAMP GENERATED ALWAYS AS (datetime(last_check_ms / 1000, 'unixepoch')) VIRTUAL,
+    last_seen_ms INTEGER,
+    last_seen_in_list TIMESTAMP GENERATED ALWAYS AS (datetime(last_seen_ms / 1000, 'unixepoch')) VIRTUAL,
+    relist_count INTEGER DEFAULT 0,
+    latest_item_id INTEGER,
+    last_listed_ms INTEGER,
+    last_listed_at TIMESTAMP GENERATED ALWAYS AS (datetime(last_listed_ms / 1000, 'unixepoch')) VIRTUAL,
+    next_check_ms INTEGER,
+    next_check_at TIMESTAMP GENERATED ALWAYS AS (datetime(next_check_ms / 1000, 'unixepoch')) VIRTUAL,
+    check_count INTEGER DEFAULT 0,
+    unchanged_streak INTEGER DEFAULT 0,
+    FOREIGN KEY (brand_id) REFERENCES brands(id),
+    FOREIGN KEY (sku_id) REFERENCES skus(sku_id)
+)
+'''
+
+# 卖家表：每个卖家的最新资料
+SELLERS_TABLE = '''
+CREATE TABLE IF NOT EXISTS sellers (
+    uid INTEGER PRIMARY KEY,
+    uname TEXT,
+    uface TEXT,
+    uspace_jump_url TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+# 卖家昵称历史表：每次昵称变化一行，changed_at 为首次见到该昵称的时间
+SELLER_NAME_HISTORY_TABLE = '''
+CREATE TABLE IF NOT EXISTS seller_name_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER NOT NULL,
+    uname TEXT NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+BLACKLIST_TABLE = '''
+CREATE TABLE IF NOT EXISTS blacklist (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL,
+    uname TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(uid)
+)
+'''
+
+# 商品状态变更事件表（只追加），event_time 为毫秒时间戳
+LISTING_EVENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS listing_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER NOT NULL,
+    old_status INTEGER,
+    new_status INTEGER NOT NULL,
+    price REAL,
+    source TEXT NOT NULL,
+    event_time INTEGER NOT NULL
+)
+'''
+
+# 迁移 11 之后的 listing_events 结构：价格改存整数分，price 保留为虚拟生成列
+LISTING_EVENTS_CENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER NOT NULL,
+    old_status INTEGER,
+    new_status INTEGER NOT NULL,
+    price_cents INTEGER,
+    price REAL GENERATED ALWAYS AS (price_cents / 100.0) VIRTUAL,
+    source TEXT NOT NULL,
+    event_time INTEGER NOT NULL
+)
+'''
+
+# 过期事件压缩后的按天汇总
+LISTING_EVENT_DAILY_TABLE = '''
+CREATE TABLE IF NOT EXISTS listing_event_daily (
+    day TEXT NOT NULL,
+    new_status INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    event_count INTEGER NOT NULL,
+    PRIMARY KEY (day, new_status, source)
+)
+'''
+
+# 爬取进度表：每个分片（分类/排序方式/价格区间）的高水位、游标、本轮统计和历史产出
+CRAWL_STATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS crawl_state (
+    crawl_key TEXT PRIMARY KEY,
+    high_water_id INTEGER,
+    pending_high_water_id INTEGER,
+    next_id TEXT,
+    round_stats TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    yield_rate REAL
+)
+'''
+
+# 爬取调度表：每个分类的新商品到达率估计和下一轮计划，时间均为秒级时间戳
+CRAWL_SCHEDULE_TABLE = '''
+CREATE TABLE IF NOT EXISTS crawl_schedule (
+    category TEXT PRIMARY KEY,
+    arrival_rate REAL,
+    rate_samples INTEGER DEFAULT 0,
+    last_new_items INTEGER,
+    last_round_at REAL,
+    next_round_at REAL,
+    planned_interval REAL,
+    planned_pages INTEGER,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+# 重新上架记录表：合并到在售商品的每个商品ID及其上架时间
+RELISTS_TABLE = f'''
+CREATE TABLE IF NOT EXISTS {{name}} (
+    item_id INTEGER PRIMARY KEY,
+    canonical_id INTEGER NOT NULL,
+    listed_ms INTEGER DEFAULT ({NOW_MS_SQL}),
+    listed_at TIMESTAMP GENERATED ALWAYS AS (datetime(listed_ms / 1000, 'unixepoch')) VIRTUAL
+)
+'''
+
+TABLES = (
+    BRANDS_TABLE,
+    SKUS_TABLE.format(name='skus'),
+    C2C_ITEMS_TABLE.format(name='c2c_items'),
+    SELLERS_TABLE,
+    SELLER_NAME_HISTORY_TABLE,
+    BLACKLIST_TABLE,
+    LISTING_EVENTS_TABLE,
+    LISTING_EVENT_DAILY_TABLE,
+    CRAWL_STATE_TABLE,
+    CRAWL_SCHEDULE_TABLE,
+    RELISTS_TABLE.format(name='c2c_item_relists'),
+    # 商品归档表：已售出、已下架一段时间的商品由状态爬虫从 c2c_items 移到这里
+    C2C_ITEMS_TABLE.format(name='c2c_items_archive'),
+)
+
+# 旧数据库中由各程序启动时逐个添加的字段，新建的表已包含这些字段
+LEGACY_COLUMNS = (
+    ('c2c_items', 'publish_status INTEGER DEFAULT 1'),
+    ('c2c_items', 'is_blacklisted INTEGER DEFAULT 0'),
+    ('c2c_items', 'last_seen_in_list TIMESTAMP'),
+    ('c2c_items', 'relist_count INTEGER DEFAULT 0'),
+    ('c2c_items', 'latest_item_id INTEGER'),
+    ('c2c_items', 'last_listed_at TIMESTAMP'),
+    ('c2c_items', 'next_check_at TIMESTAMP'),
+    ('c2c_items', 'check_count INTEGER DEFAULT 0'),
+    ('c2c_items', 'unchanged_streak INTEGER DEFAULT 0'),
+    ('c2c_items_archive', 'next_check_at TIMESTAMP'),
+    ('c2c_items_archive', 'check_count INTEGER DEFAULT 0'),
+    ('c2c_items_archive', 'unchanged_streak INTEGER DEFAULT 0'),
+    ('crawl_state', 'yield_rate REAL'),
+)
+
+# 历史视图的字段：在售表和归档表共有的字段
+HISTORY_COLUMNS = (
+    'id, type, name, brand_id, sku_id, items_id, total_items_count, price_cents, price, '
+    'show_price, show_market_price, uid, payment_time, is_my_publish, publish_status, is_blacklisted, '
+    'created_ms, created_at, last_check_ms, last_check_time, last_seen_in_list, '
+    'relist_count, latest_item_id, last_listed_at'
+)
+
+VIEWS = ('c2c_item_details', 'c2c_item_listings', 'c2c_items_history')
+
+VIEWS_SQL = (
+    # 兼容视图：商品记录加上卖家的最新资料，字段与迁移前的 c2c_items 一致
+    '''
+    CREATE VIEW IF NOT EXISTS c2c_item_details AS
+    SELECT c.*, s.uname, s.uface, s.uspace_jump_url
+    FROM c2c_items c
+    LEFT JOIN sellers s ON s.uid = c.uid
+    ''',
+    # 每次上架一行：商品记录加上合并的重新上架记录，用于统计上架次数
+    '''
+    CREATE VIEW IF NOT EXISTS c2c_item_listings AS
+    SELECT c.id, c.uid, s.uname, c.sku_id, c.price, c.created_ms, c.created_at
+    FROM c2c_items c
+    LEFT JOIN sellers s ON s.uid = c.uid
+    UNION ALL
+    SELECT r.item_id, c.uid, s.uname, c.sku_id, c.price, r.listed_ms, r.listed_at
+    FROM c2c_item_relists r
+    JOIN c2c_items c ON c.id = r.canonical_id
+    LEFT JOIN sellers s ON s.uid = c.uid
+    ''',
+    # 历史视图：在售表加上归档表，用于查询全部历史商品
+    f'''
+    CREATE VIEW IF NOT EXISTS c2c_items_history AS
+    SELECT {HISTORY_COLUMNS} FROM c2c_items
+    UNION ALL
+    SELECT {HISTORY_COLUMNS} FROM c2c_items_archive
+    ''',
+)
+
+BRANDS = (
+    ('TAITO', 'TAITO|タイトー|太东'),
+    ('SEGA', 'SEGA|世嘉|セガ'),
+    ('BANPRESTO', 'BANPRESTO|万代南梦宫|バンプレスト'),
+    ('FURYU', 'FURYU|フリュー|福龙'),
+    ('BANDAI', 'BANDAI|万代|バンダイ'),
+    ('GOODSMILE', 'GOODSMILE|GSC|굿스마일|グッドスマイル'),
+    ('ALTER', 'ALTER|阿尔塔|アルター'),
+    ('KOTOBUKIYA', 'KOTOBUKIYA|寿屋|コトブキヤ'),
+    ('ANIPLEX', 'ANIPLEX|アニプレックス'),
+    ('HOBBY STOCK', 'HOBBY STOCK|ホビーストック'),
+    ('KADOKAWA', 'KADOKAWA|角川|カドカワ'),
+    ('WAVE', 'WAVE|ウェーブ'),
+    ('BROCCOLI', 'BROCCOLI|ブロッコリー'),
+    ('AQUAMARINE', 'AQUAMARINE|アクアマリン'),
+    ('MEDICOS', 'MEDICOS|メディコス'),
+    ('MEGAHOUSE', 'MEGAHOUSE|メガハウス'),
+    ('ORANGE ROUGE', 'ORANGE ROUGE|オランジュ・ルージュ'),
+    ('STRONGER', 'STRONGER|ストロンガー'),
+)
+
+# 初始品牌数据，已存在的品牌不覆盖
+BRANDS_SQL = tuple(
+    f"INSERT OR IGNORE INTO brands (name, keywords) VALUES ('{name}', '{keywords}')"
+    for name, keywords in BRANDS
+)
+
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_id ON c2c_items(id)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_sku_id ON c2c_items(sku_id)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_items_id ON c2c_items(items_id)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_brand_id ON c2c_items(brand_id)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_uid ON c2c_items(uid)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_created_at ON c2c_items(created_ms)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_last_check_time ON c2c_items(last_check_ms)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_publish_status ON c2c_items(publish_status)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_uid_sku ON c2c_items(uid, sku_id, price_cents)',
+    # 到期检查索引：按状态和下次检查时间取出到期商品
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_next_check ON c2c_items(publish_status, next_check_at)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_item_relists_canonical ON c2c_item_relists(canonical_id, listed_ms)',
+    'CREATE INDEX IF NOT EXISTS idx_seller_name_history_uid ON seller_name_history(uid)',
+    'CREATE INDEX IF NOT EXISTS idx_listing_events_time ON listing_events(event_time)',
+    'CREATE INDEX IF NOT EXISTS idx_listing_events_status_time ON listing_events(new_status, event_time)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_archive_uid ON c2c_items_archive(uid)',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_archive_sku_id ON c2c_items_archive(sku_id)',
+)
+
+# 不论数据如何都不需要的索引（见 scripts/index_advisor.py 的报告）：idx_c2c_items_id 与 INTEGER PRIMARY KEY 重复，
+# items_id 没有查询使用，idx_c2c_items_uid 是 idx_c2c_items_uid_sku 的前缀。每个索引都会拖慢写入
+REDUNDANT_INDEXES = (
+    'DROP INDEX IF EXISTS idx_c2c_items_id',
+    'DROP INDEX IF EXISTS idx_c2c_items_items_id',
+    'DROP INDEX IF EXISTS idx_c2c_items_uid',
+)
+
+# 品牌重新匹配任务（scripts/update_brands.py）的进度：每个表已处理到的商品ID和当时品牌规则的校验和
+BRAND_TAGGING_STATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS brand_tagging_state (
+    table_name TEXT PRIMARY KEY,
+    high_water_id INTEGER,
+    rules_checksum TEXT,
+    updated_ms INTEGER
+)
+'''
+
+# 爬虫心跳：各组件最近一次成功工作的时间（spider/heartbeat.py）
+SPIDER_HEARTBEATS_TABLE = '''
+CREATE TABLE IF NOT EXISTS spider_heartbeats (
+    component TEXT PRIMARY KEY,
+    last_success_ms INTEGER NOT NULL,
+    detail TEXT,
+    updated_ms INTEGER NOT NULL
+)
+'''
+
+# 在售商品被删除（清理超额记录、API 删除、归档）时删除合并到它的重新上架记录，
+# 否则这些商品ID再次出现时会指向不存在的商品而无法写入
+RELISTS_CLEANUP_TRIGGER = '''
+CREATE TRIGGER IF NOT EXISTS trg_c2c_items_delete_relists
+AFTER DELETE ON c2c_items
+BEGIN
+    DELETE FROM c2c_item_relists WHERE canonical_id = OLD.id;
+END
+'''
+
+# 触发器创建之前已删除的商品留下的重新上架记录
+ORPHAN_RELISTS_SQL = '''
+DELETE FROM c2c_item_relists
+WHERE canonical_id NOT IN (SELECT id FROM c2c_items)
+'''
+
+SCHEMA_VERSION_TABLE = '''
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    progress INTEGER DEFAULT 0,
+    started_ms INTEGER,
+    applied_ms INTEGER,
+    duration_ms INTEGER
+)
+'''
+
+
+def drop_views(cursor):
+    """删除视图；重建视图引用的表之前调用"""
+    for view in VIEWS:
+        cursor.execute(f'DROP VIEW IF EXISTS {view}')
+
+def create_views(cursor):
+    """创建视图（已存在时跳过）"""
+    for sql in VIEWS_SQL:
+        cursor.execute(sql)
+
+def create_tables(cursor):
+    """创建数据表（已存在时跳过）"""
+    for sql in TABLES:
+        cursor.execute(sql)
+
+def add_legacy_columns(conn):
+    """给旧数据库补上后来添加的字段"""
+    cursor = conn.cursor()
+    for table, column in LEGACY_COLUMNS:
+        try:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+        except sqlite3.OperationalError:
+            pass  # 字段已存在，忽略错误
+    cursor.execute("PRAGMA table_info(c2c_items_archive)")
+    if 'archived_ms' not in {column[1] for column in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE c2c_items_archive ADD COLUMN archived_ms INTEGER')
+    conn.commit()
+
+def get_db_stats(cursor):
+    """返回数据库已用大小(字节，不含空闲页)和 c2c_items 记录数"""
+    cursor.execute('PRAGMA page_size')
+    page_size = cursor.fetchone()[0]
+    cursor.execute('PRAGMA page_count')
+    page_count = cursor.fetchone()[0]
+    cursor.execute('PRAGMA freelist_count')
+    freelist_count = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM c2c_items')
+    return (page_count - freelist_count) * page_size, cursor.fetchone()[0]
+
+def archive_columns(cursor):
+    """c2c_items 和 c2c_items_archive 共有的可写字段（不含生成列和归档时间），用于两表之间移动商品"""
+    columns = []
+    for table in ('c2c_items', 'c2c_items_archive'):
+        cursor.execute(f"PRAGMA table_xinfo({table})")
+        columns.append({column[1] for column in cursor.fetchall() if not column[6]})
+    return ', '.join(sorted(columns[0] & columns[1]))
+
+def rebuild_table(cursor, table, create_sql, expressions=None, renamed=None, dropped=()):
+    """按新的表结构重建表并复制数据，需在事务中调用
+
+    create_sql 创建名为 <table>_new 的新表。新表的字段按 expressions（字段 -> 取值表达式）
+    从旧表取值，没有表达式的同名字段直接复制；dropped 中的旧字段丢弃，
+    其他程序添加的字段原样保留。原有索引按 renamed（旧字段 -> 新字段）换成新字段后重建。
+    """
+    expressions = expressions or {}
+    renamed = renamed or {}
+    cursor.execute(f"PRAGMA table_info({table})")
+    old_columns = cursor.fetchall()
+    old_names = {column[1] for column in old_columns}
+
+    # 记录手动创建的索引（不含主键和 UNIQUE 约束自动创建的索引）
+    indexes = []
+    cursor.execute(f"PRAGMA index_list({table})")
+    for _, index_name, unique, origin, _ in cursor.fetchall():
+        if origin != 'c':
+            continue
+        cursor.execute(f"PRAGMA index_info({index_name})")
+        index_columns = [renamed.get(row[2], row[2]) for row in cursor.fetchall()]
+        if None not in index_columns:
+            indexes.append((index_name, unique, index_columns))
+
+    cursor.execute(create_sql)
+    # table_xinfo 包含生成列，hidden 不为 0 的字段不能写入
+    cursor.execute(f"PRAGMA table_xinfo({table}_new)")
+    new_columns = {column[1]: column[6] for column in cursor.fetchall()}
+    for _, name, column_type, _, default, _ in old_columns:
+        if name in new_columns or name in renamed or name in dropped:
+            continue
+        definition = f"{name} {column_type}" + (f" DEFAULT {default}" if default is not None else "")
+        cursor.execute(f'ALTER TABLE {table}_new ADD COLUMN {definition}')
+        new_columns[name] = 0
+
+    copy_columns = {
+        name: expressions.get(name, name)
+        for name, hidden in new_columns.items()
+        if not hidden and (name in expressions or name in old_names)
+    }
+    cursor.execute(f'''
+        INSERT INTO {table}_new ({', '.join(copy_columns)})
+        SELECT {', '.join(copy_columns.values())}
+        FROM {table}
+    ''')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    for index_name, unique, index_columns in indexes:
+        cursor.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} "
+            f"ON {table}({', '.join(index_columns)})"
+        )
+
+def migrate_sellers(conn, vacuum=True):
+    """把 c2c_items 中每行重复的卖家资料迁移到 sellers 表
+
+    卖家的最新资料写入 sellers，每个昵称首次出现的时间写入 seller_name_history，
+    c2c_items 重建为只保留整数 uid（保留其他字段和索引）。已迁移的数据库直接返回。
+    迁移在一个事务中完成，之后执行 VACUUM 回收空间。
+    """
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("PRAGMA table_info(c2c_items)")
+        columns = cursor.fetchall()
+        if not any(column[1] in SELLER_PROFILE_COLUMNS for column in columns):
+            return
+        
+        print("迁移卖家资料到 sellers 表...")
+        start = time.time()
+        size_before, item_count = get_db_stats(cursor)
+        
+        cursor.execute('BEGIN')
+        
+        # 每个卖家取最近一条商品记录中的资料
+        cursor.execute('''
+            INSERT OR IGNORE INTO sellers (uid, uname, uface, uspace_jump_url, created_at, updated_at)
+            SELECT uid, uname, uface, uspace_jump_url, first_seen, created_at
+            FROM (
+                SELECT
+                    CAST(uid AS INTEGER) as uid, uname, uface, uspace_jump_url, created_at,
+                    MIN(created_at) OVER (PARTITION BY uid) as first_seen,
+                    ROW_NUMBER() OVER (PARTITION BY uid ORDER BY created_at DESC, id DESC) as row_number
+                FROM c2c_items
+                WHERE uid IS NOT NULL
+            )
+            WHERE row_number = 1
+        ''')
+        seller_count = cursor.rowcount
+        
+        # 每个昵称首次出现的时间
+        cursor.execute('''
+            INSERT INTO seller_name_history (uid, uname, changed_at)
+            SELECT CAST(uid AS INTEGER), uname, MIN(created_at)
+            FROM c2c_items
+            WHERE uid IS NOT NULL AND uname IS NOT NULL
+            GROUP BY uid, uname
+            ORDER BY MIN(created_at)
+        ''')
+        name_count = cursor.rowcount
+        
+        # 重建 c2c_items：去掉卖家资料字段，uid 转为整数；时间和价格字段保持原样，由 migrate_timestamps 迁移
+        drop_views(cursor)
+        rebuild_table(cursor, 'c2c_items', '''
+        CREATE TABLE c2c_items_new (
+            id INTEGER PRIMARY KEY,
+            type INTEGER,
+            name TEXT,
+            brand_id INTEGER,
+            sku_id INTEGER,
+            items_id INTEGER,
+            total_items_count INTEGER,
+            price REAL,
+            show_price TEXT,
+            show_market_price TEXT,
+            uid INTEGER,
+            payment_time INTEGER,
+            is_my_publish INTEGER,
+            publish_status INTEGER DEFAULT 1,
+            is_blacklisted INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_check_time TIMESTAMP,
+            last_seen_in_list TIMESTAMP,
+            relist_count INTEGER DEFAULT 0,
+            latest_item_id INTEGER,
+            last_listed_at TIMESTAMP,
+            FOREIGN KEY (brand_id) REFERENCES brands(id),
+            FOREIGN KEY (sku_id) REFERENCES skus(sku_id)
+        )
+        ''', expressions={'uid': 'CAST(uid AS INTEGER)'}, dropped=SELLER_PROFILE_COLUMNS)
+        conn.commit()
+        
+        if vacuum:
+            cursor.execute('VACUUM')
+        size_after, _ = get_db_stats(cursor)
+        print(f"已迁移 {item_count} 条商品记录，{seller_count} 个卖家，{name_count} 条昵称记录，"
+              f"耗时 {time.time() - start:.1f} 秒")
+        print(f"数据库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+
+    except Exception as e:
+        print(f"迁移卖家资料时出错: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def migrate_timestamps(conn, vacuum=True):
+    """把时间字段迁移为毫秒时间戳，价格字段迁移为整数分
+
+    c2c_items 的 created_at、last_check_time 改存 created_ms、last_check_ms，price 改存 price_cents，
+    skus 的 market_price 改存 market_price_cents，c2c_item_relists 的 listed_at 改存 listed_ms。
+    原字段保留为由新字段计算的虚拟生成列，读取结果不变；索引改建在整数字段上。
+    已迁移的表跳过，迁移在一个事务中完成，之后执行 VACUUM 回收空间。
+    """
+    cursor = conn.cursor()
+
+    try:
+        pending = {}
+        for table, column in (('c2c_items', 'created_ms'), ('skus', 'market_price_cents'),
+                              ('c2c_item_relists', 'listed_ms')):
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = {row[1] for row in cursor.fetchall()}
+            if columns and column not in columns:
+                pending[table] = columns
+        if not pending:
+            return
+        
+        print("迁移时间字段为毫秒时间戳、价格字段为整数分...")
+        start = time.time()
+        size_before, item_count = get_db_stats(cursor)
+        
+        # 重建被引用的 skus 表时不能检查外键；该设置在事务外才生效
+        cursor.execute('PRAGMA foreign_keys = OFF')
+        cursor.execute('BEGIN')
+        drop_views(cursor)
+        
+        def to_ms(column):
+            return f"CAST(strftime('%s', {column}) AS INTEGER) * 1000"
+        
+        if 'c2c_items' in pending:
+            expressions = {
+                'price_cents': 'CAST(ROUND(price * 100) AS INTEGER)',
+                'created_ms': to_ms('created_at'),
+            }
+            # 很旧的数据库可能还没有 last_check_time 字段
+            if 'last_check_time' in pending['c2c_items']:
+                expressions['last_check_ms'] = to_ms('last_check_time')
+            rebuild_table(
+                cursor, 'c2c_items', C2C_ITEMS_TABLE.format(name='c2c_items_new'), expressions,
+                renamed={'price': 'price_cents', 'created_at': 'created_ms', 'last_check_time': 'last_check_ms'}
+            )
+        if 'skus' in pending:
+            rebuild_table(
+                cursor, 'skus', SKUS_TABLE.format(name='skus_new'),
+                {'market_price_cents': 'CAST(ROUND(market_price * 100) AS INTEGER)'},
+                renamed={'market_price': 'market_price_cents'}
+            )
+        if 'c2c_item_relists' in pending:
+            rebuild_table(
+                cursor, 'c2c_item_relists', RELISTS_TABLE.format(name='c2c_item_relists_new'),
+                {'listed_ms': to_ms('listed_at')},
+                renamed={'listed_at': 'listed_ms'}
+            )
+        create_views(cursor)
+        conn.commit()
+        
+        if vacuum:
+            cursor.execute('VACUUM')
+        size_after, _ = get_db_stats(cursor)
+        print(f"已迁移 {', '.join(pending)}（{item_count} 条商品记录），耗时 {time.time() - start:.1f} 秒")
+        print(f"数据库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+
+    except Exception as e:
+        print(f"迁移时间和价格字段时出错: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def migrate_check_times(conn, vacuum=True):
+    """把调度和列表时间字段迁移为毫秒时间戳，状态变更事件的价格迁移为整数分
+
+    c2c_items 和 c2c_items_archive 的 next_check_at、last_seen_in_list、last_listed_at 改存
+    next_check_ms、last_seen_ms、last_listed_ms，listing_events 的 price 改存 price_cents；
+    原字段保留为虚拟生成列，读取结果不变。原来建在 next_check_at 上的到期检查索引删除，
+    由迁移 12 在 next_check_ms 上重建。已迁移的表跳过，迁移在一个事务中完成。
+    """
+    cursor = conn.cursor()
+
+    try:
+        pending = []
+        for table, column in (('c2c_items', 'next_check_ms'), ('c2c_items_archive', 'next_check_ms'),
+                              ('listing_events', 'price_cents')):
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = {row[1] for row in cursor.fetchall()}
+            if columns and column not in columns:
+                pending.append(table)
+        if not pending:
+            return
+        
+        print("迁移检查时间、列表出现时间为毫秒时间戳，事件价格为整数分...")
+        start = time.time()
+        size_before, item_count = get_db_stats(cursor)
+        
+        cursor.execute('BEGIN')
+        drop_views(cursor)
+        
+        def to_ms(column):
+            return f"CAST(strftime('%s', {column}) AS INTEGER) * 1000"
+        
+        for table in pending:
+            if table == 'listing_events':
+                rebuild_table(
+                    cursor, table, LISTING_EVENTS_CENTS_TABLE.format(name=f'{table}_new'),
+                    {'price_cents': 'CAST(ROUND(price * 100) AS INTEGER)'},
+                    renamed={'price': 'price_cents'}
+                )
+                continue
+            rebuild_table(
+                cursor, table, C2C_ITEMS_MS_TABLE.format(name=f'{table}_new'),
+                {
+                    'next_check_ms': to_ms('next_check_at'),
+                    'last_seen_ms': to_ms('last_seen_in_list'),
+                    'last_listed_ms': to_ms('last_listed_at'),
+                },
+                # 到期检查索引不随表重建（映射为 None），由迁移 12 重建
+                renamed={'next_check_at': None, 'last_seen_in_list': 'last_seen_ms', 'last_listed_at': 'last_listed_ms'}
+            )
+        # 重建表时删除了表上的触发器
+        cursor.execute(RELISTS_CLEANUP_TRIGGER)
+        create_views(cursor)
+        conn.commit()
+        
+        if vacuum:
+            cursor.execute('VACUUM')
+        size_after, _ = get_db_stats(cursor)
+        print(f"已迁移 {', '.join(pending)}（{item_count} 条商品记录），耗时 {time.time() - start:.1f} 秒")
+        print(f"数据库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+
+    except Exception as e:
+        print(f"迁移检查时间和事件价格字段时出错: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# 到期检查索引改建在整数时间戳上。新数据库中迁移 6（在线迁移，在离线迁移之后执行）
+# 会在虚拟生成列 next_check_at 上建同名索引，这里一并删除
+CHECK_TIME_INDEXES = (
+    'DROP INDEX IF EXISTS idx_c2c_items_next_check',
+    'CREATE INDEX IF NOT EXISTS idx_c2c_items_next_check_ms ON c2c_items(publish_status, next_check_ms)',
+)
+
+
+def apply_dependencies(func, seen=None):
+    """func（含其中的嵌套函数）引用的本模块常量和函数，函数再递归收集，返回 [(名称, 值)]"""
+    seen = set() if seen is None else seen
+    names = set()
+    codes = [func.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+    dependencies = []
+    for name in sorted(names - seen):
+        value = globals().get(name)
+        if isinstance(value, (str, tuple)):
+            seen.add(name)
+            dependencies.append((name, value))
+        elif inspect.isfunction(value) and value.__module__ == __name__:
+            seen.add(name)
+            dependencies.append((name, value))
+            dependencies.extend(apply_dependencies(value, seen))
+    return dependencies
+
+
+class Migration:
+    """一个迁移版本
+
+    离线迁移依次执行 statements（同一个事务）和 apply(conn)；在线迁移每步执行 statements 中的一条语句，
+    或者调用 apply(conn, progress) 处理一批数据并返回新的进度，处理完毕时返回 None。
+    校验和由 statements、apply 的源代码以及 apply 用到的本模块常量（建表语句、LEGACY_COLUMNS 等）
+    和函数计算，迁移执行后都不能再修改。
+    """
+    def __init__(self, version, name, statements=(), apply=None, online=False):
+        self.version = version
+        self.name = name
+        self.statements = tuple(statements)
+        self.apply = apply
+        self.online = online
+
+    @property
+    def checksum(self):
+        if not self.apply:
+            return self.legacy_checksum
+        digest = hashlib.sha256(self.legacy_checksum.encode('utf-8'))
+        for name, value in apply_dependencies(self.apply):
+            text = inspect.getsource(value) if inspect.isfunction(value) else repr(value)
+            digest.update(f"{name}={' '.join(text.split())}".encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @property
+    def legacy_checksum(self):
+        """只包含 statements 和 apply 源代码的校验和：早期版本按此记录，migrate 确认一致后更新为 checksum"""
+        digest = hashlib.sha256()
+        for statement in self.statements:
+            digest.update(' '.join(str(statement).split()).encode('utf-8'))
+        if self.apply:
+            digest.update(inspect.getsource(self.apply).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def step(self, conn, progress):
+        """在线迁移的一步，返回新的进度，全部完成时返回 None"""
+        if self.apply:
+            return self.apply(conn, progress)
+        if progress >= len(self.statements):
+            return None
+        conn.execute(self.statements[progress])
+        return progress + 1
+
+
+# 迁移版本，只能在末尾追加
+MIGRATIONS = (
+    Migration(1, 'base_tables', TABLES, apply=add_legacy_columns),
+    Migration(2, 'sellers', apply=migrate_sellers),
+    Migration(3, 'timestamps', apply=migrate_timestamps),
+    Migration(4, 'views', VIEWS_SQL),
+    Migration(5, 'brands', BRANDS_SQL),
+    Migration(6, 'indexes', INDEXES, online=True),
+    Migration(7, 'brand_tagging_state', (BRAND_TAGGING_STATE_TABLE,)),
+    Migration(8, 'drop_redundant_indexes', REDUNDANT_INDEXES, online=True),
+    Migration(9, 'spider_heartbeats', (SPIDER_HEARTBEATS_TABLE,)),
+    Migration(10, 'relists_cleanup', (RELISTS_CLEANUP_TRIGGER, ORPHAN_RELISTS_SQL)),
+    Migration(11, 'check_times_ms', apply=migrate_check_times),
+    Migration(12, 'check_time_indexes', CHECK_TIME_INDEXES, online=True),
+)
+
+
+def index_name(sql):
+    """CREATE INDEX IF NOT EXISTS <名称> ON ... 或 DROP INDEX IF EXISTS <名称> 中的索引名"""
+    words = sql.split()
+    return words[5] if words[0] == 'CREATE' else words[-1]
+
+# 已执行迁移 8、12 删除的索引，新数据库不再创建
+SUPERSEDED_INDEXES = {index_name(sql) for sql in REDUNDANT_INDEXES + CHECK_TIME_INDEXES if sql.startswith('DROP')}
+
+# 新数据库直接创建全部迁移执行完后的最终结构，不逐个执行迁移（迁移 1 建的 c2c_items 会被迁移 11 重建，
+# 迁移 6 建的部分索引会被迁移 8、12 删除）；迁移链只用于已有数据库。
+# 表结构的变化新增迁移版本时，同时修改这里
+SCHEMA = (
+    BRANDS_TABLE,
+    SKUS_TABLE.format(name='skus'),
+    C2C_ITEMS_MS_TABLE.format(name='c2c_items'),
+    SELLERS_TABLE,
+    SELLER_NAME_HISTORY_TABLE,
+    BLACKLIST_TABLE,
+    LISTING_EVENTS_CENTS_TABLE.format(name='listing_events'),
+    LISTING_EVENT_DAILY_TABLE,
+    CRAWL_STATE_TABLE,
+    CRAWL_SCHEDULE_TABLE,
+    RELISTS_TABLE.format(name='c2c_item_relists'),
+    C2C_ITEMS_MS_TABLE.format(name='c2c_items_archive'),
+    'ALTER TABLE c2c_items_archive ADD COLUMN archived_ms INTEGER',
+    BRAND_TAGGING_STATE_TABLE,
+    SPIDER_HEARTBEATS_TABLE,
+    RELISTS_CLEANUP_TRIGGER,
+) + VIEWS_SQL + BRANDS_SQL + tuple(
+    sql for sql in INDEXES + CHECK_TIME_INDEXES
+    if sql.startswith('CREATE') and index_name(sql) not in SUPERSEDED_INDEXES
+)
+
+
+class MigrationLock:
+    """跨进程的迁移锁（API、爬虫和 init_db.py 可能同时启动）"""
+    def __init__(self, path=DB_PATH):
+        self.path = path + '.migrate-lock'
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def schema_status(conn):
+    """检查已执行的迁移，返回尚未完成的离线迁移、在线迁移，以及按早期方式记录校验和的迁移
+
+    只读取 schema_version 表，耗时与数据量无关。已执行的迁移被修改（校验和不一致）
+    或数据库版本比代码新时抛出 RuntimeError。
+    """
+    try:
+        rows = conn.execute('SELECT version, name, checksum, applied_ms FROM schema_version').fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # 新数据库或引入版本管理之前的数据库
+    applied = {version: (name, checksum, applied_ms) for version, name, checksum, applied_ms in rows}
+    known = {migration.version: migration for migration in MIGRATIONS}
+
+    unknown = sorted(set(applied) - set(known))
+    if unknown:
+        raise RuntimeError(f"数据库的表结构版本 {unknown[-1]} 比当前代码新，请更新代码")
+    outdated = []
+    for version, (name, checksum, applied_ms) in applied.items():
+        if applied_ms is None or checksum == known[version].checksum:
+            continue
+        if checksum == known[version].legacy_checksum:
+            outdated.append(known[version])
+            continue
+        raise RuntimeError(
+            f"已执行的迁移 {version}_{name} 被修改（校验和 {checksum} -> {known[version].checksum}），"
+            f"表结构的变化请添加新的迁移版本"
+        )
+
+    pending = [migration for migration in MIGRATIONS if applied.get(migration.version, (None, None, None))[2] is None]
+    return [m for m in pending if not m.online], [m for m in pending if m.online], outdated
+
+def record(conn, migration, started_ms, progress=0, applied=True):
+    """记录迁移的执行进度，applied 为 True 时标记为已完成"""
+    now_ms = int(time.time() * 1000)
+    conn.execute('''
+        INSERT OR REPLACE INTO schema_version (version, name, checksum, progress, started_ms, applied_ms, duration_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (migration.version, migration.name, migration.checksum, progress, started_ms,
+          now_ms if applied else None, now_ms - started_ms if applied else None))
+
+def apply_offline(conn, migration):
+    """执行一个离线迁移：statements 在同一个事务中执行，apply 自行管理事务"""
+    started_ms = int(time.time() * 1000)
+    print(f"执行迁移 {migration.version}_{migration.name}...")
+    if migration.statements:
+        conn.execute('BEGIN')
+        for statement in migration.statements:
+            conn.execute(statement)
+        conn.commit()
+    if migration.apply:
+        migration.apply(conn)
+    record(conn, migration, started_ms)
+    conn.commit()
+
+def is_new_database(conn):
+    """数据库中还没有任何表（新建的数据库）"""
+    return conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name != 'schema_version'"
+    ).fetchone()[0] == 0
+
+def create_schema(conn):
+    """新数据库：在一个事务中创建最终结构（SCHEMA），并把全部迁移记为已执行"""
+    started_ms = int(time.time() * 1000)
+    print("新数据库，直接创建最新的表结构...")
+    conn.execute('BEGIN')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    for migration in MIGRATIONS:
+        record(conn, migration, started_ms)
+    conn.commit()
+
+def run_online(conn, pending):
+    """分步执行在线迁移，每步一个短事务并记录进度，中断后从记录的进度继续"""
+    for migration in pending:
+        row = conn.execute(
+            'SELECT progress, started_ms FROM schema_version WHERE version = ?', (migration.version,)
+        ).fetchone()
+        progress, started_ms = row if row else (0, int(time.time() * 1000))
+        print(f"{'继续' if row else '开始'}在线迁移 {migration.version}_{migration.name}...")
+        while True:
+            # 每步单独提交，步与步之间其他程序可以读写
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                next_progress = migration.step(conn, progress)
+                record(conn, migration, started_ms, progress if next_progress is None else next_progress,
+                       applied=next_progress is None)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if next_progress is None:
+                break
+            progress = next_progress
+        print(f"在线迁移 {migration.version}_{migration.name} 完成，"
+              f"耗时 {(time.time() * 1000 - started_ms) / 1000:.1f} 秒")
+
+def migrate(path=DB_PATH):
+    """执行尚未执行的迁移，数据库已是最新时只读取 schema_version
+
+    离线迁移执行完后分步执行在线迁移。多个程序同时启动时由迁移锁保证只有一个程序执行迁移，
+    其他程序等待其完成。
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        offline, online, outdated = schema_status(conn)
+        if not offline and not online and not outdated:
+            return
+        
+        with MigrationLock(path):
+            # 等锁期间其他程序可能已执行完
+            offline, online, outdated = schema_status(conn)
+            for migration in outdated:
+                # 早期版本的校验和不含 apply 用到的常量，确认一致后改记新的校验和
+                conn.execute('UPDATE schema_version SET checksum = ? WHERE version = ?',
+                             (migration.checksum, migration.version))
+            conn.commit()
+            if offline:
+                conn.execute('PRAGMA journal_mode = WAL')
+                conn.execute(SCHEMA_VERSION_TABLE)
+                if len(offline) + len(online) == len(MIGRATIONS) and is_new_database(conn):
+                    create_schema(conn)
+                    return
+                for migration in offline:
+                    apply_offline(conn, migration)
+            run_online(conn, online)
+    finally:
+        conn.close()
@@ -0,0 +1,550 @@
+"""API 和爬虫共用的查询
+
+scripts/index_advisor.py 分析的查询都定义在这里，API、爬虫和索引分析使用同一份 SQL，
+修改查询后索引分析随之更新，不需要再同步副本。
+
+参数统一使用命名参数（:uid、:since 等），执行时传入 dict。随请求变化的片段（过滤条件、
+排序、表名、IN 列表）用 str.format 的 {字段} 填入，IN 列表的命名参数由 in_params() 生成。
+"""
+
+
+def in_params(name, values):
+    """IN 列表的命名参数：返回 (':name_0, :name_1, ...', {'name_0': 值, ...})"""
+    names = [f'{name}_{index}' for index in range(len(values))]
+    return ', '.join(f':{key}' for key in names), dict(zip(names, values))
+
+
+# ---- API ----
+
+BRANDS = '''
+SELECT
+    b.id,
+    b.name,
+    COUNT(DISTINCT s.sku_id) as total_items
+FROM brands b
+LEFT JOIN c2c_items_history c ON b.id = c.brand_id
+LEFT JOIN skus s ON s.sku_id = c.sku_id
+GROUP BY b.id, b.name
+ORDER BY total_items DESC
+'''
+
+# {brand_filter}: 空，或 'AND i.brand_id = :brand_id'；{order}: 排序条件
+SKUS = '''
+WITH filtered_items AS (
+    SELECT
+        i.sku_id,
+        i.price,
+        i.id
+    FROM c2c_items i
+    WHERE 1=1
+    {brand_filter}
+),
+sku_stats AS (
+    SELECT
+        s.sku_id,
+        s.name,
+        s.img,
+        s.market_price,
+        MIN(fi.price) as min_price,
+        MAX(fi.price) as max_price,
+        COUNT(fi.id) as total_items,
+        MAX(fi.id) as latest_id
+    FROM skus s
+    JOIN filtered_items fi ON fi.sku_id = s.sku_id
+    WHERE 1=1
+    AND (:search IS NULL OR s.name LIKE :search)
+    GROUP BY s.sku_id, s.name, s.img, s.market_price
+)
+SELECT
+    sku_id,
+    name,
+    img,
+    market_price,
+    min_price,
+    max_price,
+    total_items
+FROM sku_stats
+WHERE total_items > 0
+ORDER BY {order}
+LIMIT :limit OFFSET :offset
+'''
+
+SKU_ITEMS = '''
+SELECT
+    i.id as c2c_items_id,
+    i.uname as seller_name,
+    CAST(i.uid AS TEXT) as seller_uid,
+    i.uface as seller_avatar,
+    i.uspace_jump_url as seller_url,
+    i.price,
+    s.market_price,
+    i.publish_status,
+    i.created_at,
+    i.is_blacklisted,
+    COALESCE(i.relist_count, 0) as relist_count,
+    COALESCE(i.latest_item_id, i.id) as listing_id
+FROM c2c_item_details i
+JOIN skus s ON i.sku_id = s.sku_id
+WHERE i.sku_id = :sku_id
+ORDER BY i.price ASC
+'''
+
+# {status_condition}: 按新状态过滤事件的条件
+STATUS_CHANGES_COUNT = '''
+SELECT COUNT(DISTINCT e.item_id) as total
+FROM listing_events e
+JOIN c2c_items c ON c.id = e.item_id
+JOIN skus s ON c.sku_id = s.sku_id
+WHERE e.event_time >= :since_24h
+{status_condition}
+'''
+
+STATUS_CHANGES = '''
+WITH latest_events AS (
+    SELECT e.item_id, MAX(e.id) as event_id
+    FROM listing_events e
+    WHERE e.event_time >= :since_24h
+    {status_condition}
+    GROUP BY e.item_id
+)
+SELECT
+    c.id,
+    s.sku_id,
+    s.name,
+    s.img,
+    e.price,
+    e.new_status as publish_status,
+    datetime(e.event_time / 1000, 'unixepoch', '+8 hours') as last_check_time,
+    c.uname as seller_name,
+    CAST(c.uid AS TEXT) as seller_uid,
+    c.uspace_jump_url as seller_url
+FROM latest_events le
+JOIN listing_events e ON e.id = le.event_id
+JOIN c2c_item_details c ON c.id = e.item_id
+JOIN skus s ON c.sku_id = s.sku_id
+ORDER BY e.event_time DESC
+LIMIT :limit OFFSET :offset
+'''
+
+BLACKLIST = '''
+SELECT
+    b.*,
+    (
+        SELECT COUNT(DISTINCT c.id)
+        FROM c2c_items c
+        WHERE c.uid = b.uid
+    ) as total_items
+FROM blacklist b
+ORDER BY b.created_at DESC
+LIMIT :limit OFFSET :offset
+'''
+
+SUSPICIOUS_USERS = '''
+WITH single_sku_stats AS (
+    SELECT
+        c.uid,
+        c.uname,
+        c.sku_id,
+        COUNT(*) as listing_count,
+        MIN(c.created_at) as first_listing,
+        MAX(c.created_at) as last_listing
+    FROM c2c_item_listings c
+    WHERE c.created_ms >= :since_1h
+    GROUP BY c.uid, c.uname, c.sku_id
+    HAVING listing_count >= 20
+),
+multi_sku_stats AS (
+    SELECT
+        c.uid,
+        c.uname,
+        COUNT(DISTINCT c.sku_id) as sku_count,
+        MIN(c.created_at) as first_listing,
+        MAX(c.created_at) as last_listing
+    FROM c2c_item_listings c
+    WHERE c.created_ms >= :since_1h
+    GROUP BY c.uid, c.uname
+    HAVING sku_count >= 3
+    AND (
+        SELECT COUNT(*)
+        FROM c2c_item_listings c2
+        WHERE c2.uid = c.uid
+        AND c2.created_ms >= :since_1h
+    ) >= (sku_count * 10)
+)
+SELECT
+    CAST(us.uid AS TEXT) as uid,
+    us.uname,
+    us.sku_id,
+    s.name as sku_name,
+    us.listing_count,
+    us.first_listing,
+    us.last_listing,
+    (
+        SELECT COUNT(DISTINCT c2.sku_id)
+        FROM c2c_items c2
+        WHERE c2.uid = us.uid
+    ) as total_skus
+FROM single_sku_stats us
+JOIN skus s ON us.sku_id = s.sku_id
+WHERE NOT EXISTS (
+    SELECT 1 FROM blacklist b
+    WHERE b.uid = us.uid
+)
+UNION ALL
+SELECT
+    CAST(ms.uid AS TEXT) as uid,
+    ms.uname,
+    NULL as sku_id,
+    '多个商品' as sku_name,
+    (
+        SELECT COUNT(*)
+        FROM c2c_item_listings c2
+        WHERE c2.uid = ms.uid
+        AND c2.created_ms >= :since_1h
+    ) as listing_count,
+    ms.first_listing,
+    ms.last_listing,
+    ms.sku_count as total_skus
+FROM multi_sku_stats ms
+WHERE NOT EXISTS (
+    SELECT 1 FROM blacklist b
+    WHERE b.uid = ms.uid
+)
+ORDER BY listing_count DESC
+'''
+
+BLACKLIST_OFFLINE = '''
+UPDATE c2c_items
+SET publish_status = -1,
+    is_blacklisted = 1,
+    last_check_ms = :now_ms
+WHERE uid = :uid
+'''
+
+USER_STATS = '''
+WITH user_stats AS (
+    SELECT
+        c.uid,
+        COUNT(DISTINCT c.id) as listing_count,
+        COUNT(DISTINCT c.sku_id) as sku_count,
+        MIN(c.price) as min_price,
+        MAX(c.price) as max_price,
+        MIN(c.created_at) as first_listing,
+        MAX(c.created_at) as last_listing,
+        (
+            SELECT b.reason
+            FROM blacklist b
+            WHERE b.uid = c.uid
+            LIMIT 1
+        ) as blacklist_reason
+    FROM c2c_items c
+    WHERE c.created_ms >= :since
+    GROUP BY c.uid
+    ORDER BY listing_count DESC
+    LIMIT 50
+)
+SELECT
+    CAST(us.uid AS TEXT) as uid,
+    sl.uname,
+    us.listing_count,
+    us.sku_count,
+    us.min_price,
+    us.max_price,
+    us.first_listing,
+    us.last_listing,
+    us.blacklist_reason,
+    CASE
+        WHEN blacklist_reason IS NOT NULL THEN 1
+        ELSE 0
+    END as is_blacklisted
+FROM user_stats us
+LEFT JOIN sellers sl ON sl.uid = us.uid
+ORDER BY us.listing_count DESC
+'''
+
+USER_ITEMS = '''
+SELECT DISTINCT
+    s.sku_id,
+    s.name,
+    s.img,
+    s.market_price,
+    COUNT(DISTINCT c.id) as listing_count,
+    MIN(c.price) as min_price,
+    MAX(c.price) as max_price,
+    MIN(c.created_at) as first_listing,
+    MAX(c.created_at) as last_listing
+FROM c2c_items_history c
+JOIN skus s ON c.sku_id = s.sku_id
+WHERE c.uid = :uid
+GROUP BY s.sku_id, s.name, s.img, s.market_price
+ORDER BY last_listing DESC
+'''
+
+STATISTICS_NEW_ITEMS = '''
+SELECT COUNT(*) as count
+FROM c2c_items
+WHERE created_ms >= :since
+'''
+
+STATISTICS_NEW_SKUS = '''
+SELECT COUNT(DISTINCT sku_id) as count
+FROM c2c_items
+WHERE created_ms >= :since
+'''
+
+STATISTICS_SOLD = '''
+SELECT COUNT(DISTINCT item_id) as count
+FROM listing_events
+WHERE new_status = -2
+AND event_time >= :since
+'''
+
+STATISTICS_ACTIVE = '''
+WITH active AS (
+    SELECT
+        uid,
+        COUNT(*) as listing_count,
+        COUNT(DISTINCT sku_id) as sku_count,
+        MIN(created_at) as first_listing,
+        MAX(created_at) as last_listing
+    FROM c2c_items
+    WHERE created_ms >= :since
+    GROUP BY uid
+    ORDER BY listing_count DESC
+    LIMIT 5
+)
+SELECT
+    CAST(a.uid AS TEXT) as uid,
+    sl.uname,
+    a.listing_count,
+    a.sku_count,
+    a.first_listing,
+    a.last_listing,
+    (
+        SELECT reason
+        FROM blacklist b
+        WHERE b.uid = a.uid
+        LIMIT 1
+    ) as blacklist_reason
+FROM active a
+LEFT JOIN sellers sl ON sl.uid = a.uid
+ORDER BY a.listing_count DESC
+'''
+
+# 按 created_ms 索引范围扫描，再按分钟分组
+STATISTICS_TREND = '''
+SELECT
+    created_ms / 60000 as minute,
+    COUNT(id) as items_count,
+    COUNT(DISTINCT sku_id) as skus_count,
+    COUNT(DISTINCT uid) as users_count
+FROM c2c_items
+WHERE created_ms >= :since_1h
+GROUP BY minute
+'''
+
+# {table}: c2c_items 或 c2c_items_archive
+DELETE_SKU_ITEMS = '''
+DELETE FROM {table}
+WHERE sku_id = :sku_id
+'''
+
+# ---- 列表爬虫 ----
+
+EXISTING_ITEM = '''
+SELECT
+    id, price_cents, show_price, show_market_price,
+    uid, total_items_count, payment_time, is_my_publish,
+    publish_status, is_blacklisted
+FROM c2c_items
+WHERE id = :item_id
+'''
+
+ARCHIVED_ITEM = '''
+SELECT 1 FROM c2c_items_archive WHERE id = :item_id
+'''
+
+SELLER_LISTINGS_1H = '''
+SELECT COUNT(*) as count
+FROM c2c_item_listings
+WHERE uid = :uid
+AND sku_id = :sku_id
+AND created_ms >= :since_1h
+'''
+
+IN_BLACKLIST = '''
+SELECT 1 FROM blacklist WHERE uid = :uid
+'''
+
+SELLER_PROFILE = '''
+SELECT uname, uface, uspace_jump_url FROM sellers WHERE uid = :uid
+'''
+
+RELIST_CANONICAL = '''
+SELECT r.canonical_id, c.publish_status
+FROM c2c_item_relists r
+LEFT JOIN c2c_items c ON c.id = r.canonical_id
+WHERE r.item_id = :item_id
+'''
+
+RELIST_MATCH = '''
+SELECT id
+FROM c2c_items
+WHERE uid = :uid AND sku_id = :sku_id AND price_cents = :price_cents AND publish_status = 1
+ORDER BY created_ms DESC
+LIMIT 1
+'''
+
+# {item_ids}: in_params() 生成的 IN 列表
+MARK_SEEN = '''
+UPDATE c2c_items
+SET last_seen_ms = :now_ms
+WHERE id IN ({item_ids})
+'''
+
+MARK_SEEN_RELISTS = '''
+UPDATE c2c_items
+SET last_seen_ms = :now_ms
+WHERE id IN (
+    SELECT canonical_id FROM c2c_item_relists
+    WHERE item_id IN ({item_ids})
+)
+'''
+
+BLACKLIST_USERS_24H = '''
+WITH user_stats AS (
+    SELECT
+        c.uid,
+        c.uname,
+        c.sku_id,
+        s.name as sku_name,
+        COUNT(*) as listing_count,
+        MIN(c.created_at) as first_listing,
+        MAX(c.created_at) as last_listing
+    FROM c2c_item_listings c
+    JOIN skus s ON c.sku_id = s.sku_id
+    WHERE c.created_ms >= :since_24h
+    GROUP BY c.uid, c.uname, c.sku_id
+    HAVING listing_count >= 20
+)
+SELECT us.*
+FROM user_stats us
+WHERE NOT EXISTS (
+    SELECT 1 FROM blacklist b
+    WHERE b.uid = us.uid
+)
+'''
+
+OFFLINE_USER_SKU = '''
+UPDATE c2c_items
+SET publish_status = -1,
+    is_blacklisted = 1,
+    last_check_ms = :now_ms
+WHERE uid = :uid AND sku_id = :sku_id
+'''
+
+# 每个用户每个SKU按上架时间保留最新的 :max_listings 条
+EXCESS_LISTINGS = '''
+SELECT id, uid, uname, sku_id
+FROM (
+    SELECT
+        id, uid, uname, sku_id,
+        ROW_NUMBER() OVER (
+            PARTITION BY uid, sku_id
+            ORDER BY created_ms DESC, id DESC
+        ) as row_number
+    FROM c2c_item_details
+    WHERE publish_status = 1
+)
+WHERE row_number > :max_listings
+'''
+
+# ---- 状态爬虫 ----
+
+# {item_ids}: in_params() 生成的 IN 列表
+CHECK_INTERVAL_FACTORS = '''
+WITH batch AS (
+    SELECT id, sku_id FROM c2c_items WHERE id IN ({item_ids})
+),
+ranked AS (
+    SELECT id, RANK() OVER (PARTITION BY sku_id ORDER BY price_cents) as price_rank
+    FROM c2c_items
+    WHERE publish_status = 1
+      AND price_cents IS NOT NULL
+      AND sku_id IN (SELECT sku_id FROM batch)
+)
+SELECT
+    i.id,
+    i.price,
+    s.market_price,
+    COALESCE(r.price_rank, 1) as price_rank,
+    (:now_ms - i.created_ms) / 3600000.0 as age_hours,
+    COALESCE(i.unchanged_streak, 0) as unchanged_streak
+FROM batch b
+JOIN c2c_items i ON i.id = b.id
+LEFT JOIN ranked r ON r.id = i.id
+LEFT JOIN skus s ON s.sku_id = i.sku_id
+'''
+
+UNSCHEDULED_ITEMS = '''
+SELECT id
+FROM c2c_items
+WHERE publish_status = 1 AND next_check_ms IS NULL
+LIMIT :limit
+'''
+
+# :seen_since 之后出现在列表中、且晚于上次检查的商品视为已检查
+DUE_ITEMS = '''
+SELECT
+    id, sku_id, price, last_check_time,
+    last_seen_ms > COALESCE(last_check_ms, 0)
+        AND last_seen_ms >= :seen_since as recently_seen,
+    COALESCE(latest_item_id, id) as listing_id
+FROM c2c_items
+WHERE publish_status = 1
+  AND next_check_ms <= :now_ms
+ORDER BY next_check_ms ASC
+LIMIT :limit
+'''
+
+SUSPICIOUS_USERS_1H = '''
+WITH user_stats AS (
+    SELECT
+        c.uid,
+        c.uname,
+        c.sku_id,
+        COUNT(*) as listing_count,
+        MIN(c.created_at) as first_listing,
+        MAX(c.created_at) as last_listing
+    FROM c2c_item_listings c
+    WHERE c.created_ms >= :since_1h
+    GROUP BY c.uid, c.uname, c.sku_id
+    HAVING listing_count >= :threshold
+)
+SELECT
+    us.*,
+    s.name as sku_name
+FROM user_stats us
+JOIN skus s ON us.sku_id = s.sku_id
+WHERE NOT EXISTS (
+    SELECT 1 FROM blacklist b
+    WHERE b.uid = us.uid
+)
+'''
+
+# 一批待压缩事件的最大ID
+COMPACT_EVENTS_BATCH = '''
+SELECT MAX(id) FROM (
+    SELECT id FROM listing_events
+    WHERE event_time < :compact_cutoff
+    ORDER BY event_time
+    LIMIT :limit
+)
+'''
+
+SETTLED_ITEMS = '''
+SELECT id FROM c2c_items
+WHERE publish_status IN (-1, -2)
+  AND COALESCE(last_check_ms, created_ms) < :archive_cutoff
+LIMIT :limit
+'''
@@ -0,0 +1,220 @@
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+
+
+class ReplayFinished(BaseException):
+    """回放数据已用完
+
+    继承 BaseException，避免被爬虫中捕获 Exception 的重试逻辑当作普通请求错误。
+    """
+
+
+def request_key(method, url, body):
+    """请求的匹配键：方法、路径和查询参数、请求体"""
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    return f"{method} {path} {json.dumps(body, sort_keys=True, ensure_ascii=False) if body is not None else ''}"
+
+
+def endpoint_name(url):
+    """接口名：URL 路径的最后一段，如 list、queryC2cItemsDetail"""
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+
+class TrafficRecorder:
+    """把请求和响应写入 gzip 压缩的分段文件（只追加）
+
+    每个进程写自己的分段文件，文件名为 traffic-<开始毫秒>-<进程号>-<序号>.jsonl.gz，
+    每行一条记录，写入后立即 flush，进程异常退出时已写入的记录仍然可读。
+    不记录请求头，避免 Cookie 落盘。
+    """
+    def __init__(self, directory, segment_records=1000):
+        self.directory = directory
+        self.segment_records = segment_records  # 每个分段文件的记录数
+        self.lock = threading.Lock()
+        self.started_ms = int(time.time() * 1000)
+        self.segment_index = 0
+        self.segment_count = 0
+        self.file = None
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def open_segment(self):
+        """关闭当前分段，打开下一个分段文件"""
+        if self.file:
+            self.file.close()
+        self.segment_index += 1
+        self.segment_count = 0
+        path = os.path.join(
+            self.directory,
+            f"traffic-{self.started_ms}-{os.getpid()}-{self.segment_index:05d}.jsonl.gz"
+        )
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+
+    def record(self, method, url, body, started_at, response=None, error=None):
+        """记录一次请求；response 为 requests 的响应，请求异常时传入 error"""
+        record = {
+            't': started_at,
+            'elapsed': time.time() - started_at,
+            'endpoint': endpoint_name(url),
+            'method': method,
+            'url': url,
+            'body': body,
+        }
+        if response is not None:
+            record['status_code'] = response.status_code
+            record['response'] = response.text
+        else:
+            record['error'] = str(error)
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+
+        with self.lock:
+            if self.file is None or self.segment_count >= self.segment_records:
+                self.open_segment()
+            self.file.write(line)
+            self.file.flush()
+            self.segment_count += 1
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class LiveSession:
+    """请求线上接口，提供 recorder 时同时录制请求和响应"""
+    finished = False  # 与 ReplaySession 一致，线上请求永远不会结束
+
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        return self.request('POST', url, headers=headers, json=json, timeout=timeout)
+
+    def get(self, url, headers=None, timeout=None):
+        return self.request('GET', url, headers=headers, timeout=timeout)
+
+    def request(self, method, url, headers=None, json=None, timeout=None):
+        started_at = time.time()
+        try:
+            response = requests.request(method, url, headers=headers, json=json, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            if self.recorder:
+                self.recorder.record(method, url, json, started_at, error=e)
+            raise
+        if self.recorder:
+            self.recorder.record(method, url, json, started_at, response=response)
+        return response
+
+    def close(self):
+        if self.recorder:
+            print(f"已录制 {self.recorder.records} 条请求到 {self.recorder.directory}")
+            self.recorder.close()
+
+
+class ReplayResponse:
+    """回放的响应，提供爬虫用到的 requests.Response 属性"""
+    def __init__(self, record, headers):
+        self.status_code = record['status_code']
+        self.text = record['response']
+        self.url = record['url']
+        self.request = requests.Request(record['method'], record['url'], headers=headers or {})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplaySession:
+    """从录制目录回放响应，不访问网络
+
+    优先返回与请求完全相同（方法、路径、请求体）的下一条记录，没有时按录制顺序返回同一接口的下一条记录。
+    speed 为 1 时按录制时的时间间隔回放，2 为两倍速，0 为尽可能快。
+    某个接口的记录用完后抛出 ReplayFinished。
+    """
+    def __init__(self, directory, speed=1.0):
+        self.directory = directory
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.records = self.load_records(directory)
+        self.by_endpoint = {}  # 接口名 -> 按录制顺序的记录
+        self.by_key = {}  # 请求匹配键 -> 按录制顺序的记录
+        for record in self.records:
+            record['consumed'] = False
+            self.by_endpoint.setdefault(record['endpoint'], deque()).append(record)
+            self.by_key.setdefault(request_key(record['method'], record['url'], record['body']), deque()).append(record)
+        self.first_time = self.records[0]['t'] if self.records else 0
+        self.started_at = None
+        self.finished = False  # 爬虫请求的接口已没有记录
+        self.served = 0
+        self.mismatched = 0  # 没有完全相同的请求，按顺序返回的次数
+        print(f"从 {directory} 读取了 {len(self.records)} 条录制记录")
+
+    @staticmethod
+    def load_records(directory):
+        """读取目录下所有分段文件，按录制时间排序；忽略异常退出时未写完的最后一行"""
+        records = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.jsonl.gz'):
+                continue
+            try:
+                with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as f:
+                    for line in f:
+                        records.append(json.loads(line))
+            except (EOFError, OSError, json.JSONDecodeError) as e:
+                print(f"分段文件 {name} 不完整，已读取到出错位置: {e}")
+        records.sort(key=lambda record: record['t'])
+        return records
+
+    def next_record(self, method, url, body):
+        """取出与请求匹配的下一条记录"""
+        with self.lock:
+            for candidates in (
+                self.by_key.get(request_key(method, url, body)),
+                self.by_endpoint.get(endpoint_name(url)),
+            ):
+                while candidates and candidates[0]['consumed']:
+                    candidates.popleft()
+                if candidates:
+                    record = candidates.popleft()
+                    record['consumed'] = True
+                    if request_key(method, url, body) != request_key(record['method'], record['url'], record['body']):
+                        self.mismatched += 1
+                    self.served += 1
+                    if self.started_at is None:
+                        self.started_at = time.time()
+                    return record
+            self.finished = True
+        raise ReplayFinished(f"接口 {endpoint_name(url)} 的录制记录已用完")
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        return self.request('POST', url, headers=headers, json=json, timeout=timeout)
+
+    def get(self, url, headers=None, timeout=None):
+        return self.request('GET', url, headers=headers, timeout=timeout)
+
+    def request(self, method, url, headers=None, json=None, timeout=None):
+        record = self.next_record(method, url, json)
+        if self.speed:
+            # 按录制时的相对时间回放（含接口耗时）
+            due = self.started_at + (record['t'] + record['elapsed'] - self.first_time) / self.speed
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        if 'error' in record:
+            raise requests.exceptions.ConnectionError(record['error'])
+        return ReplayResponse(record, headers)
+
+    def close(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        rate = self.served / elapsed if elapsed > 0 else 0
+        print(f"回放了 {self.served}/{len(self.records)} 条记录，其中 {self.mismatched} 条按顺序匹配，"
+              f"耗时 {elapsed:.1f} 秒（{rate:.1f} 条/秒）")
@@ -2,17 +2,23 @@ import requests
 import json
 import sqlite3
 import time
-import random
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from spider.credentials import CredentialPool
+from spider.db_writer import connect, open_writer
+from spider import heartbeat, log, metrics, migrations, queries
+from spider.recorder import LiveSession, ReplaySession, TrafficRecorder, ReplayFinished
+
+logger = log.get_logger('status_spider')
 
 class BiliMallStatusSpider:
-    def __init__(self, cookie=None):
+    def __init__(self, cookie=None, credentials=None, writer_socket=None):
         self.min_sleep = 0.2  # 最小休眠时间(秒)
         self.max_sleep = 0.5  # 最大休眠时间(秒)
         self.error_sleep = 30  # 错误重试休眠时间(秒)
         self.fatal_sleep = 60  # 严重错误休眠时间(秒)
-        self.round_sleep = 120  # 每轮结束后的休眠时间(秒)，默认30分钟
+        self.round_sleep = 120  # 统计输出及可疑用户检查的间隔(秒)
         self.max_retry_sleep = 120  # 最大重试休眠时间(秒)，默认2小时
         self.retry_multiplier = 2  # 重试时间翻倍系数
         self.url = 'https://mall.bilibili.com/mall-magic-c/internet/c2c/items/queryC2cItemsDetail'
@@ -24,185 +30,351 @@ class BiliMallStatusSpider:
             'referer': 'https://mall.bilibili.com/neul-next/index.html?page=magic-market_detail',
             'user-agent': 'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Mobile Safari/537.36'
         }
-        if cookie:
-            self.headers['cookie'] = cookie
+        # Cookie 池：每个 Cookie 独立限速，请求分散到健康的 Cookie 上
+        self.credentials = credentials or CredentialPool([cookie])
+        self.session = LiveSession()  # HTTP 会话，可替换为录制或回放会话
         self.init_db()
+        # 写入通过写服务（配置了 socket 时）或本进程的写线程提交，本连接只用于读取
+        self.writer = open_writer(writer_socket)
+        self.pending_writes = []  # 本批已提交但尚未确认的写任务
         self.suspicious_threshold = 20  # 1小时内上架次数阈值
-        self.batch_size = 20  # 每批处理的商品数量
+        self.batch_size = 20  # 每个可用 Cookie 每批处理的商品数量
         self.batch_sleep = 3  # 每批处理后的休眠时间(秒)
+        self.idle_sleep = 10  # 没有到期商品时的休眠时间(秒)
+        self.base_check_interval = 1800  # 基础检查间隔(秒)
+        self.min_check_interval = 60  # 最短检查间隔(秒)
+        self.max_check_interval = 86400  # 最长检查间隔(秒)
+        self.new_items_batch = 500  # 每次纳入调度的新商品数量
+        self.event_retention_days = 30  # 状态变更事件保留天数
+        self.event_compact_batch = 5000  # 每批压缩的事件数量
+        self.archive_after_days = 7  # 已售出/已下架超过此天数的商品移到归档表
+        self.archive_batch = 5000  # 每批归档的商品数量
+        self.sighting_window = 600  # 列表爬虫在此时间(秒)内见过的商品视为已检查
+        self.backlog_interval = 30  # 统计到期商品积压数的间隔(秒)
+        self.backlog_cap = 100000  # 积压数最多统计到此数量，避免积压严重时计数本身变慢
+        self.backlog_checked_at = 0
+        self.metrics = metrics.spider_metrics('bmall_status_spider')
+        self.metrics.gauge('status_backlog', f'已到期尚未检查的在售商品数（每 {self.backlog_interval} 秒统计，最多统计到上限）')
+        self.metrics.gauge('healthy_credentials', '当前未停用的 Cookie 数量')
+        self.metrics.gauge_function('healthy_credentials', lambda: self.credentials.healthy_count())
 
     def init_db(self):
         """初始化数据库连接"""
-        self.conn = sqlite3.connect('./db/bilibili_mall.db')
+        self.conn = connect()
         self.cursor = self.conn.cursor()
         
-        # 添加 publish_status 字段（如果不存在）
-        try:
-            self.cursor.execute('''
-                ALTER TABLE c2c_items 
-                ADD COLUMN publish_status INTEGER DEFAULT 1
-            ''')
-            self.conn.commit()
-        except sqlite3.OperationalError:
-            pass  # 字段已存在，忽略错误
+        # 表结构由 spider/migrations.py 统一维护；数据库已是最新时只读取 schema_version
+        migrations.migrate()
+        # 归档时复制的字段，表结构在运行期间不变，只读取一次
+        self.archive_columns = migrations.archive_columns(self.cursor)
 
     def fetch_item_status(self, item_id):
-        """获取商品状态"""
+        """获取商品状态（可在多个线程中并发调用，不访问数据库）"""
         try:
             url = f"{self.url}?c2cItemsId={item_id}"
             
-            delay = random.uniform(self.min_sleep, self.max_sleep)
-            time.sleep(delay)
+            # 等待某个健康的 Cookie 有可用令牌
+            credential = self.credentials.acquire()
             
-            response = requests.get(url, headers=self.headers, timeout=10)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=credential.apply_headers(self.headers), timeout=10)
+            finally:
+                self.metrics.observe('request_seconds', time.perf_counter() - start, endpoint='detail')
             
             # 处理HTTP错误
             if response.status_code != 200:
-                print(f"HTTP错误: {response.status_code}")
-                time.sleep(self.error_sleep)
+                self.metrics.inc('responses_total', endpoint='detail', status=response.status_code, code='')
+                logger.warning('detail_http_error', item_id=item_id, status=response.status_code, credential=credential.name)
+                self.credentials.report(credential, False)
+                self.wait_for_credentials()
                 return None
             
             data = response.json()
+            self.metrics.inc('responses_total', endpoint='detail', status=response.status_code, code=data['code'])
             
             # 处理API错误
             if data['code'] != 0:
-                print(f"API错误: {data.get('message', '未知错误')}")
-                time.sleep(self.error_sleep)
+                logger.warning('detail_api_error', item_id=item_id, code=data['code'],
+                               message=data.get('message', '未知错误'), credential=credential.name)
+                self.credentials.report(credential, False)
+                self.wait_for_credentials()
                 return None
             
+            self.credentials.report(credential, True)
+            
             # 获取状态
             publish_status = data['data'].get('publishStatus', None)
             sale_status = data['data'].get('saleStatus', None)
             
             # 如果已售出，返回特定状态码
             if sale_status == 2:
-                print(f"商品 {item_id} 已售出")
+                logger.debug('item_sold', item_id=item_id)
                 return -2  # 使用 -2 表示已售出状态
             
             return publish_status
             
         except requests.exceptions.RequestException as e:
-            print(f"请求异常: {e}")
+            self.metrics.inc('responses_total', endpoint='detail', status='error', code=type(e).__name__)
+            logger.warning('detail_request_failed', item_id=item_id, error=str(e))
             time.sleep(self.error_sleep)
             return None
         except json.JSONDecodeError as e:
-            print(f"JSON解析错误: {e}")
+            self.metrics.inc('responses_total', endpoint='detail', status=response.status_code, code='invalid_json')
+            logger.warning('detail_invalid_json', item_id=item_id, error=str(e))
             time.sleep(self.error_sleep)
             return None
         except Exception as e:
-            print(f"获取商品状态失败: {e}")
+            logger.warning('detail_fetch_failed', item_id=item_id, error=str(e))
             time.sleep(self.fatal_sleep)
             return None
 
+    def wait_for_credentials(self):
+        """所有 Cookie 都已停用时休眠，否则由其他 Cookie 继续请求"""
+        if self.credentials.healthy_count() == 0:
+            time.sleep(self.error_sleep)
+
+    def fetch_statuses(self, item_ids):
+        """按可用 Cookie 数并发获取一批商品的状态，返回 {商品ID: 状态}，失败的为 None
+
+        回放数据用完后未请求的商品不在返回结果中。
+        """
+        if not item_ids:
+            return {}
+        
+        def fetch(item_id):
+            try:
+                return self.fetch_item_status(item_id)
+            except ReplayFinished:
+                return ReplayFinished
+        
+        workers = max(1, min(self.credentials.healthy_count(), len(item_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return {
+                item_id: status
+                for item_id, status in zip(item_ids, executor.map(fetch, item_ids))
+                if status is not ReplayFinished
+            }
+
+    def write(self, statements, description):
+        """提交写任务，不等待提交完成；同一批商品的写入由写线程合并到一个事务中提交"""
+        future = self.writer.submit(statements)
+        self.pending_writes.append((future, description))
+        return future
+
+    def flush_writes(self):
+        """等待已提交的写任务全部提交，返回失败数量"""
+        failed = 0
+        with self.metrics.time('db_write_seconds', stage='batch'):
+            for future, description in self.pending_writes:
+                try:
+                    self.writer.wait(future)
+                except Exception as e:
+                    logger.warning('write_failed', description=description, error=str(e))
+                    failed += 1
+        self.pending_writes = []
+        return failed
+
     def update_item_status(self, item_id, status):
-        """更新商品状态"""
-        try:
-            self.cursor.execute('''
+        """更新商品状态，并在同一事务中记录状态变更事件"""
+        now_ms = int(time.time() * 1000)
+        self.write([
+            ('''
+                INSERT INTO listing_events (item_id, old_status, new_status, price_cents, source, event_time)
+                SELECT id, publish_status, ?, price_cents, 'status_spider', ?
+                FROM c2c_items
+                WHERE id = ? AND publish_status IS NOT ?
+            ''', (status, now_ms, item_id, status)),
+            ('''
                 UPDATE c2c_items 
                 SET publish_status = ?,
-                    last_check_time = CURRENT_TIMESTAMP
+                    last_check_ms = ?,
+                    next_check_ms = NULL,
+                    check_count = COALESCE(check_count, 0) + 1,
+                    unchanged_streak = 0
                 WHERE id = ?
-            ''', (status, item_id))
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"更新商品状态失败: {e}")
-            self.conn.rollback()
-            return False
+            ''', (status, now_ms, item_id)),
+        ], f"更新商品 {item_id} 状态")
+        return True
+
+    def update_check_time(self, item_id, interval):
+        """更新商品检查时间，并在 interval 秒后安排下次检查"""
+        now_ms = int(time.time() * 1000)
+        self.write([('''
+            UPDATE c2c_items 
+            SET last_check_ms = ?,
+                next_check_ms = ?,
+                check_count = COALESCE(check_count, 0) + 1,
+                unchanged_streak = COALESCE(unchanged_streak, 0) + 1
+            WHERE id = ?
+        ''', (now_ms, now_ms + interval * 1000, item_id))], f"更新商品 {item_id} 检查时间")
+        return True
+
+    def credit_list_sighting(self, item_id, interval):
+        """将列表爬虫最近的一次发现视为一次成功的在售检查，并在 interval 秒后安排下次检查"""
+        self.write([('''
+            UPDATE c2c_items
+            SET last_check_ms = last_seen_ms,
+                next_check_ms = last_seen_ms + ?,
+                check_count = COALESCE(check_count, 0) + 1,
+                unchanged_streak = COALESCE(unchanged_streak, 0) + 1
+            WHERE id = ?
+        ''', (interval * 1000, item_id))], f"记录商品 {item_id} 列表发现时间")
+        return True
 
-    def update_check_time(self, item_id):
-        """更新商品检查时间"""
+    def postpone_check(self, item_id):
+        """检查失败时推迟该商品，避免反复重试同一个商品"""
+        self.write([('''
+            UPDATE c2c_items
+            SET next_check_ms = ?
+            WHERE id = ?
+        ''', (int(time.time() * 1000) + self.min_check_interval * 1000, item_id))], f"推迟商品 {item_id} 检查")
+
+    def compute_check_intervals(self, item_ids, unchanged=False):
+        """计算一批商品的下次检查间隔(秒)，返回 {商品ID: 间隔}
+        
+        同SKU在售价格排名用一次窗口查询算出，只扫描本批商品所属SKU的在售商品，
+        而不是每个商品单独统计一次。unchanged 为 True 时按本次检查未变化计算。
+        """
+        if not item_ids:
+            return {}
+        id_list, id_params = queries.in_params('item_id', item_ids)
+        self.cursor.execute(queries.CHECK_INTERVAL_FACTORS.format(item_ids=id_list),
+                            {'now_ms': int(time.time() * 1000), **id_params})
+        intervals = {item_id: self.base_check_interval for item_id in item_ids}
+        for item_id, *factors in self.cursor.fetchall():
+            intervals[item_id] = self.check_interval(*factors, unchanged=unchanged)
+        return intervals
+
+    def check_interval(self, price, market_price, price_rank, age_hours, unchanged_streak, unchanged=False):
+        """根据价格排名、折扣、上架时长和连续未变化次数计算检查间隔(秒)
+        
+        同SKU最低价、远低于市场价、刚上架的商品最可能卖出，检查最频繁；
+        连续多次检查仍未变化的商品逐步降低检查频率。
+        """
+        if unchanged:
+            unchanged_streak += 1
+        
+        interval = self.base_check_interval
+        
+        # 同SKU价格排名
+        if price_rank == 1:
+            interval *= 0.25
+        elif price_rank <= 3:
+            interval *= 0.5
+        elif price_rank > 10:
+            interval *= 2
+        
+        # 相对市场价的折扣
+        if price and market_price:
+            discount = 1 - price / market_price
+            if discount >= 0.3:
+                interval *= 0.25
+            elif discount >= 0.15:
+                interval *= 0.5
+            elif discount < 0:
+                interval *= 2
+        
+        # 上架时长
+        if age_hours is not None:
+            if age_hours < 1:
+                interval *= 0.5
+            elif age_hours > 24 * 7:
+                interval *= 2
+        
+        # 历史检查结果
+        interval *= min(1 + 0.5 * unchanged_streak, 4)
+        
+        return int(min(max(interval, self.min_check_interval), self.max_check_interval))
+
+    def schedule_new_items(self):
+        """将新上架（尚未调度）的在售商品纳入调度，返回纳入数量"""
+        self.cursor.execute(queries.UNSCHEDULED_ITEMS, {'limit': self.new_items_batch})
+        new_ids = [row[0] for row in self.cursor.fetchall()]
+        
+        if not new_ids:
+            return 0
+        
         try:
-            self.cursor.execute('''
-                UPDATE c2c_items 
-                SET last_check_time = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (item_id,))
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"更新检查时间失败: {e}")
-            self.conn.rollback()
-            return False
+            intervals = self.compute_check_intervals(new_ids)
+            now_ms = int(time.time() * 1000)
+            statements = []
+            for item_id in new_ids:
+                # 新商品上架时即确认在售，从上次检查（或上架）时间起算
+                interval = intervals[item_id]
+                statements.append(('''
+                    UPDATE c2c_items
+                    SET next_check_ms = COALESCE(last_check_ms, created_ms, ?) + ?
+                    WHERE id = ?
+                ''', (now_ms, interval * 1000, item_id)))
+            self.writer.execute(statements)
+        except Exception:
+            logger.exception('schedule_new_items_error', items=len(new_ids))
+            return 0
+        return len(new_ids)
 
-    def get_active_items(self):
-        """获取需要检查的在售商品ID，优先检查未检查过的商品，然后是最早检查的商品"""
-        self.cursor.execute('''
-            WITH ranked_items AS (
-                -- 对每个SKU的商品按价格排序
-                SELECT 
-                    i.id,
-                    i.sku_id,
-                    i.price,
-                    i.last_check_time,
-                    ROW_NUMBER() OVER (PARTITION BY i.sku_id ORDER BY i.price ASC) as price_rank,
-                    CASE 
-                        WHEN i.last_check_time IS NULL THEN 1  -- 未检查过的优先级最高
-                        ELSE 2  -- 已检查过的优先级较低
-                    END as check_priority
-                FROM c2c_items i
-                WHERE i.publish_status = 1 
-                  AND (i.publish_status != -2 OR i.publish_status IS NULL)  -- 排除已售商品
-            )
-            SELECT 
-                id,
-                sku_id,
-                price,
-                last_check_time
-            FROM ranked_items
-            ORDER BY 
-                check_priority ASC,  -- 优先检查未检查过的
-                CASE 
-                    WHEN check_priority = 1 THEN price_rank  -- 未检查过的按价格排序
-                    ELSE last_check_time  -- 已检查过的按最后检查时间排序
-                END ASC
-        ''')
-        return [(row[0], row[1], row[2]) for row in self.cursor.fetchall()]
+    def get_due_items(self, limit):
+        """按下次检查时间取出到期的在售商品
+        
+        合并了重新上架的商品按最新的商品ID（listing_id）请求详情。
+        """
+        now_ms = int(time.time() * 1000)
+        self.cursor.execute(queries.DUE_ITEMS, {
+            'seen_since': now_ms - self.sighting_window * 1000,
+            'now_ms': now_ms,
+            'limit': limit
+        })
+        return self.cursor.fetchall()
+
+    def update_backlog(self):
+        """每 backlog_interval 秒统计一次已到期尚未检查的在售商品数，供 /metrics 输出"""
+        if time.time() - self.backlog_checked_at < self.backlog_interval:
+            return
+        self.backlog_checked_at = time.time()
+        try:
+            self.cursor.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM c2c_items
+                    WHERE publish_status = 1 AND next_check_ms <= ?
+                    LIMIT ?
+                )
+            ''', (int(time.time() * 1000), self.backlog_cap))
+            self.metrics.set('status_backlog', self.cursor.fetchone()[0])
+        except sqlite3.Error as e:
+            logger.warning('backlog_count_failed', error=str(e))
 
     def check_suspicious_users(self):
         """检查并自动将可疑用户加入黑名单"""
         try:
-            cursor = self.cursor
+            # 按字段名读取查询结果
+            cursor = self.conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
             # 查找可疑用户
-            cursor.execute("""
-                WITH user_stats AS (
-                    SELECT 
-                        c.uid,
-                        c.uname,
-                        c.sku_id,
-                        COUNT(*) as listing_count,
-                        MIN(c.created_at) as first_listing,
-                        MAX(c.created_at) as last_listing
-                    FROM c2c_items c
-                    WHERE c.created_at >= datetime('now', '-1 hour')
-                    GROUP BY c.uid, c.uname, c.sku_id
-                    HAVING listing_count >= ?
-                )
-                SELECT 
-                    us.*,
-                    s.name as sku_name
-                FROM user_stats us
-                JOIN skus s ON us.sku_id = s.sku_id
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM blacklist b 
-                    WHERE b.uid = us.uid
-                )
-            """, (self.suspicious_threshold,))
+            cursor.execute(queries.SUSPICIOUS_USERS_1H, {
+                'since_1h': int((time.time() - 3600) * 1000),
+                'threshold': self.suspicious_threshold
+            })
             
             suspicious_users = cursor.fetchall()
             
-            for user in suspicious_users:
+            # 每个用户单独一个写任务，已在黑名单中的用户不影响其他用户
+            futures = [
+                self.writer.submit([("""
+                    INSERT INTO blacklist (uid, uname, reason)
+                    VALUES (?, ?, ?)
+                """, (
+                    user['uid'],
+                    user['uname'],
+                    f"自动加入黑名单：1小时内对商品 {user['sku_name']} 上架 {user['listing_count']} 次"
+                ))])
+                for user in suspicious_users
+            ]
+            
+            for user, future in zip(suspicious_users, futures):
                 try:
                     # 添加到黑名单
-                    cursor.execute("""
-                        INSERT INTO blacklist (uid, uname, reason)
-                        VALUES (?, ?, ?)
-                    """, (
-                        user['uid'],
-                        user['uname'],
-                        f"自动加入黑名单：1小时内对商品 {user['sku_name']} 上架 {user['listing_count']} 次"
-                    ))
+                    self.writer.wait(future)
                     
                     print(f"用户 {user['uname']}(UID:{user['uid']}) 已自动加入黑名单")
                     print(f"原因：1小时内对商品 {user['sku_name']} 上架 {user['listing_count']} 次")
@@ -211,109 +383,225 @@ class BiliMallStatusSpider:
                     # 用户已在黑名单中，忽略
                     pass
                 
-            self.conn.commit()
+        except Exception:
+            logger.exception('suspicious_check_error')
+
+    def compact_listing_events(self):
+        """将超过保留期的状态变更事件汇总到按天统计表后删除，分批执行以缩短锁占用"""
+        cutoff = int((time.time() - self.event_retention_days * 86400) * 1000)
+        total_compacted = 0
+        try:
+            while True:
+                self.cursor.execute(queries.COMPACT_EVENTS_BATCH, {
+                    'compact_cutoff': cutoff,
+                    'limit': self.event_compact_batch
+                })
+                max_id = self.cursor.fetchone()[0]
+                if max_id is None:
+                    break
+                
+                results = self.writer.execute([('''
+                    INSERT INTO listing_event_daily (day, new_status, source, event_count)
+                    SELECT
+                        date(event_time / 1000, 'unixepoch', '+8 hours') as day,
+                        new_status,
+                        source,
+                        COUNT(*)
+                    FROM listing_events
+                    WHERE event_time < ? AND id <= ?
+                    GROUP BY day, new_status, source
+                    ON CONFLICT(day, new_status, source)
+                    DO UPDATE SET event_count = event_count + excluded.event_count
+                ''', (cutoff, max_id)), ('''
+                    DELETE FROM listing_events
+                    WHERE event_time < ? AND id <= ?
+                ''', (cutoff, max_id))])
+                total_compacted += results[1]['rowcount']
             
-        except Exception as e:
-            print(f"检查可疑用户时出错: {e}")
-            self.conn.rollback()
+            if total_compacted:
+                print(f"已压缩 {total_compacted} 条超过 {self.event_retention_days} 天的状态变更事件")
+        
+        except Exception:
+            logger.exception('event_compaction_error', retention_days=self.event_retention_days)
+
+    def archive_settled_items(self):
+        """把已售出/已下架超过 archive_after_days 天的商品移到归档表，分批执行以缩短锁占用
+        
+        c2c_items 只保留在售和最近结束的商品，大小不随运行时间增长；历史查询使用 c2c_items_history 视图。
+        """
+        cutoff = int((time.time() - self.archive_after_days * 86400) * 1000)
+        total_archived = 0
+        copy_columns = self.archive_columns
+        try:
+            while True:
+                self.cursor.execute(queries.SETTLED_ITEMS, {
+                    'archive_cutoff': cutoff,
+                    'limit': self.archive_batch
+                })
+                item_ids = [row[0] for row in self.cursor.fetchall()]
+                if not item_ids:
+                    break
+                
+                placeholders = ','.join('?' * len(item_ids))
+                results = self.writer.execute([
+                    (f'''
+                        INSERT OR REPLACE INTO c2c_items_archive ({copy_columns}, archived_ms)
+                        SELECT {copy_columns}, ? FROM c2c_items
+                        WHERE id IN ({placeholders})
+                    ''', [int(time.time() * 1000)] + item_ids),
+                    (f"DELETE FROM c2c_items WHERE id IN ({placeholders})", item_ids),
+                ])
+                total_archived += results[1]['rowcount']
+            
+            if total_archived:
+                print(f"已归档 {total_archived} 个结束超过 {self.archive_after_days} 天的商品")
+        
+        except Exception:
+            logger.exception('archive_error', archive_after_days=self.archive_after_days)
 
     def run(self):
-        """运行状态更新爬虫"""
+        """持续运行状态更新爬虫，不断取出到期商品进行检查"""
+        round_start = datetime.now()
+        checked_count = 0
+        updated_count = 0
+        status_changed = 0
+        failed_count = 0
+        sighting_count = 0
+        error_count = 0
+        current_retry_sleep = self.error_sleep  # 当前重试休眠时间
+        
+        self.credentials.set_interval(self.min_sleep, self.max_sleep)
+        print("\n=== 开始状态更新（按优先级调度） ===")
+        print(f"Cookie 数: {len(self.credentials)}")
+        
         while True:  # 持续运行
-            print("\n=== 开始新一轮状态更新 ===")
-            start_time = datetime.now()
+            # 每隔 round_sleep 秒输出统计并检查可疑用户
+            if (datetime.now() - round_start).total_seconds() >= self.round_sleep:
+                print("\n=== 本轮更新完成 ===")
+                print(f"总计处理商品: {checked_count}")
+                print(f"成功更新状态: {updated_count}")
+                print(f"状态发生变化: {status_changed}")
+                print(f"处理失败数量: {failed_count}")
+                print(f"列表发现跳过: {sighting_count}")
+                print(f"耗时: {datetime.now() - round_start}")
+                self.credentials.print_stats()
+                self.writer.print_stats()
+                
+                print("\n=== 检查可疑用户 ===")
+                self.check_suspicious_users()
+                self.compact_listing_events()
+                self.archive_settled_items()
+                
+                round_start = datetime.now()
+                checked_count = updated_count = status_changed = failed_count = sighting_count = 0
             
-            # 获取所有在售商品
-            items = self.get_active_items()
-            total_items = len(items)
-            updated_count = 0
-            status_changed = 0
-            error_count = 0
-            current_retry_sleep = self.error_sleep  # 当前重试休眠时间
+            new_count = self.schedule_new_items()
+            if new_count:
+                logger.info('items_scheduled', count=new_count)
+            self.update_backlog()
             
-            print(f"找到 {total_items} 个在售商品，按SKU分组并优先检查最低价商品")
+            # 每批商品数随可用 Cookie 数增加，整体吞吐随 Cookie 数线性增长
+            items = self.get_due_items(self.batch_size * max(1, self.credentials.healthy_count()))
+            if not items:
+                time.sleep(self.idle_sleep)
+                continue
             
-            # 按批次处理商品
-            for i in range(0, len(items), self.batch_size):
-                batch_items = items[i:i + self.batch_size]
-                print(f"\n处理批次 {i//self.batch_size + 1}/{(total_items + self.batch_size - 1)//self.batch_size}")
-                
-                for idx, (item_id, sku_id, price) in enumerate(batch_items, i + 1):
-                    try:
-                        # 获取商品的最后检查时间
-                        self.cursor.execute('''
-                            SELECT last_check_time 
-                            FROM c2c_items 
-                            WHERE id = ?
-                        ''', (item_id,))
-                        result = self.cursor.fetchone()
-                        last_check = result[0] if result else None
-                        check_status = "从未检查" if last_check is None else f"上次检查: {last_check}"
-                        
-                        print(f"\n处理商品 {idx}/{total_items} (ID: {item_id}, SKU: {sku_id}, 价格: ¥{price:.2f}, {check_status})")
-                        status = self.fetch_item_status(item_id)
-                        
-                        if status is not None:
-                            if status != 1:  # 状态发生变化
-                                if self.update_item_status(item_id, status):
-                                    status_changed += 1
-                                    print(f"商品 {item_id} 状态已更新: {'在售' if status == 1 else '已下架'}")
-                            else:  # 状态未变化，仍为在售状态
-                                self.update_check_time(item_id)
-                            updated_count += 1
-                            error_count = 0  # 重置错误计数
-                            current_retry_sleep = self.error_sleep  # 重置重试时间
-                        else:
-                            error_count += 1
-                            print(f"获取商品 {item_id} 状态失败")
-                        
-                        # 如果连续错误过多，增加休眠时间
-                        if error_count >= 3:
-                            print(f"连续出错 {error_count} 次，休眠 {current_retry_sleep} 秒...")
-                            time.sleep(current_retry_sleep)
-                            # 计算下一次重试时间
-                            current_retry_sleep = min(
-                                current_retry_sleep * self.retry_multiplier,
-                                self.max_retry_sleep
-                            )
-                            print(f"下次重试休眠时间将增加到: {current_retry_sleep} 秒")
-                            error_count = 0
-                        
-                    except Exception as e:
-                        print(f"处理商品 {item_id} 时出错: {e}")
+            logger.info('batch_due', items=len(items))
+            # 列表爬虫未见过的商品并发请求详情
+            statuses = self.fetch_statuses([item[5] for item in items if not item[4]])
+            # 仍在售的商品的下次检查间隔，整批一次计算
+            try:
+                intervals = self.compute_check_intervals([item[0] for item in items], unchanged=True)
+            except sqlite3.Error as e:
+                logger.warning('check_interval_failed', error=str(e))
+                intervals = {}
+            batch_start = updated_count + sighting_count
+            
+            for item_id, sku_id, price, last_check, recently_seen, listing_id in items:
+                try:
+                    # 列表爬虫刚见过该商品，说明仍在售，无需请求详情
+                    if recently_seen:
+                        if self.credit_list_sighting(item_id, intervals.get(item_id, self.base_check_interval)):
+                            sighting_count += 1
+                            self.metrics.inc('items_total', result='list_sighting')
+                        continue
+                    
+                    if listing_id not in statuses:  # 回放数据已用完
+                        continue
+                    
+                    checked_count += 1
+                    status = statuses.get(listing_id)
+                    logger.debug('item_checked', item_id=item_id, sku_id=sku_id, price=price,
+                                 last_check=last_check, status=status)
+                    
+                    if status is not None:
+                        if status != 1:  # 状态发生变化
+                            if self.update_item_status(item_id, status):
+                                status_changed += 1
+                                self.metrics.inc('items_total', result='sold' if status == -2 else 'delisted')
+                        else:  # 状态未变化，仍为在售状态
+                            self.update_check_time(item_id, intervals.get(item_id, self.base_check_interval))
+                            self.metrics.inc('items_total', result='unchanged')
+                        updated_count += 1
+                        error_count = 0  # 重置错误计数
+                        current_retry_sleep = self.error_sleep  # 重置重试时间
+                    else:
                         error_count += 1
+                        failed_count += 1
+                        self.postpone_check(item_id)
+                        self.metrics.inc('items_total', result='fetch_failed')
+                    
+                    # 如果连续错误过多，增加休眠时间
+                    if error_count >= 3:
+                        logger.warning('consecutive_errors', errors=error_count, sleep=current_retry_sleep)
                         time.sleep(current_retry_sleep)
                         # 计算下一次重试时间
                         current_retry_sleep = min(
                             current_retry_sleep * self.retry_multiplier,
                             self.max_retry_sleep
                         )
-                        continue
+                        error_count = 0
                 
-                # 每批次处理完后休息
-                if i + self.batch_size < total_items:
-                    print(f"批次处理完成，休息 {self.batch_sleep} 秒...")
-                    time.sleep(self.batch_sleep)
-
-            end_time = datetime.now()
-            duration = end_time - start_time
+                except Exception as e:
+                    logger.warning('item_check_failed', item_id=item_id, error=str(e))
+                    self.metrics.inc('items_total', result='error')
+                    error_count += 1
+                    failed_count += 1
+                    self.postpone_check(item_id)
+                    time.sleep(current_retry_sleep)
+                    # 计算下一次重试时间
+                    current_retry_sleep = min(
+                        current_retry_sleep * self.retry_multiplier,
+                        self.max_retry_sleep
+                    )
+                    continue
+            
+            # 本批有商品检查成功时记录心跳：/readyz 据此判断状态爬虫是否停滞
+            if updated_count + sighting_count > batch_start:
+                self.write([heartbeat.heartbeat(heartbeat.STATUS_CHECK, due=len(items),
+                                                checked=updated_count + sighting_count - batch_start)], "记录心跳")
             
-            print("\n=== 本轮更新完成 ===")
-            print(f"总计处理商品: {total_items}")
-            print(f"成功更新状态: {updated_count}")
-            print(f"状态发生变化: {status_changed}")
-            print(f"处理失败数量: {total_items - updated_count}")
-            print(f"耗时: {duration}")
+            # 等待本批写入提交，下次取到期商品时能看到新的检查时间
+            if self.flush_writes() == 0 and updated_count + sighting_count > batch_start:
+                metrics.mark_success(self.metrics)
             
-            print(f"\n等待{self.round_sleep}秒（{self.round_sleep/60:.1f}分钟）后开始下一轮...")
-            time.sleep(self.round_sleep)
+            if self.session.finished:
+                print("\n回放数据已用完，停止状态更新")
+                print(f"总计处理商品: {checked_count}，状态发生变化: {status_changed}，处理失败: {failed_count}")
+                return
             
-            # 在每轮结束时检查可疑用户
-            print("\n=== 检查可疑用户 ===")
-            self.check_suspicious_users()
+            # 每批次处理完后休息（整批均由列表发现跳过时无需休息）
+            if not all(item[4] for item in items):
+                print(f"批次处理完成，休息 {self.batch_sleep} 秒...")
+                time.sleep(self.batch_sleep)
 
     def close(self):
-        """关闭数据库连接"""
+        """关闭数据库连接和HTTP会话"""
+        if hasattr(self, 'session') and self.session:
+            self.session.close()
+        if hasattr(self, 'writer') and self.writer:
+            self.flush_writes()
+            self.writer.close()
         if hasattr(self, 'cursor') and self.cursor:
             self.cursor.close()
         if hasattr(self, 'conn') and self.conn:
@@ -321,17 +609,41 @@ class BiliMallStatusSpider:
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='B站商城商品状态更新爬虫')
-    parser.add_argument('--cookie', type=str, required=True, help='浏览器Cookie字符串')
-    parser.add_argument('--min-sleep', type=float, default=1, help='最小休眠时间(秒)，默认1秒')
-    parser.add_argument('--max-sleep', type=float, default=3, help='最大休眠时间(秒)，默认3秒')
+    parser.add_argument('--cookie', type=str, help='浏览器Cookie字符串')
+    parser.add_argument('--cookie-file', type=str, help='Cookie文件，每行一个Cookie，请求分散到各个Cookie上')
+    parser.add_argument('--bench-seconds', type=int, default=300, help='Cookie连续异常时的首次停用时长(秒)，默认300秒')
+    parser.add_argument('--base-url', type=str, default='https://mall.bilibili.com', help='接口地址，可指向本地模拟服务 scripts/fake_mall_server.py')
+    parser.add_argument('--record', type=str, metavar='DIR', help='把接口请求和响应录制到该目录（gzip 分段文件）')
+    parser.add_argument('--replay', type=str, metavar='DIR', help='从该目录回放录制的响应，不访问网络')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='回放速度：1 按录制时的间隔，2 为两倍速，0 为尽可能快，默认1')
+    parser.add_argument('--min-sleep', type=float, default=1, help='每个Cookie的最小请求间隔(秒)，默认1秒')
+    parser.add_argument('--max-sleep', type=float, default=3, help='每个Cookie的最大请求间隔(秒)，默认3秒')
     parser.add_argument('--error-sleep', type=int, default=30, help='错误重试休眠时间(秒)，默认30秒')
     parser.add_argument('--fatal-sleep', type=int, default=60, help='严重错误休眠时间(秒)，默认60秒')
-    parser.add_argument('--round-sleep', type=int, default=1800, help='每轮结束后的休眠时间(秒)，默认1800秒')
+    parser.add_argument('--round-sleep', type=int, default=1800, help='统计输出及可疑用户检查的间隔(秒)，默认1800秒')
+    parser.add_argument('--base-check-interval', type=int, default=1800, help='基础检查间隔(秒)，默认1800秒')
+    parser.add_argument('--min-check-interval', type=int, default=60, help='最短检查间隔(秒)，默认60秒')
+    parser.add_argument('--max-check-interval', type=int, default=86400, help='最长检查间隔(秒)，默认86400秒')
+    parser.add_argument('--sighting-window', type=int, default=600, help='列表爬虫在此时间(秒)内见过的商品视为已检查，默认600秒')
+    parser.add_argument('--event-retention-days', type=int, default=30, help='状态变更事件保留天数，默认30天')
+    parser.add_argument('--archive-after-days', type=float, default=7, help='已售出/已下架超过此天数的商品移到归档表，不应小于1天（统计接口查询最近24小时），默认7天')
+    parser.add_argument('--writer-socket', type=str, help='写服务的 Unix socket 路径（python -m spider.db_writer），默认读取环境变量 BMALL_WRITER_SOCKET，都未设置时在本进程内写入')
     parser.add_argument('--max-retry-sleep', type=int, default=7200, help='最大重试休眠时间(秒)，默认7200秒')
     parser.add_argument('--retry-multiplier', type=float, default=2.0, help='重试时间翻倍系数，默认2.0')
+    parser.add_argument('--metrics-port', type=int, default=0, help='在该端口提供 Prometheus 格式的 /metrics，默认0不提供')
+    parser.add_argument('--log-level', type=str.upper, choices=log.LEVELS, default=log.DEFAULT_LEVEL, help='日志级别，DEBUG 时输出逐个商品的处理过程，默认读取环境变量 BMALL_LOG_LEVEL，未设置时为 INFO')
     args = parser.parse_args()
+    if not args.cookie and not args.cookie_file and not args.replay:
+        parser.error('需要提供 --cookie 或 --cookie-file')
+    if args.record and args.replay:
+        parser.error('--record 和 --replay 不能同时使用')
 
-    spider = BiliMallStatusSpider(cookie=args.cookie)
+    log.setup(args.log_level)
+    credentials = CredentialPool.from_file(args.cookie_file) if args.cookie_file else CredentialPool([args.cookie])
+    credentials.bench_seconds = args.bench_seconds
+    spider = BiliMallStatusSpider(credentials=credentials, writer_socket=args.writer_socket)
+    if args.metrics_port:
+        metrics.serve(spider.metrics, args.metrics_port)
     spider.min_sleep = args.min_sleep
     spider.max_sleep = args.max_sleep
     spider.error_sleep = args.error_sleep
@@ -339,6 +651,21 @@ if __name__ == "__main__":
     spider.round_sleep = args.round_sleep
     spider.max_retry_sleep = args.max_retry_sleep
     spider.retry_multiplier = args.retry_multiplier
+    spider.base_check_interval = args.base_check_interval
+    spider.min_check_interval = args.min_check_interval
+    spider.max_check_interval = args.max_check_interval
+    spider.event_retention_days = args.event_retention_days
+    spider.archive_after_days = args.archive_after_days
+    spider.sighting_window = args.sighting_window
+    spider.url = spider.url.replace('https://mall.bilibili.com', args.base_url.rstrip('/'))
+    if args.record:
+        spider.session = LiveSession(TrafficRecorder(args.record))
+    if args.replay:
+        # 回放时由回放会话控制节奏，关闭爬虫自身的等待
+        spider.session = ReplaySession(args.replay, speed=args.replay_speed)
+        spider.min_sleep = spider.max_sleep = 0
+        spider.error_sleep = spider.fatal_sleep = 0
+        spider.batch_sleep = 0
     
     try:
         spider.run()